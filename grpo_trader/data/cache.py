@@ -0,0 +1,86 @@
+import json
+import os
+import re
+import pandas as pd
+
+OHLCV_COLUMNS = ['date', 'open', 'high', 'low', 'close', 'volume']
+DEFAULT_CACHE_DIR = os.environ.get("GRPO_TRADER_CACHE_DIR", os.path.expanduser("~/.cache/grpo_trader/ohlcv"))
+# Parquet schema metadata key holding the earliest timestamp a full download asked for
+COVERAGE_KEY = b"grpo_trader.coverage_start"
+
+def period_start(period, end):
+    """
+    Start timestamp of a yfinance style period ("5d", "1wk", "1mo", "1y", "ytd", "max") ending at end.
+    Returns None for "max".
+    """
+    if period == "max":
+        return None
+    if period == "ytd":
+        return end.normalize().replace(month=1, day=1)
+    match = re.fullmatch(r"(\d+)(d|wk|mo|y)", period)
+    if match is None:
+        raise ValueError(f"Unsupported period: {period!r}")
+    n, unit = int(match.group(1)), match.group(2)
+    offset = {
+        'd': pd.DateOffset(days=n),
+        'wk': pd.DateOffset(weeks=n),
+        'mo': pd.DateOffset(months=n),
+        'y': pd.DateOffset(years=n),
+    }[unit]
+    return end - offset
+
+class OHLCVCache:
+    """
+    On-disk OHLCV store, one Parquet file per ticker and interval:
+        <root>/<ticker>/<interval>.parquet
+    holding the bars (date, open, high, low, close, volume) sorted by date, plus the start of the
+    widest period downloaded so far, so a later request for a longer period knows it must backfill.
+    Writes go to a temporary file first and are renamed into place.
+    """
+    def __init__(self, root=DEFAULT_CACHE_DIR):
+        self.root = root
+
+    def path(self, ticker, interval):
+        return os.path.join(self.root, ticker, f"{interval}.parquet")
+
+    def read(self, ticker, interval):
+        """
+        Returns (bars, coverage_start), or (None, None) if nothing is cached.
+        coverage_start is None when the whole history ("max") was downloaded.
+        """
+        import pyarrow.parquet as pq
+
+        path = self.path(ticker, interval)
+        if not os.path.exists(path):
+            return None, None
+        table = pq.read_table(path)
+        coverage = json.loads((table.schema.metadata or {}).get(COVERAGE_KEY, b"null"))
+        return table.to_pandas(), pd.Timestamp(coverage) if coverage is not None else None
+
+    def write(self, ticker, interval, bars, coverage_start):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        path = self.path(ticker, interval)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        table = pa.Table.from_pandas(bars[OHLCV_COLUMNS].reset_index(drop=True), preserve_index=False)
+        coverage = coverage_start.isoformat() if coverage_start is not None else None
+        metadata = {**(table.schema.metadata or {}), COVERAGE_KEY: json.dumps(coverage).encode()}
+        tmp_path = path + ".tmp"
+        pq.write_table(table.replace_schema_metadata(metadata), tmp_path)
+        os.replace(tmp_path, path)
+
+    def update(self, ticker, interval, bars, coverage_start):
+        """
+        Merges newly downloaded bars into the cache and returns the merged bars.
+        A bar already cached is replaced by its new version (the last bar may have been incomplete).
+        """
+        cached, cached_coverage = self.read(ticker, interval)
+        if cached is not None:
+            bars = pd.concat([cached, bars[OHLCV_COLUMNS]], ignore_index=True)
+            bars = bars.drop_duplicates(subset='date', keep='last')
+            if coverage_start is not None:
+                coverage_start = min(coverage_start, cached_coverage) if cached_coverage is not None else None
+        bars = bars.sort_values('date').reset_index(drop=True)
+        self.write(ticker, interval, bars, coverage_start)
+        return bars
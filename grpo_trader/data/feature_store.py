@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from grpo_trader.data.cache import DEFAULT_CACHE_DIR
+from grpo_trader.data.processor import PROMPT_COLUMNS, build_prompt
+
+META_FILE = "meta.json"
+TIMESTAMPS_FILE = "timestamps.npy"
+
+class FeatureTable:
+    """
+    The features of one ticker and interval, memory-mapped read-only: a sorted int64 timestamp
+    index (ns since the epoch, UTC) and one float array per column. Slices are views of the
+    mapped files, so windows are zero-copy and every process reading the table shares the OS
+    page cache.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.timestamps = np.load(os.path.join(path, TIMESTAMPS_FILE), mmap_mode='r')
+        self.columns = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r') for name in self.meta['columns']
+        }
+        self.tz = self.meta['tz']
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def index_of(self, timestamp, side="left"):
+        """Row of the first bar at or after timestamp (side="right": strictly after)."""
+        timestamp = pd.Timestamp(timestamp)
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.tz_localize(self.tz or "UTC")
+        return int(np.searchsorted(self.timestamps, timestamp.value, side=side))
+
+    def window(self, start, stop):
+        """Views of every column over rows [start, stop)."""
+        return {name: values[start:stop] for name, values in self.columns.items()}
+
+    def date(self, row):
+        date = pd.Timestamp(int(self.timestamps[row]), tz="UTC")
+        return date.tz_convert(self.tz) if self.tz else date.tz_localize(None)
+
+    def to_frame(self, start=0, stop=None):
+        """Copy of rows [start, stop) as a DataFrame with a date column, like fetch_crypto_data."""
+        dates = pd.to_datetime(np.asarray(self.timestamps[start:stop]), utc=True)
+        dates = dates.tz_convert(self.tz) if self.tz else dates.tz_localize(None)
+        frame = {'date': dates}
+        frame.update((name, np.asarray(values[start:stop])) for name, values in self.columns.items())
+        return pd.DataFrame(frame)
+
+class FeatureStore:
+    """
+    Computed features persisted as memory-mapped column arrays, one directory per ticker and
+    interval:
+        <root>/<ticker>/<interval>/timestamps.npy   int64 ns since the epoch (UTC), sorted
+        <root>/<ticker>/<interval>/<column>.npy     one array per feature column
+        <root>/<ticker>/<interval>/meta.json        columns, dtypes, row count, timezone
+    The columns the prompts and rewards read are kept in float64, so they come out exactly as
+    from the DataFrame (float32 has about 7 significant digits: at BTC prices that moves the
+    second decimal). The other columns are stored in dtype, float32 by default.
+    A write builds the new directory next to the old one and swaps it in, so readers never see a
+    partial table (processes that mapped the old files keep reading them until they reopen).
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, ticker, interval):
+        return os.path.join(self.root, ticker, interval)
+
+    def exists(self, ticker, interval):
+        return os.path.exists(os.path.join(self.path(ticker, interval), META_FILE))
+
+    def tickers(self, interval):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(ticker for ticker in os.listdir(self.root) if self.exists(ticker, interval))
+
+    def write(self, ticker, interval, df, columns=None, dtype=np.float32, float64_columns=PROMPT_COLUMNS):
+        """
+        Stores the numeric columns of df (default: all but date) and its date column as the index,
+        float64_columns in float64 and the others in dtype.
+        """
+        columns = columns if columns is not None else [
+            name for name in df.columns if name != 'date' and pd.api.types.is_numeric_dtype(df[name])
+        ]
+        dates = pd.DatetimeIndex(df['date'])
+        if not dates.is_monotonic_increasing:
+            raise ValueError("Feature rows must be sorted by date")
+        tz = str(dates.tz) if dates.tz is not None else None
+        timestamps = (dates.tz_convert("UTC") if tz else dates).as_unit("ns").asi8
+
+        path = self.path(ticker, interval)
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, TIMESTAMPS_FILE), timestamps)
+        dtypes = {name: np.dtype(np.float64 if name in float64_columns else dtype).name for name in columns}
+        for name in columns:
+            np.save(os.path.join(tmp_path, f"{name}.npy"), df[name].to_numpy(dtype=dtypes[name]))
+        meta = {'columns': columns, 'dtypes': dtypes, 'num_rows': len(df), 'tz': tz}
+        with open(os.path.join(tmp_path, META_FILE), "w") as f:
+            json.dump(meta, f, indent=2)
+
+        old_path = path + ".old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    def open(self, ticker, interval):
+        if not self.exists(ticker, interval):
+            raise FileNotFoundError(f"No {interval} features for {ticker} in {self.root}")
+        return FeatureTable(self.path(ticker, interval))
+
+class WindowDataset:
+    """
+    CryptoDataset over a FeatureStore: the same items (prompt of window_size bars, current and
+    next close, index), for one or several tickers, read from the memory-mapped columns instead
+    of DataFrame slices.
+
+    split=(begin, end) keeps that fraction of every ticker's rows (e.g. (0.0, 0.8) and (0.8, 1.0)
+    like split_data). Items are numbered ticker after ticker. The tables are opened lazily in
+    each process, so DataLoader workers map the files themselves instead of receiving copies.
+    """
+    def __init__(self, store, tickers, interval="1h", window_size=10, split=(0.0, 1.0)):
+        self.store = store
+        self.tickers = [tickers] if isinstance(tickers, str) else list(tickers)
+        self.interval = interval
+        self.window_size = window_size
+        self.split = split
+        self._tables = None
+        # Row range of every ticker and the number of windows in it
+        self.row_ranges = []
+        counts = []
+        for ticker in self.tickers:
+            num_rows = self._table(ticker).meta['num_rows']
+            start, stop = int(num_rows * split[0]), int(num_rows * split[1])
+            self.row_ranges.append((start, stop))
+            counts.append(max(stop - start - window_size - 1, 0))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def _table(self, ticker):
+        if self._tables is None:
+            self._tables = {}
+        if ticker not in self._tables:
+            self._tables[ticker] = self.store.open(ticker, self.interval)
+        return self._tables[ticker]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_tables'] = None
+        return state
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, idx):
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        which = int(np.searchsorted(self.offsets, idx, side='right')) - 1
+        table = self._table(self.tickers[which])
+        start = self.row_ranges[which][0] + idx - int(self.offsets[which])
+        stop = start + self.window_size
+        window = table.window(start, stop)
+
+        history = []
+        for i in range(self.window_size):
+            row = {name: values[i] for name, values in window.items()}
+            history.append((str(table.date(start + i)), row))
+        close = table.columns['close']
+        return {
+            "index": idx,
+            "prompt": build_prompt(history, history[-1][1]),
+            "current_price": float(close[stop - 1]),
+            "next_price": float(close[stop])
+        }
+
+def build_feature_store(root, tickers, period="1y", interval="1h", cache_dir=DEFAULT_CACHE_DIR, offline=False,
+                        source=None):
+    """Fetches the bars of every ticker, computes the features and writes them to the store."""
+    from grpo_trader.data.loader import fetch_crypto_data
+
+    store = FeatureStore(root)
+    for ticker in tickers:
+        df = fetch_crypto_data(ticker, period, interval, cache_dir=cache_dir, offline=offline, source=source)
+        store.write(ticker, interval, df)
+        print(f"Stored {len(df)} rows of {ticker} ({interval}) in {store.path(ticker, interval)}")
+    return store
+
+if __name__ == "__main__":
+    from grpo_trader.data.sources import source_from_spec
+
+    parser = argparse.ArgumentParser(description="Build the memory-mapped feature store")
+    parser.add_argument("--root", type=str, required=True, help="Feature store directory")
+    parser.add_argument("--tickers", type=str, nargs="+", default=["BTC-USD"])
+    parser.add_argument("--period", type=str, default="1y")
+    parser.add_argument("--interval", type=str, default="1h")
+    parser.add_argument("--data_source", type=source_from_spec, default=None,
+                        help="yfinance (default), files:<dir> or synthetic[:num_bars=N,seed=S]")
+    parser.add_argument("--data_cache_dir", type=str, default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--offline", action="store_true", help="Read the market data from the local cache only")
+    args = parser.parse_args()
+
+    build_feature_store(
+        args.root, args.tickers, args.period, args.interval,
+        cache_dir=args.data_cache_dir, offline=args.offline, source=args.data_source
+    )
@@ -0,0 +1,334 @@
+import math
+import numpy as np
+import pandas as pd
+
+INDICATOR_COLUMNS = [
+    'returns', 'sma_5', 'sma_20', 'volatility', 'rsi', 'macd', 'macd_signal', 'bb_upper', 'bb_lower', 'volume_sma'
+]
+
+def rolling_mean(x, window, csum=None):
+    """
+    Mean of the last window values of x (NaN for the first window - 1), from its cumulative sum
+    csum (computed if not given, pass it to share it between windows). Like pandas, windows
+    holding a NaN are NaN.
+    """
+    if len(x) < window:
+        return np.full(len(x), np.nan)
+    missing = np.isnan(x)
+    if missing.any():
+        out = rolling_mean(np.where(missing, 0.0, x), window)
+        out[rolling_mean(missing.astype(np.float64), window) > 0] = np.nan
+        return out
+    csum = np.cumsum(x) if csum is None else csum
+    out = np.empty(len(x))
+    out[:window - 1] = np.nan
+    out[window - 1] = csum[window - 1]
+    np.subtract(csum[window:], csum[:-window], out=out[window:])
+    out[window - 1:] /= window
+    return out
+
+def rolling_std(x, window, mean=None, chunk_size=1 << 15):
+    """
+    Sample standard deviation (ddof=1) of the last window values of x, given their rolling mean.
+
+    Two-pass: the squared deviations from each window's mean are summed lag by lag, instead of
+    taking the cumulative sum of squares, which loses all precision on long series of large
+    prices. The window passes run chunk by chunk so they stay in cache.
+    """
+    n = len(x)
+    out = np.full(n, np.nan)
+    if n < window:
+        return out
+    mean = rolling_mean(x, window) if mean is None else mean
+    deviation = np.empty(min(chunk_size, n))
+    # Chunks of window end positions t, covering x[t - window + 1:t + 1]
+    for start in range(window - 1, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        centre = mean[start:stop]
+        sq_sum = out[start:stop]
+        sq_sum[:] = 0
+        dev = deviation[:stop - start]
+        for lag in range(window):
+            np.subtract(x[start - lag:stop - lag], centre, out=dev)
+            np.multiply(dev, dev, out=dev)
+            sq_sum += dev
+        sq_sum /= window - 1
+        np.sqrt(sq_sum, out=sq_sum)
+    return out
+
+def linear_recurrence(values, decay, initial, block=64):
+    """
+    y[t] = decay * y[t-1] + values[t] with y[-1] = initial, vectorised.
+
+    Inside blocks of `block` values the recursion is a product with a lower triangular matrix of
+    decay weights (one matmul for all blocks, from a zero state). The states carried between
+    blocks follow the same recursion over the block ends, with decay^block, solved recursively.
+    """
+    n = len(values)
+    num_blocks = -(-n // block)
+    padded = np.zeros(num_blocks * block)
+    padded[:n] = values
+    lags = np.arange(block)
+    # weights[t, j] = decay^(t - j) for j <= t
+    weights = np.tril(decay ** np.maximum(lags[:, None] - lags[None, :], 0))
+    local = padded.reshape(num_blocks, block) @ weights.T
+    # Weight of the state entering a block at each position of the block
+    carry_decay = decay ** (lags + 1)
+
+    carry = np.empty(num_blocks)
+    carry[0] = initial
+    if num_blocks > 1:
+        carry[1:] = linear_recurrence(local[:-1, -1], carry_decay[-1], initial, block)
+    local += carry[:, None] * carry_decay[None, :]
+    return local.reshape(-1)[:n]
+
+def ewm_mean(x, span):
+    """
+    Exponential moving average y[t] = (1 - alpha) y[t-1] + alpha x[t], y[0] = x[0], with
+    alpha = 2 / (span + 1) (pandas ewm(span, adjust=False)).
+    """
+    if len(x) == 0:
+        return np.empty(0)
+    alpha = 2.0 / (span + 1)
+    return linear_recurrence(alpha * np.asarray(x, dtype=np.float64), 1.0 - alpha, x[0])
+
+def compute_indicators(close, volume):
+    """
+    The technical indicators of fetch_crypto_data from close and volume arrays, in one pass
+    over contiguous float64 arrays. Returns a dict of arrays named as INDICATOR_COLUMNS, equal
+    (to rounding) to the pandas rolling/ewm chain of add_indicators_pandas, NaN included.
+    close must not contain NaN.
+    """
+    close = np.ascontiguousarray(close, dtype=np.float64)
+    volume = np.ascontiguousarray(volume, dtype=np.float64)
+    n = len(close)
+    if n == 0:
+        return {name: np.empty(0) for name in INDICATOR_COLUMNS}
+    features = {}
+
+    returns = np.full(n, np.nan)
+    np.divide(close[1:], close[:-1], out=returns[1:])
+    returns[1:] -= 1
+    features['returns'] = returns
+    close_csum = np.cumsum(close)
+    features['sma_5'] = rolling_mean(close, 5, close_csum)
+    sma_20 = rolling_mean(close, 20, close_csum)
+    features['sma_20'] = sma_20
+    # The first return is NaN: windows containing it stay NaN
+    volatility = np.full(n, np.nan)
+    volatility[1:] = rolling_std(returns[1:], 10)
+    features['volatility'] = volatility
+
+    # RSI (14): the undefined first change counts as no gain and no loss
+    delta = np.zeros(n)
+    np.subtract(close[1:], close[:-1], out=delta[1:])
+    gain = rolling_mean(np.maximum(delta, 0), 14)
+    loss = rolling_mean(np.maximum(-delta, 0), 14)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi = np.divide(gain, loss)
+        rsi += 1
+        np.divide(100, rsi, out=rsi)
+        np.subtract(100, rsi, out=rsi)
+    features['rsi'] = rsi
+
+    # MACD (12, 26, 9)
+    macd = ewm_mean(close, 12) - ewm_mean(close, 26)
+    features['macd'] = macd
+    features['macd_signal'] = ewm_mean(macd, 9)
+
+    # Bollinger Bands (20, 2), sharing the 20-bar mean and std
+    band = 2 * rolling_std(close, 20, sma_20)
+    features['bb_upper'] = sma_20 + band
+    features['bb_lower'] = sma_20 - band
+
+    features['volume_sma'] = rolling_mean(volume, 20)
+    return features
+
+def add_indicators(df):
+    """
+    Adds the INDICATOR_COLUMNS to an OHLCV frame and drops the warm-up rows (NaN indicators).
+    Bars without a close price are dropped first, the indicators skip over them.
+    """
+    if df['close'].isna().any():
+        df = df[df['close'].notna()]
+    features = compute_indicators(df['close'].to_numpy(), df['volume'].to_numpy())
+    # Same rows as DataFrame.dropna, without building the NaN-holding frame first
+    valid = df.notna().all(axis=1).to_numpy().copy()
+    for values in features.values():
+        valid &= ~np.isnan(values)
+    first = int(np.argmax(valid)) if valid.any() else len(valid)
+    if valid[first:].all():
+        # Usual case, only the warm-up rows are dropped: slices instead of boolean indexing
+        rows = slice(first, None)
+        df = df.iloc[rows]
+    else:
+        rows = valid
+        df = df[valid]
+    features = pd.DataFrame({name: values[rows] for name, values in features.items()}, index=df.index)
+    return pd.concat([df, features], axis=1)
+
+class RollingWindow:
+    """
+    Ring buffer of the last `size` values of a stream with a running sum: mean in O(1), sample
+    std in O(size) (two-pass, see rolling_std). NaN values are counted and kept out of the sum;
+    like pandas, the mean and std are NaN until the window is full or while it holds a NaN.
+    The running sum is recomputed exactly every time the ring wraps, so rounding does not drift,
+    and a window of zeros has an exact zero mean (RSI tells "no losses" from "no moves" by it).
+    """
+    def __init__(self, size):
+        self.size = size
+        self.values = [0.0] * size
+        self.count = 0
+        self.position = 0
+        self.total = 0.0
+        self.num_missing = 0
+        self.num_nonzero = 0
+
+    def push(self, value):
+        if self.count == self.size:
+            old = self.values[self.position]
+            if math.isnan(old):
+                self.num_missing -= 1
+            else:
+                self.total -= old
+                self.num_nonzero -= old != 0
+        else:
+            self.count += 1
+        self.values[self.position] = value
+        if math.isnan(value):
+            self.num_missing += 1
+        else:
+            self.total += value
+            self.num_nonzero += value != 0
+        self.position += 1
+        if self.position == self.size:
+            self.position = 0
+            self.total = math.fsum(v for v in self.values if not math.isnan(v))
+
+    @property
+    def ready(self):
+        return self.count == self.size and self.num_missing == 0
+
+    def mean(self):
+        if not self.ready:
+            return math.nan
+        return self.total / self.size if self.num_nonzero else 0.0
+
+    def std(self, mean=None):
+        if not self.ready:
+            return math.nan
+        mean = self.mean() if mean is None else mean
+        return math.sqrt(sum((v - mean) * (v - mean) for v in self.values) / (self.size - 1))
+
+class StreamingIndicators:
+    """
+    Incremental version of compute_indicators for live use: update() takes one bar and returns
+    its INDICATOR_COLUMNS, in time independent of the history length (ring buffers for the
+    rolling windows, running accumulators for the EWMs). The values match the batch engine on
+    the same bars, NaN during the warm-up included (a bar is complete when none is NaN).
+
+    Usage:
+        state = StreamingIndicators()
+        state.warm_up(history['close'], history['volume'])
+        features = state.update(close, volume)
+    """
+    def __init__(self):
+        self.prev_close = None
+        self.close_5 = RollingWindow(5)
+        self.close_20 = RollingWindow(20)
+        self.returns_10 = RollingWindow(10)
+        self.gain_14 = RollingWindow(14)
+        self.loss_14 = RollingWindow(14)
+        self.volume_20 = RollingWindow(20)
+        self.ema_12 = None
+        self.ema_26 = None
+        self.macd_signal = None
+
+    @staticmethod
+    def _ewm(state, value, span):
+        alpha = 2.0 / (span + 1)
+        return value if state is None else (1.0 - alpha) * state + alpha * value
+
+    def update(self, close, volume):
+        close = float(close)
+        volume = float(volume)
+        features = {}
+        if self.prev_close is None:
+            # Like the batch engine, the first bar has no return and counts as no gain and no loss
+            returns = math.nan
+            delta = 0.0
+        else:
+            returns = close / self.prev_close - 1
+            delta = close - self.prev_close
+            self.returns_10.push(returns)
+        self.prev_close = close
+        features['returns'] = returns
+
+        self.close_5.push(close)
+        self.close_20.push(close)
+        features['sma_5'] = self.close_5.mean()
+        sma_20 = self.close_20.mean()
+        features['sma_20'] = sma_20
+        features['volatility'] = self.returns_10.std()
+
+        self.gain_14.push(max(delta, 0.0))
+        self.loss_14.push(max(-delta, 0.0))
+        gain, loss = self.gain_14.mean(), self.loss_14.mean()
+        if math.isnan(gain) or (gain == 0 and loss == 0):
+            features['rsi'] = math.nan
+        else:
+            features['rsi'] = 100.0 if loss == 0 else 100 - 100 / (1 + gain / loss)
+
+        self.ema_12 = self._ewm(self.ema_12, close, 12)
+        self.ema_26 = self._ewm(self.ema_26, close, 26)
+        macd = self.ema_12 - self.ema_26
+        self.macd_signal = self._ewm(self.macd_signal, macd, 9)
+        features['macd'] = macd
+        features['macd_signal'] = self.macd_signal
+
+        band = 2 * self.close_20.std(sma_20)
+        features['bb_upper'] = sma_20 + band
+        features['bb_lower'] = sma_20 - band
+
+        self.volume_20.push(volume)
+        features['volume_sma'] = self.volume_20.mean()
+        return features
+
+    def warm_up(self, closes, volumes):
+        """Feeds a history of bars; returns the features of the last one (None if empty)."""
+        features = None
+        for close, volume in zip(closes, volumes):
+            features = self.update(close, volume)
+        return features
+
+def add_indicators_pandas(df):
+    """
+    Reference implementation: the original chain of pandas rolling / ewm calls. Kept to
+    validate and benchmark add_indicators.
+    """
+    df = df.copy()
+    df['returns'] = df['close'].pct_change()
+    df['sma_5'] = df['close'].rolling(window=5).mean()
+    df['sma_20'] = df['close'].rolling(window=20).mean()
+    df['volatility'] = df['returns'].rolling(window=10).std()
+
+    # RSI (14)
+    delta = df['close'].diff()
+    gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
+    loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
+    rs = gain / loss
+    df['rsi'] = 100 - (100 / (1 + rs))
+
+    # MACD (12, 26, 9)
+    exp1 = df['close'].ewm(span=12, adjust=False).mean()
+    exp2 = df['close'].ewm(span=26, adjust=False).mean()
+    df['macd'] = exp1 - exp2
+    df['macd_signal'] = df['macd'].ewm(span=9, adjust=False).mean()
+
+    # Bollinger Bands (20, 2)
+    df['bb_upper'] = df['sma_20'] + (df['close'].rolling(window=20).std() * 2)
+    df['bb_lower'] = df['sma_20'] - (df['close'].rolling(window=20).std() * 2)
+
+    # Volume Trend (SMA 20)
+    df['volume_sma'] = df['volume'].rolling(window=20).mean()
+    return df.dropna()
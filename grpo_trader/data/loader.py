@@ -1,62 +1,71 @@
-import yfinance as yf
 import pandas as pd
 import numpy as np
+from grpo_trader.data.cache import DEFAULT_CACHE_DIR, OHLCVCache, period_start
+from grpo_trader.data.indicators import add_indicators
+from grpo_trader.data.sources import YFinanceSource, select_window
 
-def fetch_crypto_data(ticker="BTC-USD", period="1mo", interval="1h"):
+def load_ohlcv(ticker="BTC-USD", period="1mo", interval="1h", cache_dir=DEFAULT_CACHE_DIR, offline=False, source=None):
     """
-    Fetches crypto data from yfinance.
+    OHLCV bars of the last period from source (a MarketDataSource, yfinance by default).
+
+    Network sources (source.cacheable) are read through the local cache (see OHLCVCache): online,
+    only the bars after the last cached one are downloaded (or the whole period if the cache does
+    not reach back far enough) and merged into the cache. If the download fails the cached bars
+    are used. offline=True never touches the network. cache_dir=None disables the cache.
+    The period is counted back from the last bar, so offline runs select the same window.
+    Local sources (files, synthetic) are read directly.
     """
-    print(f"Fetching data for {ticker}...")
-    df = yf.download(ticker, period=period, interval=interval, progress=False, auto_adjust=True)
-    if df.empty:
-        raise ValueError(f"No data found for {ticker}")
-    
-    # Ensure columns are flat if MultiIndex
-    if isinstance(df.columns, pd.MultiIndex):
-        df.columns = df.columns.get_level_values(0)
-        
-    df = df.reset_index()
-    # Standardize column names
-    df.columns = [c.lower() for c in df.columns]
-    
-    # Ensure 'date' column exists (yfinance might name it 'Date' or 'Datetime')
-    if 'date' not in df.columns:
-        # Check if 'datetime' exists
-        if 'datetime' in df.columns:
-            df = df.rename(columns={'datetime': 'date'})
-        # Check if 'index' exists (if original index had no name)
-        elif 'index' in df.columns:
-             df = df.rename(columns={'index': 'date'})
-    
-    # Calculate some basic indicators for the model to use
-    df['returns'] = df['close'].pct_change()
-    df['sma_5'] = df['close'].rolling(window=5).mean()
-    df['sma_20'] = df['close'].rolling(window=20).mean()
-    df['volatility'] = df['returns'].rolling(window=10).std()
+    source = source if source is not None else YFinanceSource()
+    if cache_dir is None or not source.cacheable:
+        if offline and source.cacheable:
+            raise ValueError("offline mode needs a cache_dir")
+        bars = source.fetch(ticker, interval, period=period)
+        if bars.empty:
+            raise ValueError(f"No data found for {ticker}")
+        return bars
 
-    # --- Advanced Technical Indicators ---
-    # RSI (14)
-    delta = df['close'].diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-    rs = gain / loss
-    df['rsi'] = 100 - (100 / (1 + rs))
+    cache = OHLCVCache(cache_dir)
+    bars, coverage_start = cache.read(ticker, interval)
+    if offline:
+        if bars is None:
+            raise FileNotFoundError(f"No cached data for {ticker} ({interval}) in {cache_dir}")
+        print(f"Using cached data for {ticker} (offline)")
+    else:
+        now = pd.Timestamp.now(tz="UTC")
+        wanted_start = period_start(period, now)
+        backfill = bars is None or (coverage_start is not None and (wanted_start is None or wanted_start < coverage_start))
+        try:
+            if backfill:
+                print(f"Downloading {period} of {ticker} ({interval})...")
+                new_bars = source.fetch(ticker, interval, period=period)
+            else:
+                # Re-download the last cached bar too: it may have been incomplete
+                print(f"Downloading {ticker} ({interval}) bars after {bars['date'].iloc[-1]}...")
+                new_bars = source.fetch(ticker, interval, start=bars['date'].iloc[-1])
+        except Exception as e:
+            if bars is None:
+                raise
+            print(f"Download failed ({e}), using cached data")
+        else:
+            if not new_bars.empty:
+                bars = cache.update(ticker, interval, new_bars, wanted_start if backfill else coverage_start)
 
-    # MACD (12, 26, 9)
-    exp1 = df['close'].ewm(span=12, adjust=False).mean()
-    exp2 = df['close'].ewm(span=26, adjust=False).mean()
-    df['macd'] = exp1 - exp2
-    df['macd_signal'] = df['macd'].ewm(span=9, adjust=False).mean()
+    if bars is None or bars.empty:
+        raise ValueError(f"No data found for {ticker}")
+    return select_window(bars, period)
 
-    # Bollinger Bands (20, 2)
-    df['bb_upper'] = df['sma_20'] + (df['close'].rolling(window=20).std() * 2)
-    df['bb_lower'] = df['sma_20'] - (df['close'].rolling(window=20).std() * 2)
+def fetch_crypto_data(ticker="BTC-USD", period="1mo", interval="1h", cache_dir=DEFAULT_CACHE_DIR, offline=False,
+                      source=None):
+    """
+    Fetches crypto data (by default from the local cache, then yfinance for the missing bars)
+    and adds the technical indicators.
+    """
+    print(f"Fetching data for {ticker}...")
+    df = load_ohlcv(ticker, period, interval, cache_dir=cache_dir, offline=offline, source=source)
 
-    # Volume Trend (SMA 20)
-    df['volume_sma'] = df['volume'].rolling(window=20).mean()
-    
-    df = df.dropna()
-    return df
+    # Returns, SMA 5/20, volatility, RSI 14, MACD 12/26/9, Bollinger Bands 20/2 and volume SMA 20,
+    # computed in one pass over NumPy arrays; drops the warm-up rows
+    return add_indicators(df)
 
 def split_data(df, train_ratio=0.8):
     """
@@ -1,19 +1,31 @@
 import pandas as pd
 
+# Columns read by build_prompt (close is also the price the rewards are computed from)
+PROMPT_COLUMNS = ['close', 'returns', 'sma_5', 'sma_20', 'rsi', 'macd', 'macd_signal', 'bb_upper', 'bb_lower']
+
 def format_market_data_prompt(df_window):
     """
     Formats a window of market data into a text prompt.
     """
+    history = []
+    for i, row in df_window.iterrows():
+        date_str = str(row['date']) if 'date' in row else f"T-{len(df_window)-i-1}"
+        history.append((date_str, row))
+    return build_prompt(history, df_window.iloc[-1])
+
+def build_prompt(history, latest):
+    """
+    Builds the chat prompt from (date string, row) pairs, oldest first, and the latest row.
+    Rows are mappings of column name to value (DataFrame rows, or dicts of array values).
+    """
     prompt = "Analyze the following crypto market data and decide whether to Buy, Sell, or Hold.\n\n"
     prompt += "Recent Market History:\n"
     
-    for i, row in df_window.iterrows():
-        date_str = str(row['date']) if 'date' in row else f"T-{len(df_window)-i-1}"
+    for date_str, row in history:
         returns_str = f"{row['returns']*100:+.2f}%" if not pd.isna(row['returns']) else "N/A"
         prompt += f"Time: {date_str} | Price: {row['close']:.2f} ({returns_str}) | SMA5: {row['sma_5']:.2f} | SMA20: {row['sma_20']:.2f}\n"
         
     # Add Technical Analysis Summary
-    latest = df_window.iloc[-1]
     
     # RSI Analysis
     rsi_text = f"RSI is {latest['rsi']:.1f}"
@@ -62,7 +74,15 @@ class CryptoDataset:
         prompt = format_market_data_prompt(window)
         
         return {
+            "index": idx,
             "prompt": prompt,
             "current_price": current_price,
             "next_price": next_price
         }
+
+def collate_batch(items):
+    """
+    Collates CryptoDataset items into a batch dict of lists.
+    The default DataLoader collate would transpose the chat message dicts of the prompts.
+    """
+    return {key: [item[key] for item in items] for key in items[0]}
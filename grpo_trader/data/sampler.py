@@ -0,0 +1,157 @@
+import math
+import numpy as np
+import torch
+from torch.utils.data import DistributedSampler, Sampler
+
+class ResumableSampler(DistributedSampler):
+    """
+    Shuffled sampler whose order is a deterministic function of (seed, epoch), and which can
+    start part way through an epoch, so a resumed run sees exactly the remaining samples.
+
+    Also shards the dataset across data-parallel ranks (num_replicas=1 for a single process).
+    """
+    def __init__(self, dataset, num_replicas=1, rank=0, seed=0, shuffle=True):
+        super().__init__(dataset, num_replicas=num_replicas, rank=rank, shuffle=shuffle, seed=seed)
+        self.start_index = 0
+
+    def set_position(self, epoch, start_index=0):
+        """Positions the sampler at the start_index-th sample (of this rank) of epoch."""
+        self.set_epoch(epoch)
+        self.start_index = start_index
+
+    def __iter__(self):
+        indices = list(super().__iter__())
+        return iter(indices[self.start_index:])
+
+    def __len__(self):
+        return max(self.num_samples - self.start_index, 0)
+
+class PrioritizedSampler(Sampler):
+    """
+    Samples prompts (with replacement) in proportion to how much gradient signal their recent
+    rollouts produced, so generation is spent on prompts whose groups are not all-equal.
+
+    The priority of a prompt is an exponential moving average, updated every time one of its
+    groups is scored (see update), of
+        reward std within the group + mean |advantage| of the group
+    Groups with identical rewards (zero advantages) score 0, informative ones ~1 plus their
+    reward spread. Prompts not scored yet keep initial_priority, so every prompt gets tried.
+
+    Every prompt keeps at least floor / N of the probability mass (N prompts): the sampling
+    distribution is (1 - floor) * priorities / sum(priorities) + floor / N, i.e. a draw is a
+    uniform prompt with probability floor and otherwise proportional to the priorities.
+    The priorities are the leaves of a sum tree, so a draw and the update of a prompt take
+    O(log N) instead of a pass over all N priorities. Indices are drawn lazily, so updates made
+    while an epoch is running affect the rest of that epoch.
+
+    Like ResumableSampler, an epoch yields ceil(N / num_replicas) indices per rank and can start
+    part way through (set_position); the priorities and RNG are restored with load_state_dict.
+    """
+    def __init__(self, dataset, num_replicas=1, rank=0, seed=0, floor=0.1, decay=0.9, initial_priority=1.0):
+        if not 0 < floor <= 1:
+            raise ValueError(f"floor must be in (0, 1], got {floor}")
+        if not 0 <= decay < 1:
+            raise ValueError(f"decay must be in [0, 1), got {decay}")
+        if initial_priority < 0:
+            raise ValueError(f"initial_priority must be >= 0, got {initial_priority}")
+        self.num_prompts = len(dataset)
+        self.num_samples = math.ceil(self.num_prompts / num_replicas)
+        self.floor = floor
+        self.decay = decay
+        # Sum tree: the priorities are the leaves [capacity, capacity + N), node i holds the sum
+        # of its children 2i and 2i + 1, the root (node 1) the total
+        self._capacity = 1 << max(self.num_prompts - 1, 0).bit_length()
+        self._tree = np.zeros(2 * self._capacity)
+        self._tree[self._capacity:self._capacity + self.num_prompts] = initial_priority
+        self._rebuild()
+        self.num_updates = torch.zeros(self.num_prompts, dtype=torch.long)
+        # Ranks draw independently, from their own (locally updated) priorities
+        self.generator = torch.Generator().manual_seed(seed + rank)
+        self.start_index = 0
+
+    @property
+    def priorities(self):
+        """The priority of every prompt [N] (a view of the tree leaves)."""
+        return torch.from_numpy(self._tree[self._capacity:self._capacity + self.num_prompts])
+
+    def _rebuild(self):
+        size = self._capacity
+        while size > 1:
+            size //= 2
+            self._tree[size:2 * size] = self._tree[2 * size:4 * size:2] + self._tree[2 * size + 1:4 * size:2]
+
+    def _propagate(self, indices):
+        """Recomputes the sums above the given leaves, one tree level at a time."""
+        nodes = np.unique((np.asarray(indices, dtype=np.int64) + self._capacity) // 2)
+        while len(nodes):
+            self._tree[nodes] = self._tree[2 * nodes] + self._tree[2 * nodes + 1]
+            nodes = np.unique(nodes[nodes > 1] // 2)
+
+    def set_position(self, epoch, start_index=0):
+        # The draws do not depend on the epoch: the generator state carries over
+        self.start_index = start_index
+
+    def probabilities(self):
+        priorities = self.priorities.clone()
+        total = float(priorities.sum())
+        if total == 0:
+            return torch.full_like(priorities, 1 / self.num_prompts)
+        return (1 - self.floor) * priorities / total + self.floor / self.num_prompts
+
+    def update(self, indices, rewards, advantages):
+        """
+        Folds the scored groups of a rollout into the priorities.
+
+        Args:
+            indices: dataset index of each prompt of the batch [B].
+            rewards, advantages: rewards and advantages of the groups [B, G].
+        """
+        signal = rewards.std(dim=1) + advantages.abs().mean(dim=1)
+        leaves = []
+        for index, value in zip(indices, signal.tolist()):
+            index = int(index)
+            leaf = self._capacity + index
+            self._tree[leaf] = self.decay * self._tree[leaf] + (1 - self.decay) * value
+            self.num_updates[index] += 1
+            leaves.append(index)
+        if leaves:
+            self._propagate(leaves)
+
+    def state_dict(self):
+        # Tensors: saved per rank next to the RNG state of checkpoints, not in the JSON trainer state
+        return {
+            'priorities': self.priorities.clone(),
+            'num_updates': self.num_updates.clone(),
+            'generator': self.generator.get_state()
+        }
+
+    def load_state_dict(self, state):
+        priorities = torch.as_tensor(state['priorities'], dtype=torch.float64)
+        self._tree[self._capacity:self._capacity + self.num_prompts] = priorities.numpy()
+        self._rebuild()
+        self.num_updates = torch.as_tensor(state['num_updates'], dtype=torch.long).clone()
+        self.generator.set_state(torch.as_tensor(state['generator'], dtype=torch.uint8))
+
+    def _draw(self):
+        uniform, target = torch.rand(2, generator=self.generator, dtype=torch.float64).tolist()
+        total = self._tree[1]
+        if uniform < self.floor or total <= 0:
+            return min(int(target * self.num_prompts), self.num_prompts - 1)
+        target *= total
+        node = 1
+        while node < self._capacity:
+            left = self._tree[2 * node]
+            # Rounding can leave target past the last nonzero leaf: never step into an empty subtree
+            if target < left or self._tree[2 * node + 1] <= 0:
+                node = 2 * node
+            else:
+                target -= left
+                node = 2 * node + 1
+        return node - self._capacity
+
+    def __iter__(self):
+        for _ in range(len(self)):
+            yield self._draw()
+
+    def __len__(self):
+        return max(self.num_samples - self.start_index, 0)
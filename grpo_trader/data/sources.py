@@ -0,0 +1,203 @@
+import os
+import re
+import zlib
+import numpy as np
+import pandas as pd
+from grpo_trader.data.cache import OHLCV_COLUMNS, period_start
+
+def interval_to_timedelta(interval):
+    """Bar length of a yfinance style interval ("1m", "15m", "1h", "1d", "1wk")."""
+    match = re.fullmatch(r"(\d+)(m|h|d|wk)", interval)
+    if match is None:
+        raise ValueError(f"Unsupported interval: {interval!r}")
+    n, unit = int(match.group(1)), match.group(2)
+    unit = {'m': 'minutes', 'h': 'hours', 'd': 'days', 'wk': 'weeks'}[unit]
+    return pd.Timedelta(**{unit: n})
+
+def select_window(bars, period=None, start=None):
+    """Bars from start on, or of the last period counted back from the last bar."""
+    if bars.empty:
+        return bars
+    if start is None and period is not None:
+        start = period_start(period, bars['date'].iloc[-1])
+    if start is not None:
+        bars = bars[bars['date'] >= start]
+    return bars.reset_index(drop=True)
+
+class MarketDataSource:
+    """
+    Where OHLCV bars come from. fetch returns a frame with the columns date, open, high, low,
+    close, volume, sorted by date: the bars of the last period, or from start onwards (possibly
+    empty). Sources reached over the network set cacheable so load_ohlcv keeps a local copy.
+    """
+    cacheable = False
+
+    def fetch(self, ticker, interval="1h", period=None, start=None):
+        raise NotImplementedError
+
+class YFinanceSource(MarketDataSource):
+    """Yahoo Finance through yfinance, period counted back from now."""
+    cacheable = True
+
+    def fetch(self, ticker, interval="1h", period=None, start=None):
+        import yfinance as yf
+
+        if start is not None:
+            df = yf.download(ticker, start=start, interval=interval, progress=False, auto_adjust=True)
+        else:
+            df = yf.download(ticker, period=period, interval=interval, progress=False, auto_adjust=True)
+        if df.empty:
+            return pd.DataFrame(columns=OHLCV_COLUMNS)
+
+        # Ensure columns are flat if MultiIndex
+        if isinstance(df.columns, pd.MultiIndex):
+            df.columns = df.columns.get_level_values(0)
+
+        df = df.reset_index()
+        # Standardize column names
+        df.columns = [c.lower() for c in df.columns]
+
+        # Ensure 'date' column exists (yfinance might name it 'Date' or 'Datetime')
+        if 'date' not in df.columns:
+            # Check if 'datetime' exists
+            if 'datetime' in df.columns:
+                df = df.rename(columns={'datetime': 'date'})
+            # Check if 'index' exists (if original index had no name)
+            elif 'index' in df.columns:
+                df = df.rename(columns={'index': 'date'})
+        return df[OHLCV_COLUMNS]
+
+class FileSource(MarketDataSource):
+    """
+    OHLCV files in a directory, looked up in order as
+        <root>/<ticker>/<interval>.parquet   (the OHLCVCache layout, so a cache can be read offline)
+        <root>/<ticker>/<interval>.csv
+        <root>/<ticker>_<interval>.parquet
+        <root>/<ticker>_<interval>.csv
+    Column names are matched case-insensitively ("Date"/"Datetime"/"timestamp" are read as date).
+    The period is counted back from the last bar of the file.
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, ticker, interval):
+        candidates = [
+            os.path.join(self.root, ticker, f"{interval}.parquet"),
+            os.path.join(self.root, ticker, f"{interval}.csv"),
+            os.path.join(self.root, f"{ticker}_{interval}.parquet"),
+            os.path.join(self.root, f"{ticker}_{interval}.csv"),
+        ]
+        for path in candidates:
+            if os.path.exists(path):
+                return path
+        raise FileNotFoundError(f"No {interval} data for {ticker} in {self.root}")
+
+    def fetch(self, ticker, interval="1h", period=None, start=None):
+        path = self.path(ticker, interval)
+        df = pd.read_parquet(path) if path.endswith(".parquet") else pd.read_csv(path)
+        df.columns = [c.lower() for c in df.columns]
+        df = df.rename(columns={'datetime': 'date', 'timestamp': 'date'})
+        df['date'] = pd.to_datetime(df['date'])
+        df = df[OHLCV_COLUMNS].sort_values('date')
+        return select_window(df, period, start)
+
+# (annual drift, annual volatility) of the synthetic regimes
+DEFAULT_REGIMES = (
+    (0.8, 0.5),    # bull
+    (-0.6, 0.8),   # bear
+    (0.0, 0.25),   # quiet range
+)
+
+class SyntheticSource(MarketDataSource):
+    """
+    Deterministic geometric Brownian motion with Markov regime switches, for offline runs, CI and
+    throughput benchmarks (millions of bars take about a second).
+
+    The regime (drift, volatility) changes after geometrically distributed durations with mean
+    mean_regime_bars, to a uniformly drawn other regime. Log returns within a bar are
+    N((mu - sigma^2 / 2) dt, sigma^2 dt), dt being the bar length in years; highs and lows
+    extend the open/close range by a half-normal amount, volume is log-normal and rises with
+    the regime volatility. The bars are a function of (seed, ticker): num_bars of them ending at
+    end. The period is counted back from the last bar.
+    """
+    def __init__(self, num_bars=10_000, seed=0, end="2025-01-01", initial_price=100.0,
+                 regimes=DEFAULT_REGIMES, mean_regime_bars=500):
+        self.num_bars = int(num_bars)
+        self.seed = seed
+        self.end = pd.Timestamp(end, tz="UTC") if pd.Timestamp(end).tzinfo is None else pd.Timestamp(end)
+        self.initial_price = initial_price
+        self.regimes = np.asarray(regimes, dtype=np.float64)
+        self.mean_regime_bars = mean_regime_bars
+
+    def regime_path(self, rng, n):
+        """Regime index of each of n bars."""
+        # Enough durations to cover n bars in expectation, topped up if they fall short
+        durations = rng.geometric(1 / self.mean_regime_bars, size=n // self.mean_regime_bars + 16)
+        while durations.sum() < n:
+            durations = np.concatenate([durations, rng.geometric(1 / self.mean_regime_bars, size=16)])
+        # Every switch moves to one of the other regimes
+        num_regimes = len(self.regimes)
+        steps = rng.integers(1, num_regimes, size=len(durations))
+        steps[0] = rng.integers(0, num_regimes)
+        regimes = np.cumsum(steps) % num_regimes
+        return np.repeat(regimes, durations)[:n]
+
+    def generate(self, ticker, interval="1h"):
+        n = self.num_bars
+        bar = interval_to_timedelta(interval)
+        dt = bar / pd.Timedelta(days=365)
+        rng = np.random.default_rng([self.seed, zlib.crc32(ticker.encode())])
+
+        regime = self.regime_path(rng, n)
+        mu, sigma = self.regimes[regime, 0], self.regimes[regime, 1]
+        log_returns = (mu - 0.5 * sigma ** 2) * dt + sigma * np.sqrt(dt) * rng.standard_normal(n)
+        close = self.initial_price * np.exp(np.cumsum(log_returns))
+        open_ = np.empty(n)
+        open_[0] = self.initial_price
+        open_[1:] = close[:-1]
+        bar_sigma = sigma * np.sqrt(dt)
+        high = np.maximum(open_, close) * np.exp(np.abs(rng.standard_normal(n)) * bar_sigma * 0.5)
+        low = np.minimum(open_, close) * np.exp(-np.abs(rng.standard_normal(n)) * bar_sigma * 0.5)
+        volume = 1e3 * (sigma / self.regimes[:, 1].min()) * rng.lognormal(0.0, 0.5, n)
+
+        dates = pd.date_range(end=self.end, periods=n, freq=bar)
+        return pd.DataFrame({
+            'date': dates, 'open': open_, 'high': high, 'low': low, 'close': close, 'volume': volume
+        })
+
+    def fetch(self, ticker, interval="1h", period=None, start=None):
+        return select_window(self.generate(ticker, interval), period, start)
+
+SOURCES = {
+    'yfinance': YFinanceSource,
+    'files': FileSource,
+    'synthetic': SyntheticSource,
+}
+
+def source_from_spec(spec):
+    """
+    Builds a source from a command line spec:
+        "yfinance"
+        "files:/path/to/dir"
+        "synthetic" or "synthetic:num_bars=1000000,seed=3"
+    """
+    name, _, arg = spec.partition(":")
+    if name not in SOURCES:
+        raise ValueError(f"Unknown data source {name!r}, expected one of {sorted(SOURCES)}")
+    if name == 'files':
+        if not arg:
+            raise ValueError("The files source needs a directory, e.g. files:/data/ohlcv")
+        return FileSource(arg)
+    kwargs = {}
+    for item in filter(None, arg.split(",")):
+        key, _, value = item.partition("=")
+        kwargs[key] = _parse_value(value)
+    return SOURCES[name](**kwargs)
+
+def _parse_value(value):
+    for parse in (int, float):
+        try:
+            return parse(value)
+        except ValueError:
+            pass
+    return value
@@ -1,46 +1,172 @@
 import argparse
+import os
 import torch
 from torch.utils.data import DataLoader
+from grpo_trader.data.cache import DEFAULT_CACHE_DIR
+from grpo_trader.data.feature_store import FeatureStore, WindowDataset, build_feature_store
 from grpo_trader.data.loader import fetch_crypto_data, split_data
-from grpo_trader.data.processor import CryptoDataset
+from grpo_trader.data.processor import CryptoDataset, collate_batch
+from grpo_trader.data.sampler import PrioritizedSampler, ResumableSampler
+from grpo_trader.data.sources import source_from_spec
 from grpo_trader.env.trading_env import TradingEnvironment
-from grpo_trader.model.modeling import load_model_and_tokenizer
+from grpo_trader.model.modeling import apply_lora, load_model_and_tokenizer, load_reference_model
+from grpo_trader.train.async_rollout import AsyncRolloutWorker
+from grpo_trader.train.checkpoint import AsyncCheckpointer, latest_checkpoint, load_checkpoint
+from grpo_trader.train.distributed import broadcast_parameters, init_distributed, is_main_process
 from grpo_trader.train.grpo_trainer import GRPOTrainer
+from grpo_trader.train.profiling import parse_step_range
 
 def main():
     parser = argparse.ArgumentParser(description="GRPO Trader Training")
     parser.add_argument("--ticker", type=str, default="BTC-USD", help="Crypto ticker")
     parser.add_argument("--period", type=str, default="1mo", help="Data period")
+    parser.add_argument("--interval", type=str, default="1h", help="Bar interval")
+    parser.add_argument("--data_source", type=source_from_spec, default=None,
+                        help="yfinance (default), files:<dir> with CSV/Parquet OHLCV files, or synthetic[:num_bars=N,seed=S]")
+    parser.add_argument("--data_cache_dir", type=str, default=DEFAULT_CACHE_DIR,
+                        help="Local OHLCV cache: only bars after the last cached one are downloaded")
+    parser.add_argument("--no_data_cache", action="store_true", help="Download the whole period, no local cache")
+    parser.add_argument("--offline", action="store_true", help="Read the market data from the local cache only")
+    parser.add_argument("--feature_store", type=str, default=None,
+                        help="Train from this memory-mapped feature store (built for --ticker if missing); "
+                             "--ticker may then list several tickers separated by commas")
     parser.add_argument("--model_name", type=str, default="Qwen/Qwen2.5-0.5B-Instruct", help="Model name")
     parser.add_argument("--epochs", type=int, default=1, help="Number of epochs")
     parser.add_argument("--batch_size", type=int, default=2, help="Batch size")
     parser.add_argument("--group_size", type=int, default=4, help="Group size for GRPO")
     parser.add_argument("--lr", type=float, default=1e-5, help="Learning rate")
+    parser.add_argument("--max_new_tokens", type=int, default=128, help="Max generated tokens per completion")
+    parser.add_argument("--rollout_token_budget", type=int, default=None,
+                        help="Max tokens per generate call (default: whole batch in one call)")
+    parser.add_argument("--kl_estimator", type=str, default="k3", choices=["k1", "k2", "k3", "full"],
+                        help="Sampled-token KL estimator, or 'full' for the exact full-vocab KL")
+    parser.add_argument("--lora", action="store_true",
+                        help="Train a LoRA adapter; the reference is the base model with the adapter disabled")
+    parser.add_argument("--lora_r", type=int, default=16, help="LoRA rank")
+    parser.add_argument("--lora_alpha", type=int, default=32, help="LoRA alpha")
+    parser.add_argument("--ref_checkpoint", type=str, default=None,
+                        help="Memory-map the reference model from this safetensors file or directory")
+    parser.add_argument("--no_share_prompt_cache", action="store_true",
+                        help="Prefill the prompt for every sample instead of once per group")
+    parser.add_argument("--no_stop_at_answer", action="store_true",
+                        help="Keep decoding after </answer> up to max_new_tokens")
+    parser.add_argument("--ppo_epochs", type=int, default=1, help="Update epochs over each rollout")
+    parser.add_argument("--mini_batch_groups", type=int, default=None,
+                        help="Prompt groups per mini-batch update (default: the whole batch)")
+    parser.add_argument("--async_rollout", action="store_true",
+                        help="Generate the next batch in a background thread while training on the current one")
+    parser.add_argument("--rollout_queue_size", type=int, default=1, help="Rollouts generated ahead (async mode)")
+    parser.add_argument("--max_staleness", type=int, default=1,
+                        help="Drop rollouts sampled more than this many policy updates ago (async mode)")
+    parser.add_argument("--max_tokens_per_micro_batch", type=int, default=None,
+                        help="Token budget per forward/backward; gradients are accumulated over micro-batches")
+    parser.add_argument("--pack_sequences", action="store_true",
+                        help="Score completions on padding-free packed sequences")
+    parser.add_argument("--fused_loss", action="store_true",
+                        help="Fuse the output projection into the loss so no vocab-sized logits are stored")
+    parser.add_argument("--gradient_checkpointing", action="store_true",
+                        help="Recompute layer activations in backward instead of storing them")
+    parser.add_argument("--bf16_autocast", action="store_true",
+                        help="Run the scoring forwards under bf16 autocast (CPU or CUDA)")
+    parser.add_argument("--master_weights", action="store_true",
+                        help="Keep fp32 master weights for the optimizer, generate and backprop with a bf16 copy")
+    parser.add_argument("--dynamic_sampling", action="store_true",
+                        help="Drop groups whose rewards are all equal before scoring them")
+    parser.add_argument("--max_refill_batches", type=int, default=0,
+                        help="Extra batches sampled per step to refill dropped groups (dynamic sampling)")
+    parser.add_argument("--prioritized_sampling", action="store_true",
+                        help="Sample prompts by the reward variance and advantage magnitude of their recent groups")
+    parser.add_argument("--priority_floor", type=float, default=0.1,
+                        help="Probability mass spread uniformly over all prompts (prioritized sampling)")
+    parser.add_argument("--priority_decay", type=float, default=0.9,
+                        help="Exponential decay of the per-prompt priority on every new group (prioritized sampling)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (offset by the rank)")
+    parser.add_argument("--metrics_file", type=str, default=None,
+                        help="Write per-step phase timings and throughput as JSONL to this file (per rank)")
+    parser.add_argument("--profile_steps", "--profile-steps", type=parse_step_range, default=None,
+                        help="Capture a torch.profiler trace of these steps, e.g. 10-12 (counted from 0)")
+    parser.add_argument("--profile_dir", type=str, default="profiles",
+                        help="Where the Chrome trace and top-ops table are written")
+    parser.add_argument("--save_steps", type=int, default=0,
+                        help="Checkpoint every N training steps, written in the background (0: disabled)")
+    parser.add_argument("--checkpoint_dir", type=str, default="checkpoints", help="Where checkpoints are written")
+    parser.add_argument("--keep_checkpoints", type=int, default=2, help="Number of most recent checkpoints kept")
+    parser.add_argument("--resume", type=str, default=None,
+                        help="Resume from a checkpoint directory, or 'latest' in --checkpoint_dir")
     args = parser.parse_args()
     
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    print(f"Using device: {device}")
+    # Data parallel when launched with torchrun: each rank generates and scores its own shard
+    # of the prompts and gradients are all-reduced over gloo (CPU)
+    rank, world_size = init_distributed()
+    if world_size > 1 and (args.async_rollout or args.max_refill_batches):
+        # Every rank must run the same number of updates per epoch
+        parser.error("--async_rollout and --max_refill_batches are not supported with torchrun")
+    torch.manual_seed(args.seed + rank)
+    device = "cuda" if torch.cuda.is_available() and world_size == 1 else "cpu"
+    print(f"Using device: {device} (rank {rank}/{world_size})")
     
     # 1. Load Data
-    try:
-        df = fetch_crypto_data(args.ticker, args.period)
-    except Exception as e:
-        print(f"Error fetching data: {e}")
-        return
+    cache_dir = None if args.no_data_cache else args.data_cache_dir
+    if args.feature_store:
+        # Windows are read from memory-mapped feature columns, shared by all processes
+        store = FeatureStore(args.feature_store)
+        tickers = args.ticker.split(",")
+        missing = [ticker for ticker in tickers if not store.exists(ticker, args.interval)]
+        if missing and rank == 0:
+            try:
+                build_feature_store(
+                    args.feature_store, missing, args.period, args.interval,
+                    cache_dir=cache_dir, offline=args.offline, source=args.data_source
+                )
+            except Exception as e:
+                print(f"Error fetching data: {e}")
+                return
+        if missing and world_size > 1:
+            torch.distributed.barrier()
+        train_dataset = WindowDataset(store, tickers, args.interval, split=(0.0, 0.8))
+    else:
+        try:
+            df = fetch_crypto_data(
+                args.ticker, args.period, args.interval, cache_dir=cache_dir, offline=args.offline, source=args.data_source
+            )
+        except Exception as e:
+            print(f"Error fetching data: {e}")
+            return
 
-    train_df, test_df = split_data(df)
-    train_dataset = CryptoDataset(train_df)
-    train_loader = DataLoader(train_dataset, batch_size=args.batch_size, shuffle=True)
+        train_df, test_df = split_data(df)
+        train_dataset = CryptoDataset(train_df)
+    if args.prioritized_sampling:
+        # Drawn by the recent gradient signal of each prompt, updated by the trainer
+        sampler = PrioritizedSampler(
+            train_dataset, num_replicas=world_size, rank=rank, seed=args.seed,
+            floor=args.priority_floor, decay=args.priority_decay
+        )
+    else:
+        # Shuffled (and sharded across ranks) in an order that can be resumed mid-epoch
+        sampler = ResumableSampler(train_dataset, num_replicas=world_size, rank=rank, seed=args.seed)
+    train_loader = DataLoader(train_dataset, batch_size=args.batch_size, sampler=sampler, collate_fn=collate_batch)
     
     print(f"Training data size: {len(train_dataset)}")
     
     # 2. Load Model
     model, tokenizer = load_model_and_tokenizer(args.model_name)
     model.to(device)
+    if args.master_weights:
+        # The loaded weights become the fp32 master copy
+        model.float()
+    if args.lora:
+        model = apply_lora(model, r=args.lora_r, alpha=args.lora_alpha)
+    if world_size > 1:
+        # e.g. the random LoRA initialisation differs between ranks
+        broadcast_parameters(model)
+
+    ref_model = None
+    if args.ref_checkpoint:
+        ref_model = load_reference_model(args.model_name, args.ref_checkpoint).to(device)
     
     # 3. Setup Environment & Trainer
     env = TradingEnvironment()
-    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr)
+    optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=args.lr)
     
     trainer = GRPOTrainer(
         model=model,
@@ -48,22 +174,112 @@ def main():
         env=env,
         optimizer=optimizer,
         group_size=args.group_size,
-        device=device
+        device=device,
+        max_new_tokens=args.max_new_tokens,
+        rollout_token_budget=args.rollout_token_budget,
+        kl_estimator=args.kl_estimator,
+        ref_model=ref_model,
+        share_prompt_cache=not args.no_share_prompt_cache,
+        stop_at_answer=not args.no_stop_at_answer,
+        ppo_epochs=args.ppo_epochs,
+        mini_batch_groups=args.mini_batch_groups,
+        max_tokens_per_micro_batch=args.max_tokens_per_micro_batch,
+        pack_sequences=args.pack_sequences,
+        dynamic_sampling=args.dynamic_sampling,
+        max_refill_batches=args.max_refill_batches,
+        metrics_path=f"{args.metrics_file}.rank{rank}" if args.metrics_file and world_size > 1 else args.metrics_file,
+        profile_steps=args.profile_steps,
+        profile_dir=args.profile_dir if world_size == 1 else os.path.join(args.profile_dir, f"rank{rank}"),
+        fused_loss=args.fused_loss,
+        gradient_checkpointing=args.gradient_checkpointing,
+        autocast_dtype=torch.bfloat16 if args.bf16_autocast else None,
+        master_weights_dtype=torch.bfloat16 if args.master_weights else None,
+        prompt_sampler=sampler if args.prioritized_sampling else None
     )
     
+    start_epoch, start_batch, global_step = 0, 0, 0
+    if args.resume:
+        # After the trainer is built, so a copied reference model keeps the initial weights
+        path = latest_checkpoint(args.checkpoint_dir) if args.resume == "latest" else args.resume
+        state = load_checkpoint(path, model, optimizer, rank)
+        trainer.load_state_dict(state['trainer'])
+        if args.prioritized_sampling:
+            sampler.load_state_dict(state['sampler'])
+        start_epoch, start_batch, global_step = state['epoch'], state['batches_in_epoch'], state['step']
+    checkpointer = AsyncCheckpointer(args.checkpoint_dir, args.keep_checkpoints, rank) if args.save_steps else None
+    
     # 4. Training Loop
     print("Starting training...")
-    for epoch in range(args.epochs):
+    for epoch in range(start_epoch, args.epochs):
         total_loss = 0
-        for batch in train_loader:
-            loss = trainer.train_step(batch)
+        num_batches = 0
+        sampler.set_position(epoch, start_batch * args.batch_size)
+        # Batches of this epoch consumed so far, the data position saved in checkpoints
+        position = {'batches': start_batch}
+        start_batch = 0
+
+        def epoch_batches():
+            for batch in train_loader:
+                position['batches'] += 1
+                yield batch
+
+        if args.async_rollout:
+            worker = AsyncRolloutWorker(
+                trainer, train_loader, queue_size=args.rollout_queue_size, max_staleness=args.max_staleness
+            )
+            # The worker reads ahead, so count the rollouts consumed (trained or dropped) instead:
+            # batches still in flight are generated again after a resume
+            losses = (trainer.train_on_rollout(rollout) for rollout in worker)
+        else:
+            # Dynamic sampling refills a step with the next batches of the same epoch
+            batches = epoch_batches()
+            refill_batches = batches if args.dynamic_sampling else None
+            losses = (trainer.train_step(batch, refill_batches=refill_batches) for batch in batches)
+        for loss in losses:
+            global_step += 1
+            if args.async_rollout:
+                position['batches'] += 1
+            if checkpointer is not None and global_step % args.save_steps == 0:
+                dropped = worker.dropped if args.async_rollout else 0
+                checkpointer.save(global_step, model, optimizer, {
+                    'epoch': epoch,
+                    'batches_in_epoch': position['batches'] + dropped,
+                    'trainer': trainer.state_dict()
+                }, sampler_state=sampler.state_dict() if args.prioritized_sampling else None)
+            if loss is None:
+                # Every group of the batch was dropped by dynamic sampling
+                continue
             total_loss += loss
-            print(f"Batch Loss: {loss:.4f}")
+            num_batches += 1
+            if is_main_process():
+                print(f"Batch Loss: {loss:.4f}")
             
-        avg_loss = total_loss / len(train_loader)
+        summary = trainer.metrics.summarize_epoch(epoch=epoch + 1)
+        if not is_main_process():
+            continue
+        avg_loss = total_loss / max(num_batches, 1)
         print(f"Epoch {epoch+1}/{args.epochs} - Avg Loss: {avg_loss:.4f}")
+        if args.async_rollout:
+            print(f"Stale rollouts dropped: {worker.dropped}")
+        if args.dynamic_sampling:
+            print(f"Groups skipped by dynamic sampling: {trainer.skipped_group_fraction:.1%}")
+        if args.prioritized_sampling:
+            probs = sampler.probabilities()
+            print(f"Prompts scored: {int((sampler.num_updates > 0).sum())}/{sampler.num_prompts}, "
+                  f"max/min sampling probability: {float(probs.max() / probs.min()):.1f}")
+        if not args.no_stop_at_answer:
+            print(f"Decode steps saved by stopping at </answer>: {trainer.decode_steps_saved}")
+        phases = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in summary['phases'].items() if seconds)
+        print(f"Time {summary['total_time']:.1f}s ({phases}), {summary['generated_tokens_per_sec']:.1f} generated tokens/s")
         
     print("Training complete.")
+    if checkpointer is not None:
+        checkpointer.wait()
+    trainer.metrics.close()
+    if trainer.profiler is not None:
+        trainer.profiler.stop()
+    if not is_main_process():
+        return
     
     # Save model
     model.save_pretrained("grpo_trader_model")
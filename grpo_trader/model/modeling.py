@@ -1,5 +1,7 @@
+import glob
+import os
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
 
 def load_model_and_tokenizer(model_name="Qwen/Qwen2.5-0.5B-Instruct"):
     """
@@ -19,3 +21,79 @@ def load_model_and_tokenizer(model_name="Qwen/Qwen2.5-0.5B-Instruct"):
     )
     
     return model, tokenizer
+
+def apply_lora(model, r=16, alpha=32, dropout=0.05, target_modules=None):
+    """
+    Wraps the model with a trainable LoRA adapter; the base weights are frozen.
+
+    The frozen base doubles as the GRPO reference model: running the same weights with the
+    adapter disabled gives the reference log probs, so no copy of the model is needed.
+    """
+    from peft import LoraConfig, get_peft_model
+
+    config = LoraConfig(
+        r=r,
+        lora_alpha=alpha,
+        lora_dropout=dropout,
+        target_modules=target_modules or ["q_proj", "k_proj", "v_proj", "o_proj"],
+        task_type="CAUSAL_LM"
+    )
+    model = get_peft_model(model, config)
+    model.print_trainable_parameters()
+    return model
+
+class AdapterDisabledReference:
+    """
+    Reference model view of a PEFT model: calls run the base weights with the adapter disabled.
+    """
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, *args, **kwargs):
+        with torch.no_grad(), self.model.disable_adapter():
+            return self.model(*args, **kwargs)
+
+def load_reference_model(model_name, checkpoint_path=None):
+    """
+    Loads a frozen reference model whose weights stay memory-mapped from safetensors files.
+
+    The model is built without allocating parameters and the mmapped tensors are assigned
+    without copying, in the checkpoint dtype. Pages are read lazily, never written, and shared
+    through the page cache with any other process mapping the same files.
+
+    Args:
+        model_name: Model name or path, used for the config (and the weights if no checkpoint_path).
+        checkpoint_path: A .safetensors file or a directory of (sharded) .safetensors files.
+    """
+    from accelerate import init_empty_weights
+    from safetensors.torch import load_file
+
+    checkpoint_path = checkpoint_path or model_name
+    if os.path.isdir(checkpoint_path):
+        files = sorted(glob.glob(os.path.join(checkpoint_path, "*.safetensors")))
+    else:
+        files = [checkpoint_path]
+    if not files:
+        raise ValueError(f"No safetensors files found in {checkpoint_path}")
+
+    print(f"Memory-mapping reference model from {checkpoint_path}")
+    state_dict = {}
+    for path in files:
+        state_dict.update(load_file(path))
+
+    config = AutoConfig.from_pretrained(model_name)
+    # Parameters on the meta device, buffers (e.g. rotary frequencies) materialised as usual
+    with init_empty_weights():
+        model = AutoModelForCausalLM.from_config(config)
+    model.load_state_dict(state_dict, strict=False, assign=True)
+    # e.g. lm_head shares the embedding matrix and is not stored in the checkpoint
+    model.tie_weights()
+
+    missing = [name for name, param in model.named_parameters() if param.is_meta]
+    if missing:
+        raise ValueError(f"Reference checkpoint is missing weights: {missing[:5]}")
+
+    model.eval()
+    for param in model.parameters():
+        param.requires_grad = False
+    return model
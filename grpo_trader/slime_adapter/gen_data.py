@@ -1,11 +1,13 @@
 import json
 import argparse
+from grpo_trader.data.cache import DEFAULT_CACHE_DIR
 from grpo_trader.data.loader import fetch_crypto_data, split_data
 from grpo_trader.data.processor import CryptoDataset
+from grpo_trader.data.sources import source_from_spec
 
-def generate_jsonl(output_dir, ticker="BTC-USD", period="1y"):
+def generate_jsonl(output_dir, ticker="BTC-USD", period="1y", cache_dir=DEFAULT_CACHE_DIR, offline=False, source=None):
     print(f"Fetching data for {ticker}...")
-    df = fetch_crypto_data(ticker, period)
+    df = fetch_crypto_data(ticker, period, cache_dir=cache_dir, offline=offline, source=source)
     
     # Split data
     train_df, test_df = split_data(df, train_ratio=0.8)
@@ -46,6 +48,13 @@ if __name__ == "__main__":
     parser.add_argument("--output_dir", type=str, default=".")
     parser.add_argument("--ticker", type=str, default="BTC-USD")
     parser.add_argument("--period", type=str, default="1y")
+    parser.add_argument("--data_source", type=source_from_spec, default=None,
+                        help="yfinance (default), files:<dir> or synthetic[:num_bars=N,seed=S]")
+    parser.add_argument("--data_cache_dir", type=str, default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--offline", action="store_true", help="Read the market data from the local cache only")
     args = parser.parse_args()
 
-    generate_jsonl(args.output_dir, args.ticker, args.period)
+    generate_jsonl(
+        args.output_dir, args.ticker, args.period,
+        cache_dir=args.data_cache_dir, offline=args.offline, source=args.data_source
+    )
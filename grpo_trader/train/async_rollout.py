@@ -0,0 +1,125 @@
+import copy
+import queue
+import threading
+import torch
+from ..model.modeling import AdapterDisabledReference
+
+class AsyncRolloutWorker:
+    """
+    Generates rollouts in a background thread while the trainer updates the policy.
+
+    The worker samples with its own snapshot of the policy, refreshed from the trainer before
+    every batch, so generation for batch N+1 overlaps the optimizer updates on batch N.
+    At most queue_size rollouts are in flight (being generated or waiting in the queue): the
+    worker takes a free slot before it refreshes the snapshot, so a rollout is never sampled
+    with weights older than needed just to wait for room in the queue. One whose snapshot is
+    more than max_staleness policy versions (trained rollouts) behind the trainer when it is
+    consumed is dropped.
+    The old log probs stored in a rollout come from the snapshot that sampled it, so the
+    importance ratio corrects for the lag.
+
+    Note the snapshot is a second copy of the policy weights.
+
+    Usage:
+        worker = AsyncRolloutWorker(trainer, train_loader)
+        for rollout in worker:
+            loss = trainer.train_on_rollout(rollout)
+    """
+    def __init__(self, trainer, batches, queue_size=1, max_staleness=1):
+        self.trainer = trainer
+        self.batches = batches
+        self.max_staleness = max_staleness
+        self.queue = queue.Queue(maxsize=queue_size)
+        # Released when the trainer takes a rollout off the queue
+        self._slots = threading.Semaphore(queue_size)
+        self.dropped = 0
+
+        # A copy of the model the trainer generates with (its compute copy under master weights)
+        self.snapshot = copy.deepcopy(trainer.compute_model)
+        self.snapshot.eval()
+        for param in self.snapshot.parameters():
+            param.requires_grad = False
+        if isinstance(trainer.ref_model, AdapterDisabledReference):
+            # The LoRA reference lives inside the policy: use the snapshot's base weights instead
+            self.snapshot_ref = AdapterDisabledReference(self.snapshot)
+        else:
+            self.snapshot_ref = trainer.ref_model
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="rollout-worker", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        # Unblock a pending put
+        while self._thread is not None and self._thread.is_alive():
+            try:
+                self.queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self._thread = None
+
+    def _sync_snapshot(self):
+        """Copies the current policy weights into the snapshot, returns their version."""
+        with self.trainer.policy_lock, torch.no_grad():
+            self.snapshot.load_state_dict(self.trainer.compute_model.state_dict())
+            return self.trainer.policy_version
+
+    def _acquire_slot(self):
+        while not self._stop.is_set():
+            if self._slots.acquire(timeout=0.1):
+                return True
+        return False
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self):
+        try:
+            for batch in self.batches:
+                if not self._acquire_slot():
+                    return
+                version = self._sync_snapshot()
+                rollout = self.trainer.generate_rollouts(
+                    batch['prompt'],
+                    batch['current_price'],
+                    batch['next_price'],
+                    model=self.snapshot,
+                    ref_model=self.snapshot_ref,
+                    prompt_indices=batch.get('index')
+                )
+                if not self._put((version, rollout)):
+                    return
+        except Exception as e:
+            self._put(e)
+            return
+        self._put(None)
+
+    def __iter__(self):
+        if self._thread is None:
+            self.start()
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                self._slots.release()
+                version, rollout = item
+                if self.trainer.policy_version - version > self.max_staleness:
+                    self.dropped += 1
+                    continue
+                yield rollout
+        finally:
+            self.close()
@@ -0,0 +1,127 @@
+import torch
+import torch.nn.functional as F
+
+# Rollout entries laid out per token: prompts are left padded, completions right padded
+PROMPT_KEYS = ('prompt_ids', 'prompt_mask')
+COMPLETION_KEYS = ('completion_ids', 'completion_mask', 'old_log_probs', 'ref_log_probs')
+
+class ExperienceBuffer:
+    """
+    Stores rollouts (prompt ids, completion ids, old/ref log probs, rewards, advantages)
+    so they can be reused for several epochs of shuffled mini-batch updates.
+
+    Samples are kept grouped: the group_size completions of a prompt are contiguous, and
+    mini-batches are drawn as whole groups.
+    """
+    def __init__(self, group_size, pad_token_id=0):
+        self.group_size = group_size
+        self.pad_token_id = pad_token_id
+        self.data = None
+
+    def __len__(self):
+        """Number of groups in the buffer."""
+        if self.data is None:
+            return 0
+        return self.data['advantages'].shape[0] // self.group_size
+
+    def clear(self):
+        self.data = None
+
+    def _pad_value(self, key):
+        return self.pad_token_id if key.endswith('_ids') else 0
+
+    def add(self, rollout):
+        """
+        Appends a rollout dict as returned by GRPOTrainer.generate_rollouts.
+        """
+        rollout = {k: v.detach() for k, v in rollout.items() if torch.is_tensor(v)}
+        if self.data is None:
+            self.data = rollout
+            return
+
+        merged = {}
+        for key, value in rollout.items():
+            stored = self.data[key]
+            if key in PROMPT_KEYS or key in COMPLETION_KEYS:
+                width = max(stored.shape[1], value.shape[1])
+                # Prompts grow on the left, completions on the right
+                side = (1, 0) if key in PROMPT_KEYS else (0, 1)
+                stored, value = [
+                    F.pad(t, tuple(s * (width - t.shape[1]) for s in side), value=self._pad_value(key))
+                    for t in (stored, value)
+                ]
+            merged[key] = torch.cat([stored, value])
+        self.data = merged
+
+    def mini_batches(self, groups_per_batch=None, shuffle=True):
+        """
+        Yields rollout dicts of groups_per_batch whole groups (all of them if None),
+        in a random order if shuffle. Padding columns no sample of the mini-batch uses are dropped.
+        """
+        num_groups = len(self)
+        groups_per_batch = groups_per_batch or num_groups
+        order = torch.randperm(num_groups) if shuffle else torch.arange(num_groups)
+        for start in range(0, num_groups, groups_per_batch):
+            groups = order[start:start + groups_per_batch]
+            rows = (groups.unsqueeze(1) * self.group_size + torch.arange(self.group_size)).view(-1)
+            rows = rows.to(self.data['advantages'].device)
+            yield trim_padding({k: v[rows] for k, v in self.data.items()})
+
+def trim_padding(batch):
+    """
+    Drops the prompt (left) and completion (right) padding columns no sample of the batch uses.
+    """
+    prompt_used = batch['prompt_mask'].any(dim=0).nonzero()
+    prompt_start = int(prompt_used[0]) if len(prompt_used) else 0
+    completion_used = batch['completion_mask'].any(dim=0).nonzero()
+    completion_end = int(completion_used[-1]) + 1 if len(completion_used) else 1
+    for key in batch:
+        if key in PROMPT_KEYS:
+            batch[key] = batch[key][:, prompt_start:]
+        elif key in COMPLETION_KEYS:
+            batch[key] = batch[key][:, :completion_end]
+    return batch
+
+def split_micro_batches(batch, group_size, max_tokens=None):
+    """
+    Packs the groups of a batch into micro-batches of at most max_tokens padded tokens
+    (rows * (prompt length + completion length)), for gradient accumulation.
+
+    Groups are packed longest first, so groups of similar lengths share a micro-batch and
+    little compute is spent on padding. A group larger than max_tokens gets a micro-batch
+    of its own.
+
+    Returns:
+        List of trimmed micro-batch dicts; the whole batch if max_tokens is None.
+    """
+    if max_tokens is None:
+        return [batch]
+
+    num_groups = batch['advantages'].shape[0] // group_size
+    prompt_lens = batch['prompt_mask'].sum(dim=1).view(num_groups, group_size).max(dim=1).values
+    completion_lens = batch['completion_mask'].sum(dim=1).view(num_groups, group_size).max(dim=1).values
+    order = torch.argsort(completion_lens + prompt_lens, descending=True).tolist()
+
+    micro_batches = []
+    current = []
+    max_prompt = max_completion = 0
+    for group in order:
+        new_prompt = max(max_prompt, int(prompt_lens[group]))
+        new_completion = max(max_completion, int(completion_lens[group]))
+        cost = (len(current) + 1) * group_size * (new_prompt + new_completion)
+        if current and cost > max_tokens:
+            micro_batches.append(current)
+            current = []
+            new_prompt = int(prompt_lens[group])
+            new_completion = int(completion_lens[group])
+        current.append(group)
+        max_prompt, max_completion = new_prompt, new_completion
+    if current:
+        micro_batches.append(current)
+
+    device = batch['advantages'].device
+    result = []
+    for groups in micro_batches:
+        rows = (torch.tensor(groups).unsqueeze(1) * group_size + torch.arange(group_size)).view(-1).to(device)
+        result.append(trim_padding({k: v[rows] for k, v in batch.items()}))
+    return result
@@ -0,0 +1,152 @@
+import glob
+import json
+import os
+import random
+import shutil
+import threading
+import numpy as np
+import torch
+
+CHECKPOINT_PREFIX = "checkpoint-"
+STATE_FILE = "trainer_state.json"
+
+def _to_cpu(obj):
+    """Deep copy of the tensors of a (nested) state dict to CPU memory."""
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {key: _to_cpu(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(value) for value in obj)
+    return obj
+
+def capture_rng_state():
+    state = {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+def restore_rng_state(state):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+class AsyncCheckpointer:
+    """
+    Writes training checkpoints from a background thread so the training loop is not blocked
+    by disk I/O.
+
+    save() copies the weights, optimizer state and RNG state to CPU memory on the calling thread
+    (the only blocking part), then a thread writes them to output_dir/checkpoint-<step>/:
+        model.safetensors   weights
+        optimizer.pt        optimizer state
+        rng_rank<r>.pt      python / numpy / torch RNG states of every rank
+        sampler_rank<r>.pt  state of every rank's data sampler, if given (e.g. prompt priorities)
+        trainer_state.json  step, data position and trainer counters, written last: only
+                            directories holding it are complete checkpoints
+    At most one save is in flight; the keep_last most recent checkpoints are kept.
+    Under torch.distributed every rank saves its RNG state, rank 0 saves everything else.
+    """
+    def __init__(self, output_dir, keep_last=2, rank=0):
+        self.output_dir = output_dir
+        self.keep_last = keep_last
+        self.rank = rank
+        self._thread = None
+        self._error = None
+
+    def save(self, step, model, optimizer, trainer_state, sampler_state=None):
+        self.wait()
+        snapshot = {'rng': capture_rng_state(), 'sampler': _to_cpu(sampler_state)}
+        if self.rank == 0:
+            snapshot['model'] = {name: tensor.contiguous() for name, tensor in _to_cpu(model.state_dict()).items()}
+            snapshot['optimizer'] = _to_cpu(optimizer.state_dict())
+            snapshot['trainer_state'] = dict(trainer_state, step=step)
+        self._thread = threading.Thread(target=self._write, args=(step, snapshot), name="checkpoint-writer", daemon=True)
+        self._thread.start()
+
+    def wait(self):
+        """Blocks until the pending save is on disk; re-raises its error if it failed."""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _write(self, step, snapshot):
+        from safetensors.torch import save_file
+
+        try:
+            path = os.path.join(self.output_dir, f"{CHECKPOINT_PREFIX}{step}")
+            os.makedirs(path, exist_ok=True)
+            torch.save(snapshot['rng'], os.path.join(path, f"rng_rank{self.rank}.pt"))
+            if snapshot['sampler'] is not None:
+                torch.save(snapshot['sampler'], os.path.join(path, f"sampler_rank{self.rank}.pt"))
+            if self.rank != 0:
+                return
+
+            save_file(snapshot['model'], os.path.join(path, "model.safetensors"))
+            torch.save(snapshot['optimizer'], os.path.join(path, "optimizer.pt"))
+            # Written last and atomically: marks the checkpoint complete
+            tmp_state = os.path.join(path, STATE_FILE + ".tmp")
+            with open(tmp_state, "w") as f:
+                json.dump(snapshot['trainer_state'], f, indent=2)
+            os.replace(tmp_state, os.path.join(path, STATE_FILE))
+            self._prune()
+        except Exception as e:
+            self._error = e
+
+    def _prune(self):
+        checkpoints = list_checkpoints(self.output_dir)
+        for path in checkpoints[:-self.keep_last] if self.keep_last else []:
+            shutil.rmtree(path, ignore_errors=True)
+
+def list_checkpoints(output_dir):
+    """Complete checkpoint directories of output_dir, oldest first."""
+    paths = [
+        path for path in glob.glob(os.path.join(output_dir, f"{CHECKPOINT_PREFIX}*"))
+        if os.path.exists(os.path.join(path, STATE_FILE))
+    ]
+    return sorted(paths, key=lambda path: int(path.rsplit("-", 1)[-1]))
+
+def latest_checkpoint(output_dir):
+    checkpoints = list_checkpoints(output_dir)
+    if not checkpoints:
+        raise FileNotFoundError(f"No complete checkpoint in {output_dir}")
+    return checkpoints[-1]
+
+def load_checkpoint(path, model, optimizer=None, rank=0):
+    """
+    Restores the weights, optimizer state and this rank's RNG state of a checkpoint.
+
+    Returns:
+        The trainer_state dict passed to AsyncCheckpointer.save (plus its 'step'), and this
+        rank's sampler_state under 'sampler' if one was saved.
+    """
+    from safetensors.torch import load_file
+
+    print(f"Resuming from {path}")
+    state_dict = load_file(os.path.join(path, "model.safetensors"))
+    device = next(model.parameters()).device
+    model.load_state_dict({name: tensor.to(device) for name, tensor in state_dict.items()})
+    if optimizer is not None:
+        optimizer.load_state_dict(torch.load(os.path.join(path, "optimizer.pt"), map_location=device))
+
+    rng_path = os.path.join(path, f"rng_rank{rank}.pt")
+    if os.path.exists(rng_path):
+        restore_rng_state(torch.load(rng_path, weights_only=False))
+    else:
+        print(f"Warning: no RNG state for rank {rank} in {path}")
+
+    with open(os.path.join(path, STATE_FILE)) as f:
+        state = json.load(f)
+    sampler_path = os.path.join(path, f"sampler_rank{rank}.pt")
+    if os.path.exists(sampler_path):
+        state['sampler'] = torch.load(sampler_path)
+    return state
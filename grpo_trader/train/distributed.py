@@ -0,0 +1,68 @@
+import os
+import torch
+import torch.distributed as dist
+
+def init_distributed(backend="gloo"):
+    """
+    Joins the process group set up by torchrun (RANK / WORLD_SIZE / MASTER_ADDR env vars).
+
+    Returns:
+        (rank, world_size); (0, 1) when not launched with torchrun.
+    """
+    world_size = int(os.environ.get("WORLD_SIZE", 1))
+    if world_size == 1:
+        return 0, 1
+    if not dist.is_initialized():
+        dist.init_process_group(backend=backend)
+    return dist.get_rank(), dist.get_world_size()
+
+def get_world_size():
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_world_size()
+    return 1
+
+def is_main_process():
+    return not (dist.is_available() and dist.is_initialized()) or dist.get_rank() == 0
+
+def broadcast_parameters(model, src=0):
+    """
+    Copies the parameters and buffers of rank src to every rank, e.g. after a random
+    (LoRA) initialisation.
+    """
+    with torch.no_grad():
+        for tensor in list(model.parameters()) + list(model.buffers()):
+            dist.broadcast(tensor.data, src=src)
+
+def all_reduce_max(value):
+    """Maximum of an integer over all ranks."""
+    tensor = torch.tensor([value], dtype=torch.long)
+    dist.all_reduce(tensor, op=dist.ReduceOp.MAX)
+    return int(tensor.item())
+
+def all_reduce_gradients(parameters, weight):
+    """
+    Replaces the gradients of every rank by their weighted mean over all ranks.
+
+    Each rank's gradients are the mean over its own samples, so weighting them by the local
+    number of samples gives the gradient of the mean over the global batch even when ranks hold
+    different amounts of data. A rank with weight 0 (nothing to train on) still takes part.
+    All gradients travel in a single flat buffer, i.e. one collective per optimizer step.
+
+    Returns:
+        Total weight over all ranks.
+    """
+    parameters = [p for p in parameters if p.requires_grad]
+    grads = [p.grad if p.grad is not None else torch.zeros_like(p) for p in parameters]
+    device = grads[0].device if grads else "cpu"
+    flat = torch.cat([g.reshape(-1).float() for g in grads] + [torch.ones(1, device=device)]) * weight
+    dist.all_reduce(flat, op=dist.ReduceOp.SUM)
+
+    total_weight = flat[-1].item()
+    if total_weight > 0:
+        flat /= total_weight
+    offset = 0
+    for param, grad in zip(parameters, grads):
+        numel = grad.numel()
+        param.grad = flat[offset:offset + numel].view_as(grad).to(grad.dtype)
+        offset += numel
+    return total_weight
@@ -1,8 +1,95 @@
 import torch
 from torch.utils.data import DataLoader
 from tqdm import tqdm
+from transformers import LogitsProcessor, LogitsProcessorList, StopStringCriteria, StoppingCriteriaList
+import contextlib
 import copy
-from ..train.loss import compute_grpo_loss
+import itertools
+import threading
+from ..model.modeling import AdapterDisabledReference
+from ..train.buffer import ExperienceBuffer, split_micro_batches, trim_padding
+from ..train.distributed import all_reduce_gradients, all_reduce_max, get_world_size
+from ..train.metrics import StepMetrics
+from ..train.precision import MasterWeights
+from ..train.profiling import StepProfiler
+from ..train.loss import (
+    compute_grpo_loss, compute_token_log_probs, pack_sequences, prefill_shared_prompts, selective_log_probs
+)
+
+class AnswerStopCriteria(StopStringCriteria):
+    """
+    Finishes each sequence of a generate call as soon as it has emitted the closing answer tag.
+    Everything after the tag is ignored by the reward, so decoding it is wasted work.
+
+    Also records the completion length at which every sequence stopped (-1 if it never did).
+    """
+    def __init__(self, tokenizer, stop_string="</answer>"):
+        super().__init__(tokenizer, [stop_string])
+        self.stop_lengths = None
+        self.prompt_width = 0
+
+    def reset(self, batch_size, prompt_width, device):
+        self.stop_lengths = torch.full((batch_size,), -1, dtype=torch.long, device=device)
+        self.prompt_width = prompt_width
+
+    def __call__(self, input_ids, scores, **kwargs):
+        is_done = super().__call__(input_ids, scores, **kwargs)
+        newly_done = is_done & (self.stop_lengths < 0)
+        self.stop_lengths[newly_done] = input_ids.shape[1] - self.prompt_width
+        return self.stop_lengths >= 0
+
+class SampledTokenLogProbs(LogitsProcessor):
+    """
+    Collects the log probs of the tokens sampled by a generate call under the raw (unprocessed)
+    logits, so the old policy log probs come for free instead of from an extra forward pass.
+
+    Only the last step's vocab-sized logits are held, where output_logits=True keeps every step
+    until generate returns (N x C x V floats). The raw logits are read from the model's output
+    by a forward hook, since generate applies its own processors (e.g. a repetition penalty)
+    before this one. The token sampled at a step is only known at the next step, in input_ids.
+
+    Usage:
+        with SampledTokenLogProbs(model) as old_log_probs:
+            sequences = model.generate(..., logits_processor=LogitsProcessorList([old_log_probs]))
+        log_probs = old_log_probs.result(sequences)
+    """
+    def __init__(self, model):
+        # generate runs the forward of the transformers model (the base model of a PEFT model)
+        self.model = model.get_base_model() if hasattr(model, "get_base_model") else model
+        self.log_probs = []
+        self._latest = None
+        self._previous = None
+        self._handle = None
+
+    def __enter__(self):
+        self.log_probs = []
+        self._latest = self._previous = None
+        self._handle = self.model.register_forward_hook(self._hook)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._handle.remove()
+        self._handle = None
+
+    def _hook(self, module, args, output):
+        self._latest = output.logits[:, -1].float()
+
+    def __call__(self, input_ids, scores):
+        if self._previous is not None:
+            self.log_probs.append(selective_log_probs(self._previous, input_ids[:, -1]))
+        self._previous = self._latest
+        return scores
+
+    def result(self, sequences):
+        """
+        Log probs [N, C] of the C generated tokens, given the sequences returned by generate
+        (their last token was sampled from the last step held).
+        """
+        self.log_probs.append(selective_log_probs(self._previous, sequences[:, -1]))
+        log_probs = torch.stack(self.log_probs, dim=1)
+        self.log_probs = []
+        self._latest = self._previous = None
+        return log_probs
 
 class GRPOTrainer:
     def __init__(
@@ -14,9 +101,44 @@ class GRPOTrainer:
         group_size=4,
         beta=0.01,
         clip_eps=0.2,
-        device="cpu"
+        device="cpu",
+        max_new_tokens=128,
+        temperature=0.9,
+        rollout_token_budget=None,
+        kl_estimator="k3",
+        ref_model=None,
+        share_prompt_cache=True,
+        stop_at_answer=True,
+        ppo_epochs=1,
+        mini_batch_groups=None,
+        max_tokens_per_micro_batch=None,
+        pack_sequences=False,
+        dynamic_sampling=False,
+        max_refill_batches=0,
+        metrics_path=None,
+        profile_steps=None,
+        profile_dir="profiles",
+        fused_loss=False,
+        gradient_checkpointing=False,
+        autocast_dtype=None,
+        master_weights_dtype=None,
+        prompt_sampler=None
     ):
         self.model = model
+        # master_weights_dtype (e.g. torch.bfloat16): model keeps fp32 master weights for the
+        # optimizer and checkpoints, a compute copy in that dtype runs generation and backward
+        self.master_weights = MasterWeights(model, master_weights_dtype) if master_weights_dtype else None
+        self.compute_model = self.master_weights.compute_model if self.master_weights else model
+        # Recompute the activations of every layer in backward instead of storing them
+        self.gradient_checkpointing = gradient_checkpointing
+        if gradient_checkpointing:
+            self.compute_model.gradient_checkpointing_enable(gradient_checkpointing_kwargs={"use_reentrant": False})
+            # HF drops the KV cache of checkpointed layers in training mode: the model stays in eval
+            # mode (generation, shared prompt prefill) and only trains inside accumulate_gradients
+            self.compute_model.eval()
+        # Run the scoring forwards (policy and reference) under torch.autocast in this dtype
+        # (e.g. torch.bfloat16, on CPU too)
+        self.autocast_dtype = autocast_dtype
         self.tokenizer = tokenizer
         self.env = env
         self.optimizer = optimizer
@@ -24,114 +146,511 @@ class GRPOTrainer:
         self.beta = beta
         self.clip_eps = clip_eps
         self.device = device
-        
-        # Create reference model (frozen copy)
-        self.ref_model = copy.deepcopy(model)
-        self.ref_model.eval()
-        for param in self.ref_model.parameters():
-            param.requires_grad = False
-            
-    def train_step(self, batch_data):
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        # Max number of tokens (prompt + max_new_tokens, summed over sequences) per generate call.
+        # None generates the whole batch (batch_size * group_size sequences) in a single call.
+        self.rollout_token_budget = rollout_token_budget
+        # "k1"/"k2"/"k3": sampled-token KL against reference log probs cached once per rollout.
+        # "full": exact KL over the whole vocab, rerunning the reference model inside the loss.
+        self.kl_estimator = kl_estimator
+        # Compute the policy log probs with the output projection fused in, chunk by chunk, so no
+        # vocab-sized logits are stored for backward. Needs a sampled-token KL estimator.
+        if fused_loss and kl_estimator == "full":
+            raise ValueError("fused_loss needs a sampled-token KL estimator (k1/k2/k3), not 'full'")
+        self.fused_loss = fused_loss
+        # Prefill each prompt once and share its KV cache across the group_size samples,
+        # both when generating and when scoring the completions
+        self.share_prompt_cache = share_prompt_cache
+        # Score the policy and reference forwards on padding-free packed sequences. Takes
+        # precedence over share_prompt_cache (every sample then runs its own prompt tokens).
+        self.pack_sequences = pack_sequences
+        # Stop every sequence right after "</answer>" instead of decoding up to max_new_tokens
+        self.stop_criteria = AnswerStopCriteria(tokenizer) if stop_at_answer else None
+        # Decode steps (batched forwards of a generate call) not run thanks to the answer stop.
+        # A batched generate only ends once every sequence has stopped (at the tag or at EOS), so
+        # steps are only saved when the last sequence to finish stopped at the tag.
+        self.decode_steps_saved = 0
+        # Each rollout is reused for ppo_epochs passes of shuffled mini-batches of
+        # mini_batch_groups prompt groups (None: the whole batch), one optimizer step each
+        self.ppo_epochs = ppo_epochs
+        self.mini_batch_groups = mini_batch_groups
+        self.buffer = ExperienceBuffer(group_size, tokenizer.pad_token_id)
+        # Token budget of one forward/backward: each optimizer step accumulates gradients over
+        # micro-batches of whole groups of at most this many (padded) tokens. None: no split.
+        self.max_tokens_per_micro_batch = max_tokens_per_micro_batch
+        # Drop the groups whose G rewards are all equal (zero advantages, hence zero gradient)
+        # right after the reward, before any scoring forward. train_step can draw up to
+        # max_refill_batches extra batches to refill the dropped groups.
+        self.dynamic_sampling = dynamic_sampling
+        self.max_refill_batches = max_refill_batches
+        self.groups_sampled = 0
+        self.groups_skipped = 0
+        # e.g. a PrioritizedSampler: receives the rewards and advantages of every scored group
+        # (before dynamic sampling drops any), keyed by the dataset index of its prompt
+        self.prompt_sampler = prompt_sampler
+        # Per-phase wall times and token throughput of every step, written as JSONL to metrics_path
+        self.metrics = StepMetrics(metrics_path)
+        # (first_step, last_step): capture a torch.profiler trace of these steps into profile_dir
+        self.profiler = StepProfiler(*profile_steps, output_dir=profile_dir) if profile_steps else None
+        # Number of rollouts trained on so far. The lock guards in-place weight updates so a
+        # background rollout worker can take a consistent snapshot of the policy.
+        self.policy_version = 0
+        self.policy_lock = threading.Lock()
+
+        # Decoder-only generation needs the prompts aligned on the right
+        self.tokenizer.padding_side = "left"
+
+        if ref_model is not None:
+            # e.g. a frozen model memory-mapped from a safetensors checkpoint (load_reference_model)
+            self.ref_model = ref_model
+        elif hasattr(model, "disable_adapter"):
+            # LoRA policy: the reference is the same base weights with the adapter disabled
+            self.ref_model = AdapterDisabledReference(self.compute_model)
+        else:
+            # Create reference model (frozen copy)
+            self.ref_model = copy.deepcopy(model)
+            self.ref_model.eval()
+            for param in self.ref_model.parameters():
+                param.requires_grad = False
+
+    def _render_prompt(self, prompt):
         """
-        Performs a single training step using GRPO.
+        Turns a prompt (plain string or chat messages) into the text fed to the tokenizer.
         """
-        prompts = batch_data['prompt'] # List of strings
-        current_prices = batch_data['current_price']
-        next_prices = batch_data['next_price']
-        
-        # 1. Sampling: Generate G completions for each prompt
-        # We process one prompt at a time for simplicity in this demo, 
-        # but in production you'd batch this.
-        
-        total_loss = 0
-        
-        for i, prompt in enumerate(prompts):
-            # Duplicate prompt G times
-            batch_prompts = [prompt] * self.group_size
-            
-            inputs = self.tokenizer(batch_prompts, return_tensors="pt", padding=True, truncation=True).to(self.device)
-            
-            # Generate completions
-            # Note: We need to handle the fact that we want to train on the completion,
-            # so we should generate and then concatenate, or use the model's generate method
-            # and get the full sequence.
-            
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    **inputs,
-                    max_new_tokens=128,
+        if isinstance(prompt, str):
+            return prompt
+        if getattr(self.tokenizer, "chat_template", None):
+            return self.tokenizer.apply_chat_template(prompt, tokenize=False, add_generation_prompt=True)
+        return "\n".join(message["content"] for message in prompt)
+
+    def _chunk_prompts(self, prompt_lengths):
+        """
+        Splits prompt indices into consecutive chunks whose generate call fits the token budget.
+        Every chunk holds whole groups, so group statistics never straddle two generate calls.
+        """
+        if self.rollout_token_budget is None:
+            return [list(range(len(prompt_lengths)))]
+
+        chunks = []
+        current = []
+        current_max_len = 0
+        for i, length in enumerate(prompt_lengths):
+            max_len = max(current_max_len, length)
+            cost = (len(current) + 1) * self.group_size * (max_len + self.max_new_tokens)
+            if current and cost > self.rollout_token_budget:
+                chunks.append(current)
+                current = []
+                max_len = length
+            current.append(i)
+            current_max_len = max_len
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def _completion_mask(self, completion_ids, lengths=None):
+        """
+        Marks completion tokens up to and including the first EOS, and within lengths
+        (where generation was stopped) if given. Everything after it is padding.
+        """
+        is_eos = completion_ids == self.tokenizer.eos_token_id
+        # Number of EOS tokens strictly before each position
+        eos_before = torch.cumsum(is_eos.long(), dim=1) - is_eos.long()
+        mask = eos_before == 0
+        if lengths is not None:
+            positions = torch.arange(completion_ids.shape[1], device=completion_ids.device)
+            mask &= positions.unsqueeze(0) < lengths.unsqueeze(1)
+        return mask.long()
+
+    @torch.no_grad()
+    def generate_rollouts(self, prompts, current_prices, next_prices, model=None, ref_model=None, prompt_indices=None):
+        """
+        Samples group_size completions for every prompt of the batch and scores them.
+
+        Generation is batched across prompts (left padded), optionally split into several
+        generate calls by rollout_token_budget. model / ref_model default to the trainer's
+        policy and reference (a rollout worker passes its policy snapshot instead).
+        prompt_indices (the dataset indices of the prompts) are reported to the prompt sampler.
+
+        Returns:
+            Dict with left padded prompt ids/mask [N, P], right padded completion ids/mask [N, C],
+            the sampling log probs of the completion tokens [N, C] (the "old policy"),
+            the reference log probs of the completion tokens [N, C] (sampled-token KL modes only),
+            rewards and group-normalised advantages [N], where N = len(prompts) * group_size and
+            the G samples of a prompt are contiguous.
+        """
+        model = model if model is not None else self.compute_model
+        ref_model = ref_model if ref_model is not None else self.ref_model
+
+        with self.metrics.phase('tokenize'):
+            texts = [self._render_prompt(prompt) for prompt in prompts]
+            inputs = self.tokenizer(texts, return_tensors="pt", padding=True, truncation=True)
+            prompt_lengths = inputs['attention_mask'].sum(dim=1).tolist()
+
+        prompt_chunks = []
+        completion_chunks = []
+        log_prob_chunks = []
+        length_chunks = []
+        for chunk in self._chunk_prompts(prompt_lengths):
+            chunk_ids = inputs['input_ids'][chunk]
+            chunk_mask = inputs['attention_mask'][chunk]
+            # Drop the left padding shared by every prompt of the chunk
+            width = int(max(prompt_lengths[i] for i in chunk))
+            chunk_ids = chunk_ids[:, -width:].to(self.device)
+            chunk_mask = chunk_mask[:, -width:].to(self.device)
+
+            generate_kwargs = {}
+            old_log_probs = SampledTokenLogProbs(model)
+            with self.metrics.phase('generate'), old_log_probs:
+                if self.share_prompt_cache and width > 1:
+                    # generate only runs the last prompt token on top of the expanded cache
+                    generate_kwargs['past_key_values'] = prefill_shared_prompts(model, chunk_ids, chunk_mask, self.group_size)
+                chunk_ids = chunk_ids.repeat_interleave(self.group_size, dim=0)
+                chunk_mask = chunk_mask.repeat_interleave(self.group_size, dim=0)
+                if self.stop_criteria is not None:
+                    self.stop_criteria.reset(chunk_ids.shape[0], width, self.device)
+                    generate_kwargs['stopping_criteria'] = StoppingCriteriaList([self.stop_criteria])
+
+                sequences = model.generate(
+                    input_ids=chunk_ids,
+                    attention_mask=chunk_mask,
+                    max_new_tokens=self.max_new_tokens,
                     do_sample=True,
-                    temperature=0.9,
-                    pad_token_id=self.tokenizer.pad_token_id
+                    temperature=self.temperature,
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    # Gathers the sampled token log probs step by step (most of the old_log_prob work)
+                    logits_processor=LogitsProcessorList([old_log_probs]),
+                    **generate_kwargs
                 )
-            
-            # Decode to get text for reward calculation
-            completions_text = self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
-            
-            # 2. Reward Calculation
-            rewards = self.env.calculate_reward(
-                completions_text, 
-                current_prices[i], 
-                next_prices[i]
-            )
+            completion_ids = sequences[:, width:]
+            prompt_chunks.append((chunk_ids, chunk_mask))
+            completion_chunks.append(completion_ids)
+            with self.metrics.phase('old_log_prob'):
+                log_prob_chunks.append(old_log_probs.result(sequences))
+
+            lengths = torch.full((completion_ids.shape[0],), completion_ids.shape[1], dtype=torch.long, device=self.device)
+            if self.stop_criteria is not None:
+                stopped = self.stop_criteria.stop_lengths >= 0
+                lengths[stopped] = self.stop_criteria.stop_lengths[stopped]
+                # generate ended early thanks to the stop only if the last sequence to finish stopped
+                # at the tag: when it ended at EOS, the tag stops saved no step
+                if stopped.any() and int(self.stop_criteria.stop_lengths.max()) == completion_ids.shape[1]:
+                    self.decode_steps_saved += self.max_new_tokens - completion_ids.shape[1]
+            length_chunks.append(lengths)
+
+        # Re-assemble the chunks: prompts stay left padded, completions right padded
+        prompt_width = max(ids.shape[1] for ids, _ in prompt_chunks)
+        completion_width = max(ids.shape[1] for ids in completion_chunks)
+        pad_id = self.tokenizer.pad_token_id
+        prompt_ids = torch.cat([
+            torch.nn.functional.pad(ids, (prompt_width - ids.shape[1], 0), value=pad_id) for ids, _ in prompt_chunks
+        ])
+        prompt_mask = torch.cat([
+            torch.nn.functional.pad(mask, (prompt_width - mask.shape[1], 0), value=0) for _, mask in prompt_chunks
+        ])
+        completion_ids = torch.cat([
+            torch.nn.functional.pad(ids, (0, completion_width - ids.shape[1]), value=pad_id) for ids in completion_chunks
+        ])
+        # Sequences stopped at the answer tag are followed by padding, which is not always EOS
+        completion_mask = self._completion_mask(completion_ids, torch.cat(length_chunks))
+        old_log_probs = torch.cat([
+            torch.nn.functional.pad(lp, (0, completion_width - lp.shape[1]), value=0.0) for lp in log_prob_chunks
+        ]) * completion_mask
+
+        self.metrics.count(
+            prompt_tokens=prompt_mask.sum(),
+            generated_tokens=completion_mask.sum(),
+            real_tokens=prompt_mask.sum() + completion_mask.sum(),
+            padded_tokens=prompt_mask.numel() + completion_mask.numel()
+        )
+
+        with self.metrics.phase('reward'):
+            # Decode only the completions: the prompt itself contains an "<answer> Action </answer>" example
+            completions_text = self.tokenizer.batch_decode(completion_ids, skip_special_tokens=True)
+
+            # Reward Calculation, one group per prompt
+            rewards = []
+            for i in range(len(prompts)):
+                group_text = completions_text[i * self.group_size:(i + 1) * self.group_size]
+                rewards.extend(self.env.calculate_reward(group_text, float(current_prices[i]), float(next_prices[i])))
             rewards_tensor = torch.tensor(rewards, device=self.device, dtype=torch.float32)
-            
-            # 3. Advantage Calculation (Group Normalization)
-            mean_reward = rewards_tensor.mean()
-            std_reward = rewards_tensor.std() + 1e-8
-            advantages = (rewards_tensor - mean_reward) / std_reward
-            
-            # 4. Compute Old Log Probs (of the generated sequence)
-            # We treat the generated sequence as the "experience"
-            # For the first step, old_policy == current_policy
-            # In true PPO, we'd collect experience first, then train for K epochs.
-            # GRPO often does this online or with a small buffer. 
-            # Here we do a single update step per generation (online).
-            
-            # We need to compute log probs of the *generated* tokens under the *current* model (which is "old" for the backward pass)
-            # Ideally we would have saved log_probs during generation, but HF generate doesn't always return them easily structured.
-            # So we do a forward pass.
-            
-            with torch.no_grad():
-                # We use the outputs (full sequence) as input
-                # Create attention mask
-                gen_attention_mask = (outputs != self.tokenizer.pad_token_id).long()
-                
-                fwd_outputs = self.model(input_ids=outputs, attention_mask=gen_attention_mask)
-                logits = fwd_outputs.logits
-                log_probs = torch.nn.functional.log_softmax(logits, dim=-1)
-                
-                # Gather log probs of the tokens
-                token_log_probs = torch.gather(log_probs, 2, outputs.unsqueeze(-1)).squeeze(-1)
-                if gen_attention_mask is not None:
-                    token_log_probs = token_log_probs * gen_attention_mask
-                old_sequence_log_probs = token_log_probs.sum(dim=1)
-            
-            # 5. Loss & Update
-            # Now we compute gradients. We need to run the forward pass AGAIN with gradients enabled
-            # on the SAME outputs.
-            
-            # Prepare inputs for loss function
-            train_inputs = {
-                'input_ids': outputs,
-                'attention_mask': gen_attention_mask
-            }
-            
-            loss, policy_loss, kl_loss = compute_grpo_loss(
-                self.model,
-                train_inputs,
-                old_sequence_log_probs,
-                advantages,
-                ref_model=self.ref_model,
-                beta=self.beta,
-                clip_eps=self.clip_eps
+
+            # Advantage Calculation (Group Normalization)
+            grouped = rewards_tensor.view(len(prompts), self.group_size)
+            mean_reward = grouped.mean(dim=1, keepdim=True)
+            std_reward = grouped.std(dim=1, keepdim=True) + 1e-8
+            advantages = ((grouped - mean_reward) / std_reward).view(-1)
+            if self.prompt_sampler is not None and prompt_indices is not None:
+                self.prompt_sampler.update(prompt_indices, grouped, advantages.view_as(grouped))
+
+        rollout = {
+            'prompt_ids': prompt_ids,
+            'prompt_mask': prompt_mask,
+            'completion_ids': completion_ids,
+            'completion_mask': completion_mask,
+            'old_log_probs': old_log_probs,
+            'rewards': rewards_tensor,
+            'advantages': advantages
+        }
+
+        if self.dynamic_sampling:
+            # Groups with identical rewards have all-zero advantages and contribute no gradient
+            informative = grouped.std(dim=1) > 0
+            self.groups_sampled += len(prompts)
+            self.groups_skipped += int((~informative).sum())
+            rows = informative.repeat_interleave(self.group_size)
+            rollout = trim_padding({k: v[rows] for k, v in rollout.items()})
+
+        # Reference log probs are computed once here and stored with the rollout,
+        # instead of rerunning the reference model on every loss call
+        if self.beta > 0 and self.kl_estimator != "full":
+            if rollout['advantages'].numel() > 0:
+                with self.metrics.phase('ref_log_prob'), self._autocast():
+                    rollout['ref_log_probs'], _, _ = compute_token_log_probs(ref_model, self._model_inputs(rollout))
+            else:
+                rollout['ref_log_probs'] = torch.zeros_like(rollout['old_log_probs'])
+
+        return rollout
+
+    def _model_inputs(self, rollout):
+        """
+        Builds the [Prompt, Completion] model inputs of a rollout for scoring.
+        Only completion tokens are scored, so the vocab projection is limited to their positions.
+        """
+        if self.pack_sequences:
+            return pack_sequences(
+                rollout['prompt_ids'], rollout['prompt_mask'], rollout['completion_ids'], rollout['completion_mask']
             )
-            
-            # Accumulate gradients
-            loss.backward()
-            total_loss += loss.item()
-            
-        self.optimizer.step()
+
+        # Checkpointed layers drop the KV cache in training mode, so the prompt cache cannot be shared
+        if self.share_prompt_cache and not self.gradient_checkpointing and rollout['prompt_ids'].shape[1] > 1:
+            # The G samples of a group share their prompt: keep one row per group
+            return {
+                'prompt_ids': rollout['prompt_ids'][::self.group_size],
+                'prompt_mask': rollout['prompt_mask'][::self.group_size],
+                'completion_ids': rollout['completion_ids'],
+                'completion_mask': rollout['completion_mask'],
+                'group_size': self.group_size
+            }
+
+        attention_mask = torch.cat([rollout['prompt_mask'], rollout['completion_mask']], dim=1)
+        return {
+            'input_ids': torch.cat([rollout['prompt_ids'], rollout['completion_ids']], dim=1),
+            'attention_mask': attention_mask,
+            # Same positions as generate uses for left padded prompts, so the ratio starts at 1
+            'position_ids': (attention_mask.cumsum(dim=1) - 1).clamp(min=0),
+            # The logits predicting the completion tokens: the last prompt position onwards
+            'logits_to_keep': rollout['completion_ids'].shape[1] + 1,
+            'completion_mask': rollout['completion_mask']
+        }
+
+    def state_dict(self):
+        """
+        Trainer counters needed to resume a run (weights and optimizer state are saved separately).
+        """
+        return {
+            'policy_version': self.policy_version,
+            'metrics_step': self.metrics.step,
+            'decode_steps_saved': self.decode_steps_saved,
+            'groups_sampled': self.groups_sampled,
+            'groups_skipped': self.groups_skipped
+        }
+
+    def load_state_dict(self, state):
+        """
+        Restores the counters of state_dict. Call it after loading the checkpointed weights into
+        the model: the low precision compute copy is refreshed from them here.
+        """
+        if self.master_weights is not None:
+            self.master_weights.master_to_compute()
+        self.policy_version = state['policy_version']
+        self.metrics.step = state['metrics_step']
+        self.decode_steps_saved = state.get('decode_steps_saved', 0)
+        self.groups_sampled = state['groups_sampled']
+        self.groups_skipped = state['groups_skipped']
+
+    @property
+    def skipped_group_fraction(self):
+        """Fraction of the sampled groups dropped by dynamic sampling."""
+        return self.groups_skipped / max(self.groups_sampled, 1)
+
+    def train_step(self, batch_data, refill_batches=None):
+        """
+        Performs a single training step using GRPO.
+
+        With dynamic sampling, refill_batches (an iterator of batches, e.g. the rest of the
+        epoch) tops the rollout back up to one group per prompt of batch_data, drawing at most
+        max_refill_batches batches from it.
+        """
+        if self.profiler is not None:
+            # Starts the capture if this (possibly resumed) step is the first one of the window
+            self.profiler.step(self.metrics.step)
+        prompts = batch_data['prompt'] # List of strings or chat messages
+        current_prices = batch_data['current_price']
+        next_prices = batch_data['next_price']
+
+        # 1-3. Sampling, Reward and Advantage for the whole batch
+        rollout = self.generate_rollouts(prompts, current_prices, next_prices, prompt_indices=batch_data.get('index'))
+        if self.dynamic_sampling and refill_batches is not None:
+            rollout = self._refill_rollout(rollout, len(prompts), refill_batches)
+
+        # 4. Updates
+        return self.train_on_rollout(rollout)
+
+    def _refill_rollout(self, rollout, num_groups, refill_batches):
+        """
+        Adds the informative groups of further batches until the rollout holds num_groups groups.
+        """
+        buffer = ExperienceBuffer(self.group_size, self.tokenizer.pad_token_id)
+        buffer.add(rollout)
+        for _ in range(self.max_refill_batches):
+            if len(buffer) >= num_groups:
+                break
+            batch = next(refill_batches, None)
+            if batch is None:
+                break
+            buffer.add(self.generate_rollouts(
+                batch['prompt'], batch['current_price'], batch['next_price'], prompt_indices=batch.get('index')
+            ))
+
+        num_rows = num_groups * self.group_size
+        return trim_padding({k: v[:num_rows] for k, v in buffer.data.items()})
+
+    def train_on_rollout(self, rollout):
+        """
+        Stores the experience and runs K epochs of mini-batch updates over it.
+        Returns the mean loss, or None if the rollout holds no group (all dropped by dynamic sampling).
+        Closes the step of the metrics.
+        """
+        if self.profiler is not None:
+            self.profiler.step(self.metrics.step)
+        if get_world_size() > 1:
+            loss = self._train_on_rollout_distributed(rollout)
+        else:
+            loss = self._train_on_rollout_local(rollout)
+        self.metrics.end_step(loss=loss, groups=rollout['advantages'].shape[0] // self.group_size)
+        if self.profiler is not None:
+            self.profiler.step(self.metrics.step)
+        return loss
+
+    def _train_on_rollout_local(self, rollout):
+        if rollout['advantages'].numel() == 0:
+            return None
+
+        self.buffer.clear()
+        self.buffer.add(rollout)
+        losses = []
+        for _ in range(self.ppo_epochs):
+            for mini_batch in self.buffer.mini_batches(self.mini_batch_groups):
+                losses.append(self.optimize_step(mini_batch))
+        self.policy_version += 1
+
+        return sum(losses) / len(losses)
+
+    def _train_on_rollout_distributed(self, rollout):
+        """
+        Data-parallel train_on_rollout: every rank trains on the groups it generated and the
+        gradients are averaged over all ranks before each optimizer step.
+
+        Ranks may hold different numbers of groups (e.g. after dynamic sampling), so they agree on
+        the number of optimizer steps first; a rank out of mini-batches joins with no gradient.
+        """
+        self.buffer.clear()
+        if rollout['advantages'].numel() > 0:
+            self.buffer.add(rollout)
+        groups_per_batch = self.mini_batch_groups or max(len(self.buffer), 1)
+        local_steps = self.ppo_epochs * -(-len(self.buffer) // groups_per_batch)
+        num_steps = all_reduce_max(local_steps)
+
+        local_batches = (
+            mini_batch
+            for _ in range(self.ppo_epochs if len(self.buffer) else 0)
+            for mini_batch in self.buffer.mini_batches(self.mini_batch_groups)
+        )
+        losses = []
+        for mini_batch in itertools.islice(itertools.chain(local_batches, itertools.repeat(None)), num_steps):
+            loss = self.optimize_step(mini_batch)
+            if mini_batch is not None:
+                losses.append(loss)
+        if num_steps > 0:
+            self.policy_version += 1
+
+        return sum(losses) / len(losses) if losses else None
+
+    def optimize_step(self, rollout):
+        """
+        One optimizer step on a (mini-batch of a) rollout, accumulating gradients over
+        token-budgeted micro-batches. Under torch.distributed the gradients are averaged over
+        the ranks, weighted by their number of sequences (rollout may then be None on a rank
+        with nothing left to train on).
+        """
+        loss = self.accumulate_gradients(rollout) if rollout is not None else 0.0
+        if get_world_size() > 1:
+            num_sequences = rollout['advantages'].shape[0] if rollout is not None else 0
+            with self.metrics.phase('all_reduce'):
+                total_sequences = all_reduce_gradients(self.model.parameters(), num_sequences)
+            if total_sequences == 0:
+                self.optimizer.zero_grad()
+                return loss
+        with self.metrics.phase('optimizer'), self.policy_lock:
+            self.optimizer.step()
+            if self.master_weights is not None:
+                self.master_weights.master_to_compute()
         self.optimizer.zero_grad()
-        
-        return total_loss / len(prompts)
+
+        return loss
+
+    def _autocast(self):
+        if self.autocast_dtype is None:
+            return contextlib.nullcontext()
+        device_type = torch.device(self.device).type
+        return torch.autocast(device_type=device_type, dtype=self.autocast_dtype)
+
+    def accumulate_gradients(self, rollout):
+        """
+        Backward pass of the GRPO loss of a rollout, split into micro-batches of at most
+        max_tokens_per_micro_batch tokens. Each micro-batch loss is weighted so the accumulated
+        gradient equals the gradient of the loss over the whole rollout. Returns that loss.
+        """
+        num_sequences = rollout['advantages'].shape[0]
+        num_tokens = rollout['completion_mask'].sum().clamp(min=1)
+
+        if self.gradient_checkpointing:
+            # HF only checkpoints in training mode; generation stays in eval mode to keep its cache
+            self.compute_model.train()
+        total_loss = 0.0
+        for micro_batch in split_micro_batches(rollout, self.group_size, self.max_tokens_per_micro_batch):
+            # Old Log Probs of the completions
+            # We treat the generated sequence as the "experience". The sampling log probs captured
+            # during generation are the old policy, so no extra forward pass is needed.
+            old_sequence_log_probs = micro_batch['old_log_probs'].sum(dim=1)
+
+            with self.metrics.phase('loss_forward'), self._autocast():
+                loss, policy_loss, kl_loss = compute_grpo_loss(
+                    self.compute_model,
+                    self._model_inputs(micro_batch),
+                    old_sequence_log_probs,
+                    micro_batch['advantages'],
+                    ref_model=self.ref_model if self.kl_estimator == "full" else None,
+                    beta=self.beta,
+                    clip_eps=self.clip_eps,
+                    ref_log_probs=micro_batch.get('ref_log_probs'),
+                    kl_estimator=self.kl_estimator,
+                    fused=self.fused_loss
+                )
+
+                # policy_loss is a mean over sequences and kl_loss a mean over completion tokens:
+                # rescale both by the share of the rollout this micro-batch holds
+                sequence_share = micro_batch['advantages'].shape[0] / num_sequences
+                token_share = micro_batch['completion_mask'].sum() / num_tokens
+                loss = policy_loss * sequence_share + self.beta * kl_loss * token_share
+
+            with self.metrics.phase('backward'):
+                loss.backward()
+            total_loss += loss.item()
+
+        if self.gradient_checkpointing:
+            self.compute_model.eval()
+        if self.master_weights is not None:
+            self.master_weights.grads_to_master()
+        return total_loss
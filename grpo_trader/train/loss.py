@@ -1,6 +1,362 @@
 import torch
 import torch.nn.functional as F
 
+class _SelectiveLogProbs(torch.autograd.Function):
+    """
+    log p(label) = logit[label] - logsumexp(logits), streamed over sequence chunks.
+
+    Only the per-token logsumexp is saved for backward. The gradient
+    (onehot(label) - softmax(logits)) * grad is rebuilt chunk by chunk straight into a single
+    logits-shaped buffer, so neither pass allocates a second full [Batch, SeqLen, Vocab] tensor.
+    """
+
+    @staticmethod
+    def forward(ctx, logits, labels, chunk_size):
+        token_log_probs = []
+        lse = []
+        for start in range(0, logits.shape[1], chunk_size):
+            chunk = logits[:, start:start + chunk_size].float()
+            chunk_lse = torch.logsumexp(chunk, dim=-1)
+            label_logits = torch.gather(chunk, 2, labels[:, start:start + chunk_size].unsqueeze(-1)).squeeze(-1)
+            token_log_probs.append(label_logits - chunk_lse)
+            lse.append(chunk_lse)
+        ctx.save_for_backward(logits, labels, torch.cat(lse, dim=1))
+        ctx.chunk_size = chunk_size
+        return torch.cat(token_log_probs, dim=1)
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        logits, labels, lse = ctx.saved_tensors
+        chunk_size = ctx.chunk_size
+        grad_logits = torch.empty_like(logits)
+        for start in range(0, logits.shape[1], chunk_size):
+            end = start + chunk_size
+            grad = grad_output[:, start:end].unsqueeze(-1).float()
+            # float32 logits: compute in place inside grad_logits, no temporaries at all
+            out = grad_logits[:, start:end] if logits.dtype == torch.float32 else None
+            chunk_grad = torch.sub(logits[:, start:end].float(), lse[:, start:end].unsqueeze(-1), out=out)
+            chunk_grad.exp_().mul_(-grad)
+            chunk_grad.scatter_add_(2, labels[:, start:end].unsqueeze(-1), grad)
+            if out is None:
+                grad_logits[:, start:end] = chunk_grad
+        return grad_logits, None, None
+
+def selective_log_probs(logits, labels, chunk_size=256):
+    """
+    Log probabilities of the label tokens without materialising log_softmax over the vocab.
+
+    Processes the sequence in chunks: for each position only logsumexp(logits) and the
+    gathered label logit are kept, so the extra memory is [Batch, chunk_size, Vocab] at most
+    instead of a full [Batch, SeqLen, Vocab] log_softmax (and its gradient).
+
+    Args:
+        logits: [Batch, SeqLen, Vocab] (or [Batch, Vocab]) logits.
+        labels: [Batch, SeqLen] (or [Batch]) token ids to score.
+        chunk_size: Number of sequence positions processed at once.
+
+    Returns:
+        Float32 tensor shaped like labels.
+    """
+    if logits.dim() == 2:
+        return selective_log_probs(logits.unsqueeze(1), labels.unsqueeze(1), chunk_size).squeeze(1)
+    return _SelectiveLogProbs.apply(logits, labels, chunk_size)
+
+class _LinearSelectiveLogProbs(torch.autograd.Function):
+    """
+    log p(label) of hidden @ weight.T, fused with the output projection and streamed over
+    token and vocab chunks: logits only ever exist as one [chunk_size, vocab_chunk_size] block.
+
+    Forward keeps a running logsumexp over the vocab chunks and saves only that per-token value.
+    Backward recomputes every logits block and accumulates the hidden and weight gradients
+    from it, so no vocab-sized activation is stored, whatever the vocab size.
+    """
+
+    @staticmethod
+    def forward(ctx, hidden, weight, labels, chunk_size, vocab_chunk_size):
+        num_tokens = hidden.shape[0]
+        vocab_size = weight.shape[0]
+        lse = torch.empty(num_tokens, dtype=torch.float32, device=hidden.device)
+        label_logits = torch.empty(num_tokens, dtype=torch.float32, device=hidden.device)
+        for start in range(0, num_tokens, chunk_size):
+            h = hidden[start:start + chunk_size]
+            chunk_labels = labels[start:start + chunk_size]
+            chunk_lse = torch.full((h.shape[0],), float("-inf"), dtype=torch.float32, device=hidden.device)
+            for v_start in range(0, vocab_size, vocab_chunk_size):
+                logits = (h @ weight[v_start:v_start + vocab_chunk_size].to(h.dtype).T).float()
+                chunk_lse = torch.logaddexp(chunk_lse, torch.logsumexp(logits, dim=-1))
+            lse[start:start + chunk_size] = chunk_lse
+            # Label logits straight from the label rows of the weight
+            label_logits[start:start + chunk_size] = (h.float() * weight[chunk_labels].float()).sum(dim=-1)
+        ctx.save_for_backward(hidden, weight, labels, lse)
+        ctx.chunk_size = chunk_size
+        ctx.vocab_chunk_size = vocab_chunk_size
+        return label_logits - lse
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        hidden, weight, labels, lse = ctx.saved_tensors
+        chunk_size, vocab_chunk_size = ctx.chunk_size, ctx.vocab_chunk_size
+        grad_output = grad_output.float()
+        grad_hidden = torch.zeros(hidden.shape, dtype=torch.float32, device=hidden.device)
+        grad_weight = torch.zeros(weight.shape, dtype=torch.float32, device=weight.device)
+        for start in range(0, hidden.shape[0], chunk_size):
+            end = start + chunk_size
+            h = hidden[start:end]
+            g = grad_output[start:end]
+            for v_start in range(0, weight.shape[0], vocab_chunk_size):
+                # Same precision as the forward: the weight in the dtype of the hidden states
+                w = weight[v_start:v_start + vocab_chunk_size].to(h.dtype)
+                # d log p(label) / d logits = onehot(label) - softmax; the one-hot part is added below
+                grad_logits = (h @ w.T).float().sub_(lse[start:end].unsqueeze(1)).exp_().mul_(-g.unsqueeze(1))
+                grad_hidden[start:end] += grad_logits @ w.float()
+                grad_weight[v_start:v_start + vocab_chunk_size] += grad_logits.T @ h.float()
+            grad_hidden[start:end] += g.unsqueeze(1) * weight[labels[start:end]].float()
+            grad_weight.index_add_(0, labels[start:end], g.unsqueeze(1) * h.float())
+        return grad_hidden.to(hidden.dtype), grad_weight.to(weight.dtype), None, None, None
+
+def linear_selective_log_probs(hidden, weight, labels, chunk_size=1024, vocab_chunk_size=8192):
+    """
+    Log probabilities of the label tokens under logits = hidden @ weight.T, without ever
+    materialising the logits: memory beyond the inputs is [chunk_size, vocab_chunk_size].
+
+    Args:
+        hidden: [Tokens, Hidden] final hidden states.
+        weight: [Vocab, Hidden] output projection (lm_head) weight.
+        labels: [Tokens] token ids to score.
+
+    Returns:
+        [Tokens] float32 log probs.
+    """
+    return _LinearSelectiveLogProbs.apply(hidden, weight, labels, chunk_size, vocab_chunk_size)
+
+def prefill_shared_prompts(model, prompt_ids, prompt_mask, group_size):
+    """
+    Prefills each unique prompt once and expands its KV cache to the group_size samples.
+
+    The last prompt token is left out of the cache: it is fed again together with the
+    completion, since its logits predict the first completion token.
+
+    Args:
+        model: Causal LM supporting past_key_values.
+        prompt_ids: [Prompts, PromptLen] left padded unique prompts.
+        prompt_mask: [Prompts, PromptLen] attention mask of the prompts.
+        group_size: Number of samples per prompt; the cache rows of a prompt are contiguous.
+
+    Returns:
+        KV cache with Prompts * group_size rows covering prompt_ids[:, :-1].
+    """
+    position_ids = (prompt_mask.cumsum(dim=1) - 1).clamp(min=0)
+    outputs = model(
+        input_ids=prompt_ids[:, :-1],
+        attention_mask=prompt_mask[:, :-1],
+        position_ids=position_ids[:, :-1],
+        use_cache=True,
+        # Only the cache is needed; skip the vocab projection of the prompt
+        logits_to_keep=1
+    )
+    cache = outputs.past_key_values
+    cache.batch_repeat_interleave(group_size)
+    return cache
+
+def _forward(model, project=True, logits_to_keep=None, **kwargs):
+    """
+    Runs the model and returns its logits, or its final hidden states (before the output
+    projection) if not project, at the logits_to_keep positions (all of them if None).
+    """
+    if project:
+        if logits_to_keep is not None:
+            kwargs['logits_to_keep'] = logits_to_keep
+        return model(**kwargs).logits
+    hidden = model.get_decoder()(**kwargs).last_hidden_state
+    if logits_to_keep is None or isinstance(logits_to_keep, int) and logits_to_keep == 0:
+        return hidden
+    if isinstance(logits_to_keep, int):
+        return hidden[:, -logits_to_keep:]
+    return hidden[:, logits_to_keep]
+
+def _shared_prompt_logits(model, inputs, project=True):
+    """
+    Forward pass over [Prompt, Completion] where each prompt is computed once for its group.
+    Returns the logits (or hidden states) of the last prompt token and of every completion token.
+    """
+    prompt_ids = inputs['prompt_ids']
+    prompt_mask = inputs['prompt_mask']
+    completion_ids = inputs['completion_ids']
+    group_size = inputs['group_size']
+
+    cache = prefill_shared_prompts(model, prompt_ids, prompt_mask, group_size)
+
+    last_position = (prompt_mask.sum(dim=1, keepdim=True) - 1).clamp(min=0).repeat_interleave(group_size, dim=0)
+    offsets = torch.arange(completion_ids.shape[1] + 1, device=completion_ids.device)
+    return _forward(
+        model,
+        project,
+        input_ids=torch.cat([prompt_ids[:, -1:].repeat_interleave(group_size, dim=0), completion_ids], dim=1),
+        attention_mask=torch.cat([prompt_mask.repeat_interleave(group_size, dim=0), inputs['completion_mask']], dim=1),
+        position_ids=last_position + offsets,
+        past_key_values=cache,
+        use_cache=True
+    )
+
+def pack_sequences(prompt_ids, prompt_mask, completion_ids, completion_mask):
+    """
+    Packs the [Prompt, Completion] sequences of a rollout into a single row without padding.
+
+    Real tokens are found from the masks (i.e. the real prompt and completion lengths), never by
+    comparing ids with the pad token, which may also be EOS. Position ids restart at 0 for every
+    sequence, which HF models use to keep attention within each sequence.
+
+    Args:
+        prompt_ids: [Batch, PromptLen] left padded prompts.
+        prompt_mask: [Batch, PromptLen] mask of the real prompt tokens.
+        completion_ids: [Batch, CompLen] right padded completions.
+        completion_mask: [Batch, CompLen] mask of the scored completion tokens.
+
+    Returns:
+        Dict with input_ids and position_ids [1, Tokens], cu_seqlens [Batch + 1] (sequence
+        boundaries), logits_to_keep (indices of the positions predicting a completion token)
+        and completion_mask, the layout the log probs are unpacked to.
+    """
+    mask = torch.cat([prompt_mask, completion_mask], dim=1).bool()
+    input_ids = torch.cat([prompt_ids, completion_ids], dim=1)[mask]
+    is_completion = torch.cat([torch.zeros_like(prompt_mask), completion_mask], dim=1)[mask].bool()
+
+    lengths = mask.sum(dim=1)
+    cu_seqlens = F.pad(lengths.cumsum(dim=0), (1, 0))
+    starts = torch.repeat_interleave(cu_seqlens[:-1], lengths)
+    position_ids = torch.arange(input_ids.shape[0], device=input_ids.device) - starts
+
+    return {
+        'input_ids': input_ids.unsqueeze(0),
+        'position_ids': position_ids.unsqueeze(0),
+        'cu_seqlens': cu_seqlens,
+        # Every completion token is predicted by the logits of the token before it
+        'logits_to_keep': is_completion.nonzero().squeeze(1) - 1,
+        'completion_mask': completion_mask
+    }
+
+def _scored_logits(model, inputs, project=True):
+    """
+    Runs the forward pass and selects the logits, labels and mask of the tokens being scored.
+    If not project, the final hidden states are returned in place of the logits.
+    """
+    if 'cu_seqlens' in inputs:
+        # Packed layout: one row without padding, only the completion positions are projected
+        positions = inputs['logits_to_keep']
+        logits = _forward(
+            model,
+            project,
+            input_ids=inputs['input_ids'],
+            position_ids=inputs['position_ids'],
+            logits_to_keep=positions,
+            # Sequence boundaries are only inferred from position_ids without a KV cache
+            use_cache=False
+        )
+        labels = inputs['input_ids'][:, positions + 1]
+        return logits, labels, torch.ones_like(labels)
+
+    if 'prompt_ids' in inputs:
+        # Shared prompt layout: one prompt per group, completions scored on top of its cache
+        logits = _shared_prompt_logits(model, inputs, project)
+        return logits[:, :-1, :], inputs['completion_ids'], inputs['completion_mask']
+
+    # Everything except the completion mask goes to the model (e.g. position_ids for left padding)
+    logits = _forward(model, project, **{k: v for k, v in inputs.items() if k != 'completion_mask'})
+
+    # inputs['input_ids'] contains [Prompt, Completion]
+    # Logits at position t predict token t+1, so every scored token uses the logits one position earlier.
+    input_ids = inputs['input_ids']
+    completion_mask = inputs.get('completion_mask')
+    if completion_mask is not None:
+        # Only the completion tokens (last CompLen positions) are scored. This also works when the
+        # model only returned the last CompLen + 1 logits (logits_to_keep).
+        completion_len = completion_mask.shape[1]
+        return logits[:, -completion_len - 1:-1, :], input_ids[:, -completion_len:], completion_mask
+
+    attention_mask = inputs.get('attention_mask')
+    if attention_mask is None:
+        attention_mask = torch.ones_like(input_ids)
+    return logits[:, :-1, :], input_ids[:, 1:], attention_mask[:, 1:]
+
+def compute_token_log_probs(model, inputs, fused=False):
+    """
+    Runs the forward pass and returns the log probs of the scored tokens.
+
+    Args:
+        model: Causal LM.
+        inputs: Either tokenized [Prompt, Completion] inputs (input_ids, attention_mask, optional
+            position_ids / logits_to_keep), or the shared prompt layout (prompt_ids and prompt_mask
+            with one row per group, completion_ids, completion_mask and group_size) where every
+            prompt is run once and its KV cache reused by the group_size completions.
+            With a 'completion_mask' [Batch, CompLen] only those last CompLen tokens are scored;
+            otherwise every token after the first is.
+            Passing logits_to_keep=CompLen + 1 lets HF models skip the vocab projection of the prompt.
+            The packed layout of pack_sequences runs every sequence without any padding.
+        fused: Compute the log probs from the final hidden states and the output projection
+            with linear_selective_log_probs, so the logits are never materialised.
+
+    Returns:
+        token_log_probs: [Batch, Len] log probs, zeroed where token_mask is 0.
+        token_mask: [Batch, Len] mask of the scored tokens.
+        logits: [Batch, Len, Vocab] logits the log probs were computed from
+            ([1, Tokens, Vocab] for the packed layout, one row per scored token; None if fused).
+    """
+    if fused:
+        hidden, labels, token_mask = _scored_logits(model, inputs, project=False)
+        # Only the scored tokens go through the output projection
+        scored = token_mask.bool()
+        weight = model.get_output_embeddings().weight
+        token_log_probs = hidden.new_zeros(labels.shape, dtype=torch.float32)
+        token_log_probs = token_log_probs.masked_scatter(
+            scored, linear_selective_log_probs(hidden[scored], weight, labels[scored])
+        )
+        logits = None
+    else:
+        logits, labels, token_mask = _scored_logits(model, inputs)
+
+        # Log prob of the chosen token, computed chunk by chunk without a full-vocab log_softmax
+        # labels: [Batch, Len]
+        # logits: [Batch, Len, Vocab]
+        token_log_probs = selective_log_probs(logits, labels)
+
+    # Masking padding tokens
+    token_log_probs = token_log_probs * token_mask
+
+    if 'cu_seqlens' in inputs:
+        # Scatter the packed log probs back to the right padded [Batch, CompLen] completions
+        token_mask = inputs['completion_mask']
+        packed_log_probs = token_log_probs.squeeze(0)
+        token_log_probs = packed_log_probs.new_zeros(token_mask.shape)
+        token_log_probs = token_log_probs.masked_scatter(token_mask.bool(), packed_log_probs)
+
+    return token_log_probs, token_mask, logits
+
+def kl_penalty(log_probs, ref_log_probs, estimator="k3"):
+    """
+    Per token estimate of KL(policy || ref) from the log probs of the sampled tokens only.
+
+    With r = ref / policy evaluated at the sampled token:
+        k1 = -log r                  (unbiased, high variance, can be negative)
+        k2 = (log r)^2 / 2           (biased, low variance)
+        k3 = (r - 1) - log r         (unbiased, low variance, always >= 0)
+
+    Args:
+        log_probs: [Batch, Len] policy log probs of the sampled tokens.
+        ref_log_probs: [Batch, Len] reference log probs of the same tokens.
+        estimator: One of "k1", "k2", "k3".
+
+    Returns:
+        [Batch, Len] per token KL estimates.
+    """
+    log_ratio = ref_log_probs - log_probs
+    if estimator == "k1":
+        return -log_ratio
+    if estimator == "k2":
+        return 0.5 * log_ratio ** 2
+    if estimator == "k3":
+        return torch.exp(log_ratio) - log_ratio - 1
+    raise ValueError(f"Unknown KL estimator: {estimator}")
+
 def compute_grpo_loss(
     model,
     inputs,
@@ -8,53 +364,37 @@ def compute_grpo_loss(
     advantages,
     ref_model=None,
     beta=0.1,
-    clip_eps=0.2
+    clip_eps=0.2,
+    ref_log_probs=None,
+    kl_estimator="k3",
+    fused=False
 ):
     """
     Computes the GRPO loss.
     
     Args:
         model: The policy model being trained.
-        inputs: Tokenized inputs (input_ids, attention_mask) for the generated completions.
+        inputs: Tokenized inputs (input_ids, attention_mask) for the generated completions,
+            see compute_token_log_probs for the optional 'completion_mask' and logits_to_keep.
         old_log_probs: Log probabilities of the completions under the old policy (detached).
         advantages: Normalized advantages for each completion.
-        ref_model: Reference model for KL penalty (optional).
+        ref_model: Reference model for the exact full-vocab KL penalty (optional).
         beta: KL penalty coefficient.
         clip_eps: PPO clipping epsilon.
+        ref_log_probs: Per token reference log probs of the scored tokens, precomputed once per
+            rollout (optional). Takes precedence over ref_model: the KL is then estimated on the
+            sampled tokens only, without a reference forward or any vocab-sized KL tensor.
+        kl_estimator: "k1", "k2" or "k3", used with ref_log_probs.
+        fused: Fuse the output projection into the log prob computation (see
+            linear_selective_log_probs): peak activation memory no longer grows with the vocab.
+            Needs ref_log_probs (or no KL), not the full-vocab KL of ref_model.
         
     Returns:
         loss: Scalar tensor.
     """
-    input_ids = inputs['input_ids']
-    attention_mask = inputs['attention_mask']
-    
-    # Forward pass to get current logits
-    outputs = model(input_ids=input_ids, attention_mask=attention_mask)
-    logits = outputs.logits
-    
-    # Calculate log probs of the generated tokens
-    # We shift logits and labels by 1 because logits predict the *next* token
-    # inputs['input_ids'] contains [Prompt, Completion]
-    # We only care about the log probs of the Completion part, but for simplicity in this custom loop,
-    # we might calculate it over the whole sequence and mask out the prompt later if needed.
-    # For now, let's assume we calculate over the whole sequence but advantages are per-sequence.
-    
-    log_probs = F.log_softmax(logits, dim=-1)
-    
-    # Gather log probs of the actual tokens taken
-    # input_ids: [Batch, SeqLen]
-    # log_probs: [Batch, SeqLen, Vocab]
-    
-    # shift_logits = logits[..., :-1, :].contiguous()
-    # shift_labels = input_ids[..., 1:].contiguous()
-    
-    # Use gather to get log_prob of the chosen token
-    token_log_probs = torch.gather(log_probs, 2, input_ids.unsqueeze(-1)).squeeze(-1)
-    
-    # Sum log probs over the sequence (or mean, depending on preference, usually sum for trajectory)
-    # Masking padding tokens
-    if attention_mask is not None:
-        token_log_probs = token_log_probs * attention_mask
+    if fused and ref_log_probs is None and ref_model is not None:
+        raise ValueError("The fused loss needs cached ref_log_probs, not the full-vocab KL of ref_model")
+    token_log_probs, token_mask, logits = compute_token_log_probs(model, inputs, fused=fused)
         
     # Sum over sequence length to get log_prob of the trajectory
     # shape: [Batch]
@@ -70,22 +410,23 @@ def compute_grpo_loss(
     policy_loss = -torch.min(surr1, surr2).mean()
     
     # KL Penalty
-    kl_loss = 0
-    if ref_model is not None:
+    kl_loss = torch.zeros((), device=token_log_probs.device)
+    if ref_log_probs is not None:
+        per_token_kl = kl_penalty(token_log_probs, ref_log_probs, kl_estimator) * token_mask
+        kl_loss = per_token_kl.sum() / token_mask.sum().clamp(min=1)
+    elif ref_model is not None:
         with torch.no_grad():
-            ref_outputs = ref_model(input_ids=input_ids, attention_mask=attention_mask)
-            ref_logits = ref_outputs.logits
-            ref_log_probs = F.log_softmax(ref_logits, dim=-1)
+            ref_logits, _, logits_mask = _scored_logits(ref_model, inputs)
+            ref_log_probs_full = F.log_softmax(ref_logits, dim=-1)
             
         # KL(P || Ref) = sum(P * (logP - logRef))
-        # Approximation: logP - logRef (since we are sampling from P)
-        # This is the "approximated KL" often used in PPO
-        # per token KL
-        per_token_kl = torch.exp(log_probs) * (log_probs - ref_log_probs)
-        if attention_mask is not None:
-             per_token_kl = per_token_kl * attention_mask.unsqueeze(-1)
+        # The exact per token KL needs the full distributions of both models
+        log_probs = F.log_softmax(logits, dim=-1)
+        per_token_kl = torch.exp(log_probs) * (log_probs - ref_log_probs_full)
+        # The mask in the layout of the logits (packed or padded)
+        per_token_kl = per_token_kl * logits_mask.unsqueeze(-1)
              
-        kl_loss = per_token_kl.sum() / (attention_mask.sum() if attention_mask is not None else input_ids.numel())
+        kl_loss = per_token_kl.sum() / token_mask.sum().clamp(min=1)
     
     total_loss = policy_loss + beta * kl_loss
     
@@ -0,0 +1,131 @@
+import json
+import resource
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+import torch
+
+PHASES = (
+    'tokenize', 'generate', 'old_log_prob', 'reward', 'ref_log_prob', 'loss_forward', 'backward', 'all_reduce',
+    'optimizer'
+)
+
+def peak_memory_mb():
+    """
+    Peak CUDA memory allocated since the last reset, or the peak RSS of the process on CPU.
+    """
+    if torch.cuda.is_available():
+        return torch.cuda.max_memory_allocated() / 2**20
+    # ru_maxrss is reported in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class StepMetrics:
+    """
+    Collects per-phase wall times and token counts of training steps and writes one JSON line
+    per step.
+
+    Phases and counters are accumulated from any thread (e.g. an async rollout worker) until
+    end_step, so with async rollouts the generation phases land in the step during which they ran.
+
+    Usage:
+        with metrics.phase('generate'):
+            ...
+        metrics.count(generated_tokens=n)
+        record = metrics.end_step(loss=loss)
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.step = 0
+        self._lock = threading.Lock()
+        self._file = open(path, "a") if path else None
+        self._reset_step()
+        self._epoch_records = []
+
+    def _reset_step(self):
+        self.phase_times = defaultdict(float)
+        self.counters = defaultdict(int)
+        self._step_start = time.perf_counter()
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            # Also a named range in torch.profiler traces (no-op when not profiling)
+            with torch.profiler.record_function(f"grpo/{name}"):
+                yield
+        finally:
+            if torch.cuda.is_available():
+                # Kernels are asynchronous: wait for the phase's work to finish
+                torch.cuda.synchronize()
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.phase_times[name] += elapsed
+
+    def count(self, **counters):
+        with self._lock:
+            for key, value in counters.items():
+                self.counters[key] += int(value)
+
+    def end_step(self, **extra):
+        """
+        Closes the current step: returns its record and appends it to the JSONL file.
+        """
+        with self._lock:
+            step_time = time.perf_counter() - self._step_start
+            generate_time = self.phase_times.get('generate', 0.0)
+            padded = self.counters.get('padded_tokens', 0)
+            record = {
+                'step': self.step,
+                'step_time': step_time,
+                'phases': {name: self.phase_times.get(name, 0.0) for name in PHASES},
+                'prompt_tokens': self.counters.get('prompt_tokens', 0),
+                'generated_tokens': self.counters.get('generated_tokens', 0),
+                # Throughput of the generation phase (prefill + decode)
+                'prompt_tokens_per_sec': self.counters.get('prompt_tokens', 0) / generate_time if generate_time else 0.0,
+                'generated_tokens_per_sec': self.counters.get('generated_tokens', 0) / generate_time if generate_time else 0.0,
+                # Share of padding in the padded [Prompt, Completion] rollout tensors
+                'padding_ratio': 1 - self.counters.get('real_tokens', 0) / padded if padded else 0.0,
+                'peak_memory_mb': peak_memory_mb(),
+                **extra
+            }
+            self.step += 1
+            self._reset_step()
+            self._epoch_records.append(record)
+        self._write(record)
+        return record
+
+    def summarize_epoch(self, **extra):
+        """
+        Totals and means over the steps since the last summary; also written to the JSONL file.
+        """
+        records, self._epoch_records = self._epoch_records, []
+        total_time = sum(r['step_time'] for r in records)
+        generated = sum(r['generated_tokens'] for r in records)
+        summary = {
+            'summary': True,
+            'steps': len(records),
+            'total_time': total_time,
+            'phases': {name: sum(r['phases'][name] for r in records) for name in PHASES},
+            'prompt_tokens': sum(r['prompt_tokens'] for r in records),
+            'generated_tokens': generated,
+            # End-to-end throughput, including the scoring and update phases
+            'generated_tokens_per_sec': generated / total_time if total_time else 0.0,
+            'mean_padding_ratio': sum(r['padding_ratio'] for r in records) / max(len(records), 1),
+            'peak_memory_mb': max((r['peak_memory_mb'] for r in records), default=0.0),
+            **extra
+        }
+        self._write(summary)
+        return summary
+
+    def _write(self, record):
+        if self._file is not None:
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
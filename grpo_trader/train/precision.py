@@ -0,0 +1,36 @@
+import copy
+import torch
+
+class MasterWeights:
+    """
+    fp32 master weights with a low precision compute copy of the model.
+
+    The model passed in keeps its fp32 parameters: they are what the optimizer updates and what
+    checkpoints save. compute_model is a copy in dtype (bf16 by default) that runs generation,
+    the forward and the backward pass, at half the activation and weight memory traffic.
+    After backward the gradients are moved to the master parameters in fp32; after the
+    optimizer step the updated master weights are rounded back into the compute copy, so small
+    updates accumulate in fp32 instead of being lost to bf16 rounding.
+    """
+    def __init__(self, model, dtype=torch.bfloat16):
+        self.model = model
+        self.compute_model = copy.deepcopy(model).to(dtype)
+        self._pairs = [
+            (master, compute)
+            for master, compute in zip(model.parameters(), self.compute_model.parameters())
+            if master.requires_grad
+        ]
+
+    def grads_to_master(self):
+        """Moves the compute copy's gradients to the master parameters, in fp32."""
+        for master, compute in self._pairs:
+            if compute.grad is None:
+                continue
+            master.grad = compute.grad.float()
+            compute.grad = None
+
+    @torch.no_grad()
+    def master_to_compute(self):
+        """Copies the (updated) master weights into the compute copy."""
+        for master, compute in self._pairs:
+            compute.copy_(master)
@@ -0,0 +1,81 @@
+import os
+import torch
+from torch.profiler import ProfilerActivity, profile
+
+def parse_step_range(spec):
+    """
+    Parses "10-12" (inclusive) or "10" into a (first_step, last_step) tuple.
+    """
+    first, _, last = str(spec).partition("-")
+    try:
+        first_step = int(first)
+        last_step = int(last) if last else first_step
+    except ValueError:
+        raise ValueError(f"Invalid step range: {spec!r}, expected e.g. '10-12'")
+    if first_step < 0 or last_step < first_step:
+        raise ValueError(f"Invalid step range: {spec!r}")
+    return first_step, last_step
+
+class StepProfiler:
+    """
+    Captures a torch.profiler trace (CPU, plus CUDA if available, and memory) over a window of
+    training steps, then exports a Chrome trace and a table of the top ops to output_dir.
+
+    Steps are counted from 0 like the metrics records. The trainer phases show up as
+    "grpo/<phase>" ranges (see StepMetrics.phase). Other steps run without the profiler.
+
+    Nothing is captured until the first step call, so a resumed run starts (or skips) the
+    window from its resume position.
+
+    Usage:
+        profiler = StepProfiler(10, 12)
+        for step in range(start_step, num_steps):
+            profiler.step(step)
+            train()
+        profiler.stop()
+    """
+    def __init__(self, first_step, last_step, output_dir="profiles", row_limit=30, name="trace"):
+        self.first_step = first_step
+        self.last_step = last_step
+        self.output_dir = output_dir
+        self.row_limit = row_limit
+        self.name = name
+        self.trace_path = None
+        self.table_path = None
+        self._profile = None
+
+    def step(self, next_step):
+        """
+        Called before every step with the index of the step about to run (calling it again with
+        the same index is a no-op).
+        """
+        if self._profile is None and self.trace_path is None and self.first_step <= next_step <= self.last_step:
+            activities = [ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(ProfilerActivity.CUDA)
+            self._profile = profile(activities=activities, record_shapes=True, profile_memory=True)
+            self._profile.__enter__()
+        elif self._profile is not None and next_step > self.last_step:
+            self.stop()
+
+    def stop(self):
+        """Ends an active capture early (e.g. training finished inside the window) and exports it."""
+        if self._profile is None:
+            return
+        self._profile.__exit__(None, None, None)
+        self._export(self._profile)
+        self._profile = None
+
+    def _export(self, prof):
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = os.path.join(self.output_dir, f"{self.name}_steps_{self.first_step}-{self.last_step}")
+        self.trace_path = f"{prefix}.json"
+        self.table_path = f"{prefix}_top_ops.txt"
+        prof.export_chrome_trace(self.trace_path)
+
+        sort_by = "self_cuda_time_total" if torch.cuda.is_available() else "self_cpu_time_total"
+        table = prof.key_averages().table(sort_by=sort_by, row_limit=self.row_limit)
+        with open(self.table_path, "w") as f:
+            f.write(table)
+        print(table)
+        print(f"Profiler trace written to {self.trace_path} (open in chrome://tracing or Perfetto)")
@@ -18,12 +18,15 @@ export NCCL_P2P_DISABLE=1
 export NCCL_IB_DISABLE=1
 export PYTHONUNBUFFERED=1
 
-# Generate data if not exists
-# Generate data if not exists or empty
-# Always regenerate to ensure format is correct
-echo "Regenerating data to ensure correct format..."
+# Regenerate the data on every launch so it matches the latest bars
+# Market data comes from the local OHLCV cache (only new bars are downloaded), OFFLINE=1 reads the cache only
+GEN_DATA_ARGS=()
+if [ "${OFFLINE:-0}" = "1" ]; then
+    GEN_DATA_ARGS+=(--offline)
+fi
+echo "Regenerating data from the market data cache..."
 rm -f "$TRAIN_DATA" "$TEST_DATA"
-python3 -m grpo_trader.slime_adapter.gen_data --output_dir "$DATA_DIR" || exit 1
+python3 -m grpo_trader.slime_adapter.gen_data --output_dir "$DATA_DIR" "${GEN_DATA_ARGS[@]}" || exit 1
 
 echo "Checking data files..."
 ls -l "$TRAIN_DATA" "$TEST_DATA"
@@ -55,6 +58,7 @@ python3 Slime/train.py \
     --global-batch-size 256 \
     --num-steps-per-rollout 1 \
     --rollout-max-response-len 2048 \
+    --rollout-stop "</answer>" \
     --rollout-max-prompt-len 2048 \
     --rollout-max-context-len 4096 \
     --sglang-mem-fraction-static 0.5 \
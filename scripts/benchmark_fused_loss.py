@@ -0,0 +1,93 @@
+import argparse
+import multiprocessing as mp
+import resource
+import time
+import torch
+from transformers import Qwen2Config, Qwen2ForCausalLM
+from grpo_trader.train.loss import compute_grpo_loss
+
+def peak_rss_mb():
+    # ru_maxrss is reported in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def build_model(vocab_size, hidden_size):
+    config = Qwen2Config(
+        vocab_size=vocab_size,
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 2,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=4096
+    )
+    return Qwen2ForCausalLM(config)
+
+def run_case(fused, batch_size, prompt_len, completion_len, vocab_size, hidden_size, queue):
+    """
+    Runs one GRPO loss forward + backward on a random model in a fresh process and reports
+    its peak memory increase over the model, inputs and parameter gradients.
+    """
+    torch.manual_seed(0)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = build_model(vocab_size, hidden_size).to(device)
+    input_ids = torch.randint(0, vocab_size, (batch_size, prompt_len + completion_len), device=device)
+    completion_mask = torch.ones(batch_size, completion_len, device=device)
+    inputs = {
+        'input_ids': input_ids,
+        'attention_mask': torch.ones_like(input_ids),
+        'logits_to_keep': completion_len + 1,
+        'completion_mask': completion_mask
+    }
+    old_log_probs = torch.zeros(batch_size, device=device)
+    advantages = torch.randn(batch_size, device=device)
+    ref_log_probs = torch.zeros(batch_size, completion_len, device=device)
+    # Allocate the parameter gradients up front: they are not activation memory
+    for param in model.parameters():
+        param.grad = torch.zeros_like(param)
+
+    if device == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        baseline = torch.cuda.max_memory_allocated() / 2**20
+    else:
+        baseline = peak_rss_mb()
+
+    start = time.perf_counter()
+    loss, _, _ = compute_grpo_loss(
+        model, inputs, old_log_probs, advantages, beta=0.04, ref_log_probs=ref_log_probs, fused=fused
+    )
+    loss.backward()
+    if device == "cuda":
+        torch.cuda.synchronize()
+        peak = torch.cuda.max_memory_allocated() / 2**20
+    else:
+        peak = peak_rss_mb()
+    queue.put((peak - baseline, time.perf_counter() - start))
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak activation memory of the GRPO loss, logits vs fused")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--prompt-len", type=int, default=64)
+    parser.add_argument("--completion-len", type=int, default=512)
+    parser.add_argument("--hidden-size", type=int, default=256)
+    parser.add_argument("--vocab-sizes", type=int, nargs="+", default=[8192, 32000, 151936])
+    args = parser.parse_args()
+
+    # Every case runs in its own process so peak RSS is not polluted by previous cases
+    ctx = mp.get_context("spawn")
+
+    print(f"{'vocab':>8} {'loss':>8} {'peak MB':>10} {'time s':>8}")
+    for vocab_size in args.vocab_sizes:
+        for fused in (False, True):
+            queue = ctx.Queue()
+            proc = ctx.Process(target=run_case, args=(
+                fused, args.batch_size, args.prompt_len, args.completion_len, vocab_size, args.hidden_size, queue
+            ))
+            proc.start()
+            peak_mb, seconds = queue.get()
+            proc.join()
+            name = "fused" if fused else "logits"
+            print(f"{vocab_size:>8} {name:>8} {peak_mb:>10.0f} {seconds:>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import argparse
+import multiprocessing as mp
+import resource
+import time
+import torch
+import torch.nn.functional as F
+from grpo_trader.train.loss import selective_log_probs
+
+def full_log_softmax(logits, labels):
+    """Baseline: log_softmax over the whole vocab, then gather."""
+    log_probs = F.log_softmax(logits, dim=-1)
+    return torch.gather(log_probs, 2, labels.unsqueeze(-1)).squeeze(-1)
+
+METHODS = {
+    "full_log_softmax": full_log_softmax,
+    "selective": selective_log_probs,
+}
+
+def peak_rss_mb():
+    # ru_maxrss is reported in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_case(method, batch_size, seq_len, vocab_size, dtype, queue):
+    """
+    Runs one forward + backward in a fresh process and reports its peak memory increase.
+    """
+    torch.manual_seed(0)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    logits = torch.randn(batch_size, seq_len, vocab_size, dtype=dtype, device=device, requires_grad=True)
+    labels = torch.randint(0, vocab_size, (batch_size, seq_len), device=device)
+
+    if device == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        baseline = torch.cuda.max_memory_allocated() / 2**20
+    else:
+        baseline = peak_rss_mb()
+
+    start = time.perf_counter()
+    token_log_probs = METHODS[method](logits, labels)
+    token_log_probs.sum().backward()
+    if device == "cuda":
+        torch.cuda.synchronize()
+        peak = torch.cuda.max_memory_allocated() / 2**20
+    else:
+        peak = peak_rss_mb()
+    queue.put((peak - baseline, time.perf_counter() - start))
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak memory of token log-prob computation")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--seq-lens", type=int, nargs="+", default=[256, 512, 1024, 2048])
+    parser.add_argument("--vocab-sizes", type=int, nargs="+", default=[32000, 151936])
+    parser.add_argument("--dtype", type=str, default="float32", choices=["float32", "bfloat16"])
+    args = parser.parse_args()
+
+    dtype = getattr(torch, args.dtype)
+    # Every case runs in its own process so peak RSS is not polluted by previous cases
+    ctx = mp.get_context("spawn")
+
+    logits_header = "logits MB"
+    print(f"{'vocab':>8} {'seq_len':>8} {logits_header:>10} {'method':>18} {'peak MB':>10} {'time s':>8}")
+    for vocab_size in args.vocab_sizes:
+        for seq_len in args.seq_lens:
+            logits_mb = args.batch_size * seq_len * vocab_size * dtype.itemsize / 2**20
+            for method in METHODS:
+                queue = ctx.Queue()
+                proc = ctx.Process(target=run_case, args=(method, args.batch_size, seq_len, vocab_size, dtype, queue))
+                proc.start()
+                peak_mb, seconds = queue.get()
+                proc.join()
+                print(f"{vocab_size:>8} {seq_len:>8} {logits_mb:>10.0f} {method:>18} {peak_mb:>10.0f} {seconds:>8.2f}")
+
+if __name__ == "__main__":
+    main()
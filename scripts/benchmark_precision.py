@@ -0,0 +1,100 @@
+import argparse
+import multiprocessing as mp
+import resource
+import time
+from types import SimpleNamespace
+import torch
+from transformers import Qwen2Config, Qwen2ForCausalLM
+from grpo_trader.train.grpo_trainer import GRPOTrainer
+
+CONFIGS = {
+    "fp32": {},
+    "checkpointing": {"gradient_checkpointing": True},
+    "bf16_autocast": {"autocast_dtype": torch.bfloat16},
+    "master_weights": {"master_weights_dtype": torch.bfloat16},
+    "master+checkpointing": {"master_weights_dtype": torch.bfloat16, "gradient_checkpointing": True},
+}
+
+def peak_rss_mb():
+    # ru_maxrss is reported in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_case(name, args, queue):
+    """
+    Runs one optimizer step (loss forward, backward, AdamW) on a synthetic rollout in a fresh
+    process and reports its peak memory increase and wall time.
+    """
+    torch.manual_seed(0)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    config = Qwen2Config(
+        vocab_size=args.vocab_size,
+        hidden_size=args.hidden_size,
+        intermediate_size=args.hidden_size * 4,
+        num_hidden_layers=args.num_layers,
+        num_attention_heads=8,
+        num_key_value_heads=2,
+        max_position_embeddings=4096
+    )
+    model = Qwen2ForCausalLM(config).to(device)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-5)
+    # Only pad_token_id is needed to train on a ready-made rollout
+    tokenizer = SimpleNamespace(pad_token_id=0)
+    trainer = GRPOTrainer(
+        model, tokenizer, None, optimizer, group_size=args.group_size, device=device, stop_at_answer=False,
+        **CONFIGS[name]
+    )
+
+    n = args.prompts * args.group_size
+    completion_mask = torch.ones(n, args.completion_len, device=device)
+    rollout = {
+        'prompt_ids': torch.randint(0, args.vocab_size, (n, args.prompt_len), device=device),
+        'prompt_mask': torch.ones(n, args.prompt_len, dtype=torch.long, device=device),
+        'completion_ids': torch.randint(0, args.vocab_size, (n, args.completion_len), device=device),
+        'completion_mask': completion_mask,
+        'old_log_probs': torch.zeros(n, args.completion_len, device=device),
+        'ref_log_probs': torch.zeros(n, args.completion_len, device=device),
+        'advantages': torch.randn(n, device=device),
+    }
+    # Warm-up step: allocates the gradients and the AdamW state
+    trainer.optimize_step(rollout)
+
+    if device == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        baseline = torch.cuda.max_memory_allocated() / 2**20
+    else:
+        baseline = peak_rss_mb()
+    start = time.perf_counter()
+    trainer.optimize_step(rollout)
+    if device == "cuda":
+        torch.cuda.synchronize()
+        peak = torch.cuda.max_memory_allocated() / 2**20
+    else:
+        peak = peak_rss_mb()
+    queue.put((peak - baseline, time.perf_counter() - start))
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory and time of one training step per precision option")
+    parser.add_argument("--prompts", type=int, default=2)
+    parser.add_argument("--group-size", type=int, default=4)
+    parser.add_argument("--prompt-len", type=int, default=128)
+    parser.add_argument("--completion-len", type=int, default=256)
+    parser.add_argument("--vocab-size", type=int, default=32000)
+    parser.add_argument("--hidden-size", type=int, default=512)
+    parser.add_argument("--num-layers", type=int, default=8)
+    parser.add_argument("--configs", nargs="+", default=list(CONFIGS), choices=list(CONFIGS))
+    args = parser.parse_args()
+
+    # Every case runs in its own process so peak RSS is not polluted by previous cases
+    ctx = mp.get_context("spawn")
+    print(f"{'config':>22} {'peak MB':>10} {'time s':>8}")
+    for name in args.configs:
+        queue = ctx.Queue()
+        proc = ctx.Process(target=run_case, args=(name, args, queue))
+        proc.start()
+        peak_mb, seconds = queue.get()
+        proc.join()
+        print(f"{name:>22} {peak_mb:>10.0f} {seconds:>8.2f}")
+
+if __name__ == "__main__":
+    main()
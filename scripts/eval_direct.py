@@ -130,9 +130,17 @@ def main():
         print(f"First prompt preview: {prompts[0][:100]}...")
     
     # sampling params
-    sampling_params = {"temperature": 0.0, "max_new_tokens": 512}
+    # Stop at the closing answer tag: parse_action ignores everything after it.
+    # no_stop_trim keeps "</answer>" in the text so the answer regex still matches.
+    max_new_tokens = 512
+    sampling_params = {"temperature": 0.0, "max_new_tokens": max_new_tokens, "stop": ["</answer>"], "no_stop_trim": True}
     
     outputs = engine.generate(prompts, sampling_params)
+
+    # Report the decode tokens the answer stop saved (vs. running to max_new_tokens)
+    stopped = [out for out in outputs if (out.get('meta_info', {}).get('finish_reason') or {}).get('matched') == "</answer>"]
+    saved = sum(max_new_tokens - out['meta_info'].get('completion_tokens', max_new_tokens) for out in stopped)
+    print(f"Stopped at </answer>: {len(stopped)}/{len(outputs)} responses, {saved} decode tokens saved")
     
     results = []
     for i, out in enumerate(outputs):
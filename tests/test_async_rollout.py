@@ -0,0 +1,47 @@
+import time
+import unittest
+import torch
+from grpo_trader.train.async_rollout import AsyncRolloutWorker
+from test_trainer import BATCH, make_trainer
+
+
+class TestAsyncRolloutWorker(unittest.TestCase):
+    def test_overlapped_training(self):
+        trainer = make_trainer()
+        worker = AsyncRolloutWorker(trainer, [BATCH] * 4)
+
+        losses = []
+        for rollout in worker:
+            # Training slower than generation: the worker must wait for a free slot before sampling
+            time.sleep(0.2)
+            losses.append(trainer.train_on_rollout(rollout))
+
+        self.assertEqual(worker.dropped, 0)
+        self.assertEqual(len(losses), 4)
+        self.assertEqual(trainer.policy_version, len(losses))
+        # The snapshot is a separate copy, only refreshed before each generation
+        self.assertIsNot(next(worker.snapshot.parameters()), next(trainer.model.parameters()))
+
+    def test_stale_rollouts_are_dropped(self):
+        trainer = make_trainer()
+        worker = AsyncRolloutWorker(trainer, [BATCH, BATCH], queue_size=2, max_staleness=0).start()
+        deadline = time.time() + 60
+        while not worker.queue.full() and time.time() < deadline:
+            time.sleep(0.05)
+
+        # Both rollouts were sampled at version 0; pretend the policy moved on since
+        trainer.policy_version = 1
+        rollouts = list(worker)
+
+        self.assertEqual(rollouts, [])
+        self.assertEqual(worker.dropped, 2)
+
+    def test_worker_errors_are_raised(self):
+        trainer = make_trainer()
+        worker = AsyncRolloutWorker(trainer, [{'prompt': ["x"], 'current_price': [], 'next_price': []}])
+        with self.assertRaises(IndexError):
+            list(worker)
+
+
+if __name__ == '__main__':
+    unittest.main()
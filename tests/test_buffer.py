@@ -0,0 +1,74 @@
+import unittest
+import torch
+from grpo_trader.train.buffer import ExperienceBuffer, split_micro_batches
+
+
+def make_rollout(num_groups, group_size, prompt_len, completion_len, offset=0):
+    n = num_groups * group_size
+    prompt_mask = torch.ones(n, prompt_len, dtype=torch.long)
+    prompt_mask[:, 0] = 0
+    completion_mask = torch.ones(n, completion_len, dtype=torch.long)
+    completion_mask[:, -1] = 0
+    return {
+        'prompt_ids': torch.randint(3, 50, (n, prompt_len)) * prompt_mask,
+        'prompt_mask': prompt_mask,
+        'completion_ids': torch.randint(3, 50, (n, completion_len)) * completion_mask,
+        'completion_mask': completion_mask,
+        'old_log_probs': -torch.rand(n, completion_len) * completion_mask,
+        'rewards': torch.arange(n, dtype=torch.float32) + offset,
+        'advantages': torch.randn(n)
+    }
+
+
+class TestExperienceBuffer(unittest.TestCase):
+    def test_add_pads_to_common_width(self):
+        buffer = ExperienceBuffer(group_size=2)
+        buffer.add(make_rollout(2, 2, prompt_len=5, completion_len=4))
+        buffer.add(make_rollout(1, 2, prompt_len=7, completion_len=3, offset=100))
+
+        self.assertEqual(len(buffer), 3)
+        self.assertEqual(buffer.data['prompt_ids'].shape, (6, 7))
+        self.assertEqual(buffer.data['completion_ids'].shape, (6, 4))
+        # Shorter prompts are padded on the left, shorter completions on the right
+        self.assertEqual(buffer.data['prompt_mask'][0, :3].tolist(), [0, 0, 0])
+        self.assertEqual(buffer.data['completion_mask'][4, 3].item(), 0)
+
+    def test_mini_batches_cover_whole_groups(self):
+        buffer = ExperienceBuffer(group_size=2)
+        buffer.add(make_rollout(2, 2, prompt_len=5, completion_len=4))
+        buffer.add(make_rollout(1, 2, prompt_len=7, completion_len=3, offset=100))
+
+        seen = []
+        for mini_batch in buffer.mini_batches(groups_per_batch=1):
+            rewards = mini_batch['rewards'].tolist()
+            # The two samples of a group stay together
+            self.assertEqual(rewards[1] - rewards[0], 1)
+            seen.extend(rewards)
+            # Unused padding columns are dropped
+            self.assertTrue(bool(mini_batch['prompt_mask'][:, 0].any()))
+            self.assertTrue(bool(mini_batch['completion_mask'][:, -1].any()))
+        self.assertEqual(sorted(seen), [0, 1, 2, 3, 100, 101])
+
+
+    def test_split_micro_batches_by_token_budget(self):
+        batch = make_rollout(4, 2, prompt_len=6, completion_len=5)
+        # Give the groups different completion lengths: 4, 1, 3, 2
+        for group, length in enumerate([4, 1, 3, 2]):
+            batch['completion_mask'][group * 2:group * 2 + 2] = 0
+            batch['completion_mask'][group * 2:group * 2 + 2, :length] = 1
+
+        self.assertEqual(len(split_micro_batches(batch, 2, None)), 1)
+
+        # A group costs 2 * (5 + length) tokens; at most 30 tokens per micro-batch
+        micro_batches = split_micro_batches(batch, 2, max_tokens=30)
+        completion_lengths = [mb['completion_mask'].sum(dim=1).max().item() for mb in micro_batches]
+        rows = [mb['advantages'].shape[0] for mb in micro_batches]
+        # Longest first: the two long groups alone, then the two short ones together
+        self.assertEqual(completion_lengths, [4, 3, 2])
+        self.assertEqual(rows, [2, 2, 4])
+        self.assertEqual(sorted(r for mb in micro_batches for r in mb['rewards'].tolist()), list(range(8)))
+        # Micro-batches are trimmed to their own longest completion
+        self.assertEqual(micro_batches[2]['completion_ids'].shape[1], 2)
+
+if __name__ == '__main__':
+    unittest.main()
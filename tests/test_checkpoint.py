@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+import torch
+from grpo_trader.data.sampler import ResumableSampler
+from grpo_trader.train.checkpoint import AsyncCheckpointer, latest_checkpoint, list_checkpoints, load_checkpoint
+from test_trainer import BATCH, make_trainer
+
+
+class TestCheckpoint(unittest.TestCase):
+    def test_sampler_resumes_mid_epoch(self):
+        sampler = ResumableSampler(range(10), seed=3)
+        sampler.set_position(epoch=1)
+        full_epoch = list(sampler)
+        self.assertEqual(sorted(full_epoch), list(range(10)))
+
+        sampler.set_position(epoch=1, start_index=4)
+        self.assertEqual(list(sampler), full_epoch[4:])
+        self.assertEqual(len(sampler), 6)
+        sampler.set_position(epoch=2)
+        self.assertNotEqual(list(sampler), full_epoch)
+
+    def test_resume_is_exact(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            torch.manual_seed(0)
+            trainer = make_trainer()
+            checkpointer = AsyncCheckpointer(tmp, keep_last=2)
+            trainer.train_step(BATCH)
+            checkpointer.save(1, trainer.model, trainer.optimizer, {'epoch': 0, 'trainer': trainer.state_dict()})
+            # The snapshot is taken on save: training on does not change the checkpoint
+            trainer.train_step(BATCH)
+            expected = [p.detach().clone() for p in trainer.model.parameters()]
+            checkpointer.save(2, trainer.model, trainer.optimizer, {'epoch': 0, 'trainer': trainer.state_dict()})
+            checkpointer.wait()
+            self.assertEqual(latest_checkpoint(tmp), os.path.join(tmp, "checkpoint-2"))
+
+            # Redo step 2 from the step 1 checkpoint, in a fresh trainer with a different RNG state
+            torch.manual_seed(123)
+            resumed = make_trainer()
+            state = load_checkpoint(os.path.join(tmp, "checkpoint-1"), resumed.model, resumed.optimizer)
+            resumed.load_state_dict(state['trainer'])
+            self.assertEqual(state['step'], 1)
+            self.assertEqual(resumed.policy_version, 1)
+            resumed.train_step(BATCH)
+            self.assertTrue(all(torch.equal(a, b) for a, b in zip(expected, resumed.model.parameters())))
+
+            # Only the keep_last most recent checkpoints are kept
+            checkpointer.save(3, resumed.model, resumed.optimizer, {'epoch': 0, 'trainer': resumed.state_dict()})
+            checkpointer.wait()
+            self.assertEqual(list_checkpoints(tmp), [os.path.join(tmp, f"checkpoint-{step}") for step in (2, 3)])
+
+    def test_resume_refreshes_master_weights_compute_copy(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            torch.manual_seed(0)
+            trainer = make_trainer(master_weights_dtype=torch.bfloat16)
+            trainer.train_step(BATCH)
+            checkpointer = AsyncCheckpointer(tmp)
+            checkpointer.save(1, trainer.model, trainer.optimizer, {'epoch': 0, 'trainer': trainer.state_dict()})
+            checkpointer.wait()
+
+            # The first rollout after resuming must sample from the restored weights
+            torch.manual_seed(1)
+            resumed = make_trainer(master_weights_dtype=torch.bfloat16)
+            state = load_checkpoint(os.path.join(tmp, "checkpoint-1"), resumed.model, resumed.optimizer)
+            resumed.load_state_dict(state['trainer'])
+            pairs = zip(resumed.model.parameters(), resumed.compute_model.parameters())
+            self.assertTrue(all(torch.equal(master.to(torch.bfloat16), compute) for master, compute in pairs))
+            pairs = zip(trainer.compute_model.parameters(), resumed.compute_model.parameters())
+            self.assertTrue(all(torch.equal(a, b) for a, b in pairs))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+import pandas as pd
+from grpo_trader.data.cache import OHLCVCache, period_start
+from grpo_trader.data.loader import fetch_crypto_data, load_ohlcv
+
+
+def yf_frame(start, periods):
+    """A frame shaped like yf.download's: Datetime index, MultiIndex (Price, Ticker) columns."""
+    index = pd.date_range(start, periods=periods, freq="h", tz="UTC", name="Datetime")
+    close = 100 + np.arange(periods, dtype=float)
+    columns = pd.MultiIndex.from_product([["Close", "High", "Low", "Open", "Volume"], ["BTC-USD"]])
+    return pd.DataFrame(np.stack([close, close + 1, close - 1, close, np.full(periods, 10.0)], axis=1),
+                        index=index, columns=columns)
+
+
+class TestOHLCVCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.now = pd.Timestamp.now(tz="UTC").floor("h")
+
+    def test_period_start(self):
+        end = pd.Timestamp("2025-03-31 12:00", tz="UTC")
+        self.assertEqual(period_start("5d", end), pd.Timestamp("2025-03-26 12:00", tz="UTC"))
+        self.assertEqual(period_start("1mo", end), pd.Timestamp("2025-02-28 12:00", tz="UTC"))
+        self.assertEqual(period_start("ytd", end), pd.Timestamp("2025-01-01", tz="UTC"))
+        self.assertIsNone(period_start("max", end))
+        with self.assertRaises(ValueError):
+            period_start("1fortnight", end)
+
+    def test_incremental_refresh_and_offline(self):
+        history = yf_frame(self.now - pd.Timedelta(hours=99), 100)
+        with mock.patch("yfinance.download", return_value=history) as download:
+            first = load_ohlcv("BTC-USD", "5d", cache_dir=self.tmp.name)
+        self.assertEqual(download.call_args.kwargs['period'], "5d")
+        self.assertEqual(len(first), 100)
+        self.assertTrue(os.path.exists(OHLCVCache(self.tmp.name).path("BTC-USD", "1h")))
+
+        # The next run only asks for the bars from the last cached one on; that bar is revised
+        update = yf_frame(self.now, 3)
+        update.iloc[0, 0] = 1.0
+        with mock.patch("yfinance.download", return_value=update) as download:
+            second = load_ohlcv("BTC-USD", "5d", cache_dir=self.tmp.name)
+        self.assertEqual(download.call_args.kwargs['start'], first['date'].iloc[-1])
+        self.assertEqual(len(second), 102)
+        self.assertTrue(second['date'].is_monotonic_increasing)
+        self.assertEqual(float(second.loc[second['date'] == self.now, 'close'].iloc[0]), 1.0)
+
+        with mock.patch("yfinance.download", side_effect=AssertionError("network used")):
+            offline = load_ohlcv("BTC-USD", "5d", cache_dir=self.tmp.name, offline=True)
+            # A shorter period is a window of the cached bars, counted back from the last one
+            last_day = load_ohlcv("BTC-USD", "1d", cache_dir=self.tmp.name, offline=True)
+        pd.testing.assert_frame_equal(offline, second)
+        self.assertEqual(len(last_day), 25)
+
+        with self.assertRaises(FileNotFoundError):
+            load_ohlcv("ETH-USD", "5d", cache_dir=self.tmp.name, offline=True)
+
+    def test_longer_period_backfills(self):
+        with mock.patch("yfinance.download", return_value=yf_frame(self.now - pd.Timedelta(hours=47), 48)):
+            load_ohlcv("BTC-USD", "2d", cache_dir=self.tmp.name)
+        with mock.patch("yfinance.download", return_value=yf_frame(self.now - pd.Timedelta(hours=119), 120)) as download:
+            bars = load_ohlcv("BTC-USD", "5d", cache_dir=self.tmp.name)
+        self.assertEqual(download.call_args.kwargs['period'], "5d")
+        self.assertEqual(len(bars), 120)
+
+    def test_download_failure_falls_back_to_cache(self):
+        with mock.patch("yfinance.download", return_value=yf_frame(self.now - pd.Timedelta(hours=99), 100)):
+            df = fetch_crypto_data("BTC-USD", "5d", cache_dir=self.tmp.name)
+        with mock.patch("yfinance.download", side_effect=ConnectionError("offline")):
+            cached = fetch_crypto_data("BTC-USD", "5d", cache_dir=self.tmp.name)
+        pd.testing.assert_frame_equal(cached, df)
+        self.assertIn('rsi', cached.columns)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from grpo_trader.data.loader import fetch_crypto_data
+from grpo_trader.data.sources import FileSource, SyntheticSource, YFinanceSource, source_from_spec
+
+
+class TestDataSources(unittest.TestCase):
+    def test_synthetic_is_deterministic_ohlcv(self):
+        source = SyntheticSource(num_bars=5000, seed=1)
+        bars = source.fetch("BTC-USD", "1h")
+        pd.testing.assert_frame_equal(bars, SyntheticSource(num_bars=5000, seed=1).fetch("BTC-USD", "1h"))
+        self.assertFalse(bars['close'].equals(source.fetch("ETH-USD", "1h")['close']))
+        self.assertFalse(bars['close'].equals(SyntheticSource(num_bars=5000, seed=2).fetch("BTC-USD", "1h")['close']))
+
+        self.assertEqual(len(bars), 5000)
+        self.assertEqual(bars['date'].iloc[-1], source.end)
+        self.assertTrue((bars['date'].diff().dropna() == pd.Timedelta(hours=1)).all())
+        self.assertTrue((bars['high'] >= bars[['open', 'close']].max(axis=1)).all())
+        self.assertTrue((bars['low'] <= bars[['open', 'close']].min(axis=1)).all())
+        self.assertTrue((bars['open'].iloc[1:].values == bars['close'].iloc[:-1].values).all())
+
+        # The last period is counted back from the last bar
+        self.assertEqual(len(source.fetch("BTC-USD", "1h", period="1d")), 25)
+
+    def test_synthetic_regimes_switch(self):
+        source = SyntheticSource(num_bars=20000, mean_regime_bars=200)
+        regimes = source.regime_path(np.random.default_rng(0), 20000)
+        self.assertEqual(len(regimes), 20000)
+        self.assertEqual(set(regimes.tolist()), {0, 1, 2})
+        switches = np.flatnonzero(np.diff(regimes))
+        # Switches always move to another regime, every ~mean_regime_bars bars
+        self.assertTrue(50 < len(switches) < 200)
+
+    def test_file_source_reads_csv_and_parquet(self):
+        bars = SyntheticSource(num_bars=100).fetch("BTC-USD", "1d")
+        with tempfile.TemporaryDirectory() as tmp:
+            csv = bars.rename(columns={'date': 'Date', 'close': 'Close'})
+            csv.to_csv(os.path.join(tmp, "BTC-USD_1d.csv"), index=False)
+            os.makedirs(os.path.join(tmp, "ETH-USD"))
+            bars.iloc[::-1].to_parquet(os.path.join(tmp, "ETH-USD", "1d.parquet"))
+
+            source = FileSource(tmp)
+            from_csv = source.fetch("BTC-USD", "1d", period="1mo")
+            self.assertEqual(len(from_csv), 32)
+            np.testing.assert_allclose(from_csv['close'], bars['close'].iloc[-32:])
+            pd.testing.assert_frame_equal(source.fetch("ETH-USD", "1d"), bars)
+            with self.assertRaises(FileNotFoundError):
+                source.fetch("SOL-USD", "1d")
+
+    def test_source_from_spec(self):
+        self.assertIsInstance(source_from_spec("yfinance"), YFinanceSource)
+        self.assertEqual(source_from_spec("files:/data/ohlcv").root, "/data/ohlcv")
+        source = source_from_spec("synthetic:num_bars=1e6,seed=3,end=2024-06-01")
+        self.assertEqual((source.num_bars, source.seed), (1_000_000, 3))
+        self.assertEqual(source.end, pd.Timestamp("2024-06-01", tz="UTC"))
+        with self.assertRaises(ValueError):
+            source_from_spec("bloomberg")
+
+    def test_fetch_crypto_data_offline_from_synthetic(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            df = fetch_crypto_data("BTC-USD", "1mo", cache_dir=tmp, source=SyntheticSource(num_bars=2000))
+            # Local sources bypass the cache
+            self.assertEqual(os.listdir(tmp), [])
+        self.assertFalse(df.isna().any().any())
+        self.assertIn('macd_signal', df.columns)
+
+
+if __name__ == "__main__":
+    unittest.main()
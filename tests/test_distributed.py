@@ -0,0 +1,79 @@
+import os
+import socket
+import tempfile
+import unittest
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from grpo_trader.train.distributed import all_reduce_gradients
+from test_trainer import BATCH, ScriptedEnv, make_trainer
+
+WORLD_SIZE = 2
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_rank(rank, port, out_dir, fn):
+    os.environ.update(MASTER_ADDR="127.0.0.1", MASTER_PORT=str(port), RANK=str(rank), WORLD_SIZE=str(WORLD_SIZE))
+    dist.init_process_group("gloo", rank=rank, world_size=WORLD_SIZE)
+    try:
+        torch.save(fn(rank), os.path.join(out_dir, f"rank{rank}.pt"))
+    finally:
+        dist.destroy_process_group()
+
+
+def weighted_gradients(rank):
+    torch.manual_seed(0)
+    model = torch.nn.Linear(4, 1)
+    inputs = torch.randn(4, 4)
+    # Rank 0 holds 3 samples, rank 1 a single one
+    shard = inputs[:3] if rank == 0 else inputs[3:]
+    model(shard).pow(2).mean().backward()
+    all_reduce_gradients(model.parameters(), shard.shape[0])
+    distributed = [p.grad.clone() for p in model.parameters()]
+
+    model.zero_grad()
+    model(inputs).pow(2).mean().backward()
+    return distributed, [p.grad.clone() for p in model.parameters()]
+
+
+def uneven_train_step(rank):
+    trainer = make_trainer(dynamic_sampling=True, mini_batch_groups=1)
+    trainer.env = ScriptedEnv()
+    torch.manual_seed(rank)
+    if rank == 0:
+        batch = BATCH
+    else:
+        # Flat prices: every group is dropped, the rank only joins the gradient all-reduce
+        batch = {'prompt': BATCH['prompt'], 'current_price': [100.0, 200.0], 'next_price': [100.0, 200.0]}
+    loss = trainer.train_step(batch)
+    return loss, [p.detach().clone() for p in trainer.model.parameters()]
+
+
+class TestDistributed(unittest.TestCase):
+    def spawn(self, fn):
+        with tempfile.TemporaryDirectory() as out_dir:
+            mp.spawn(run_rank, args=(free_port(), out_dir, fn), nprocs=WORLD_SIZE)
+            return [torch.load(os.path.join(out_dir, f"rank{r}.pt")) for r in range(WORLD_SIZE)]
+
+    def test_weighted_gradient_all_reduce(self):
+        for distributed, full_batch in self.spawn(weighted_gradients):
+            self.assertTrue(all(torch.allclose(a, b, atol=1e-6) for a, b in zip(distributed, full_batch)))
+
+    def test_ranks_stay_in_sync_with_uneven_shards(self):
+        (loss0, params0), (loss1, params1) = self.spawn(uneven_train_step)
+
+        self.assertIsInstance(loss0, float)
+        self.assertIsNone(loss1)
+        # Same update on both ranks, and the weights did move
+        self.assertTrue(all(torch.equal(a, b) for a, b in zip(params0, params1)))
+        initial = make_trainer().model.parameters()
+        self.assertTrue(any(not torch.equal(a, b) for a, b in zip(params0, initial)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import pickle
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from grpo_trader.data.feature_store import FeatureStore, WindowDataset, build_feature_store
+from grpo_trader.data.loader import fetch_crypto_data
+from grpo_trader.data.processor import CryptoDataset
+from grpo_trader.data.sources import SyntheticSource
+
+
+class TestFeatureStore(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        self.source = SyntheticSource(num_bars=400)
+
+    def test_round_trip_and_zero_copy_windows(self):
+        df = fetch_crypto_data("BTC-USD", "max", source=self.source)
+        store = FeatureStore(self.root)
+        store.write("BTC-USD", "1h", df)
+        table = store.open("BTC-USD", "1h")
+
+        self.assertEqual(len(table), len(df))
+        self.assertEqual(table.columns['close'].dtype, np.float64)
+        self.assertEqual(table.columns['volume'].dtype, np.float32)
+        self.assertIsInstance(table.columns['close'], np.memmap)
+        window = table.window(10, 20)
+        self.assertTrue(np.shares_memory(window['rsi'], table.columns['rsi']))
+        np.testing.assert_array_equal(window['close'], df['close'].iloc[10:20])
+        np.testing.assert_allclose(window['volume'], df['volume'].iloc[10:20], rtol=1e-6)
+
+        frame = table.to_frame()
+        self.assertTrue((frame['date'] == df['date'].reset_index(drop=True)).all())
+        self.assertEqual(table.date(5), df['date'].iloc[5])
+        self.assertEqual(table.index_of(df['date'].iloc[7]), 7)
+        self.assertEqual(table.index_of(df['date'].iloc[7], side="right"), 8)
+
+        # Rewrites swap the whole table in
+        store.write("BTC-USD", "1h", df.iloc[:50])
+        self.assertEqual(len(store.open("BTC-USD", "1h")), 50)
+        self.assertEqual(store.tickers("1h"), ["BTC-USD"])
+
+    def test_window_dataset_matches_crypto_dataset(self):
+        # BTC-level prices, where float32 would already change the second decimal
+        df = fetch_crypto_data("BTC-USD", "max", source=SyntheticSource(num_bars=400, initial_price=90_000.0))
+        store = FeatureStore(self.root)
+        store.write("BTC-USD", "1h", df)
+        dataset = WindowDataset(store, "BTC-USD", split=(0.0, 0.8))
+        expected = CryptoDataset(df.iloc[:int(len(df) * 0.8)].reset_index(drop=True))
+
+        self.assertEqual(len(dataset), len(expected))
+        for idx in range(len(dataset)):
+            item = dataset[idx]
+            reference = expected[idx]
+            self.assertEqual(item['prompt'], reference['prompt'])
+            self.assertEqual(item['current_price'], reference['current_price'])
+            self.assertEqual(item['next_price'], reference['next_price'])
+            self.assertEqual(item['index'], idx)
+
+    def test_multi_ticker_dataset(self):
+        store = build_feature_store(self.root, ["BTC-USD", "ETH-USD"], period="max", source=self.source)
+        dataset = WindowDataset(store, ["BTC-USD", "ETH-USD"], split=(0.5, 1.0))
+        per_ticker = [len(WindowDataset(store, ticker, split=(0.5, 1.0))) for ticker in ["BTC-USD", "ETH-USD"]]
+        self.assertEqual(len(dataset), sum(per_ticker))
+
+        eth = WindowDataset(store, "ETH-USD", split=(0.5, 1.0))
+        first_eth = dataset[per_ticker[0]]
+        self.assertEqual(first_eth['prompt'], eth[0]['prompt'])
+        self.assertEqual(first_eth['index'], per_ticker[0])
+        with self.assertRaises(IndexError):
+            dataset[len(dataset)]
+
+        # Worker processes receive the dataset without its mapped tables and reopen them
+        dataset[0]
+        clone = pickle.loads(pickle.dumps(dataset))
+        self.assertIsNone(clone._tables)
+        self.assertEqual(clone[3]['prompt'], dataset[3]['prompt'])
+
+
+if __name__ == "__main__":
+    unittest.main()
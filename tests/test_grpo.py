@@ -1,7 +1,9 @@
 import unittest
 import torch
 from grpo_trader.env.trading_env import TradingEnvironment
-from grpo_trader.train.loss import compute_grpo_loss
+from grpo_trader.train.loss import (
+    compute_grpo_loss, compute_token_log_probs, kl_penalty, linear_selective_log_probs, selective_log_probs
+)
 
 class MockModel(torch.nn.Module):
     def __init__(self, vocab_size=100):
@@ -14,6 +16,13 @@ class MockModel(torch.nn.Module):
         logits = torch.randn(batch_size, seq_len, 100)
         return type('obj', (object,), {'logits': logits})
 
+class OracleModel(torch.nn.Module):
+    """Puts all the probability mass at position t on the token found at t + 1."""
+    def forward(self, input_ids, attention_mask=None):
+        next_ids = torch.roll(input_ids, shifts=-1, dims=1)
+        logits = torch.nn.functional.one_hot(next_ids, 100).float() * 50
+        return type('obj', (object,), {'logits': logits})
+
 class TestGRPO(unittest.TestCase):
     def test_reward_calculation(self):
         env = TradingEnvironment()
@@ -56,5 +65,92 @@ class TestGRPO(unittest.TestCase):
         self.assertTrue(torch.is_tensor(policy_loss))
         self.assertTrue(torch.is_tensor(kl_loss))
 
+    def test_selective_log_probs(self):
+        logits = torch.randn(2, 7, 50, requires_grad=True)
+        labels = torch.randint(0, 50, (2, 7))
+        expected = torch.gather(torch.log_softmax(logits, dim=-1), 2, labels.unsqueeze(-1)).squeeze(-1)
+        weights = torch.randn(2, 7)
+        expected_grad, = torch.autograd.grad((expected * weights).sum(), logits)
+
+        # Chunk size that does not divide the sequence length
+        token_log_probs = selective_log_probs(logits, labels, chunk_size=3)
+        grad, = torch.autograd.grad((token_log_probs * weights).sum(), logits)
+
+        self.assertTrue(torch.allclose(token_log_probs, expected, atol=1e-5))
+        self.assertTrue(torch.allclose(grad, expected_grad, atol=1e-5))
+
+        # [Batch, Vocab] logits (one generation step) and half precision inputs
+        step = selective_log_probs(logits[:, 0], labels[:, 0])
+        self.assertTrue(torch.allclose(step, expected[:, 0], atol=1e-5))
+        bf16 = selective_log_probs(logits.detach().bfloat16(), labels)
+        self.assertEqual(bf16.dtype, torch.float32)
+        self.assertTrue(torch.allclose(bf16, expected, atol=0.1))
+
+    def test_linear_selective_log_probs(self):
+        hidden = torch.randn(11, 16, requires_grad=True)
+        weight = torch.randn(50, 16, requires_grad=True)
+        labels = torch.randint(0, 50, (11,))
+        expected = torch.gather(torch.log_softmax(hidden @ weight.T, dim=-1), 1, labels.unsqueeze(-1)).squeeze(-1)
+        weights = torch.randn(11)
+        expected_grads = torch.autograd.grad((expected * weights).sum(), (hidden, weight))
+
+        # Token and vocab chunks that do not divide the sizes
+        token_log_probs = linear_selective_log_probs(hidden, weight, labels, chunk_size=4, vocab_chunk_size=7)
+        grads = torch.autograd.grad((token_log_probs * weights).sum(), (hidden, weight))
+
+        self.assertTrue(torch.allclose(token_log_probs, expected, atol=1e-5))
+        self.assertTrue(all(torch.allclose(a, b, atol=1e-5) for a, b in zip(grads, expected_grads)))
+
+    def test_token_log_probs_are_shifted(self):
+        input_ids = torch.randint(0, 100, (2, 10))
+        attention_mask = torch.ones_like(input_ids)
+        attention_mask[0, :3] = 0
+
+        # Whole sequence: every token after the first is scored by the previous position
+        token_log_probs, token_mask, _ = compute_token_log_probs(
+            OracleModel(), {'input_ids': input_ids, 'attention_mask': attention_mask}
+        )
+        self.assertEqual(token_log_probs.shape, (2, 9))
+        self.assertTrue(torch.equal(token_mask, attention_mask[:, 1:]))
+        self.assertTrue(torch.allclose(token_log_probs, torch.zeros(2, 9), atol=1e-4))
+
+        # Completion only: just the last CompLen tokens
+        completion_mask = torch.tensor([[1, 1, 1, 0], [1, 1, 1, 1]])
+        token_log_probs, token_mask, _ = compute_token_log_probs(
+            OracleModel(), {'input_ids': input_ids, 'attention_mask': attention_mask, 'completion_mask': completion_mask}
+        )
+        self.assertEqual(token_log_probs.shape, (2, 4))
+        self.assertTrue(torch.equal(token_mask, completion_mask))
+        self.assertTrue(torch.allclose(token_log_probs, torch.zeros(2, 4), atol=1e-4))
+
+    def test_kl_estimators(self):
+        log_probs = torch.tensor([[-1.0, -2.0]])
+        ref_log_probs = torch.tensor([[-1.5, -2.0]])
+        log_ratio = torch.tensor([[-0.5, 0.0]])
+
+        self.assertTrue(torch.allclose(kl_penalty(log_probs, ref_log_probs, "k1"), -log_ratio))
+        self.assertTrue(torch.allclose(kl_penalty(log_probs, ref_log_probs, "k2"), 0.5 * log_ratio ** 2))
+        k3 = kl_penalty(log_probs, ref_log_probs, "k3")
+        self.assertTrue(torch.allclose(k3, torch.exp(log_ratio) - log_ratio - 1))
+        self.assertTrue(bool((k3 >= 0).all()))
+        with self.assertRaises(ValueError):
+            kl_penalty(log_probs, ref_log_probs, "k4")
+
+    def test_grpo_loss_with_cached_ref_log_probs(self):
+        model = MockModel()
+        input_ids = torch.randint(0, 100, (2, 10))
+        completion_mask = torch.ones(2, 4, dtype=torch.long)
+        completion_mask[1, 2:] = 0
+        inputs = {'input_ids': input_ids, 'attention_mask': torch.ones_like(input_ids), 'completion_mask': completion_mask}
+
+        loss, policy_loss, kl_loss = compute_grpo_loss(
+            model, inputs, torch.zeros(2), torch.randn(2), beta=0.1,
+            ref_log_probs=torch.zeros(2, 4), kl_estimator="k3"
+        )
+
+        self.assertEqual(kl_loss.dim(), 0)
+        self.assertGreater(kl_loss.item(), 0)
+        self.assertAlmostEqual(loss.item(), (policy_loss + 0.1 * kl_loss).item(), places=5)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from grpo_trader.data.cache import OHLCV_COLUMNS
+from grpo_trader.data.indicators import (
+    INDICATOR_COLUMNS, StreamingIndicators, add_indicators, add_indicators_pandas, compute_indicators, ewm_mean,
+    rolling_mean, rolling_std
+)
+from grpo_trader.data.sources import SyntheticSource
+
+
+class TestIndicators(unittest.TestCase):
+    def test_matches_pandas_chain(self):
+        bars = SyntheticSource(num_bars=5000, initial_price=50_000.0).fetch("BTC-USD", "1h")
+        result = add_indicators(bars)
+        expected = add_indicators_pandas(bars)
+        self.assertEqual(list(result.columns), list(expected.columns))
+        self.assertTrue(result.index.equals(expected.index))
+        pd.testing.assert_frame_equal(result, expected, rtol=1e-7)
+
+    def test_flat_prices_and_missing_values(self):
+        bars = SyntheticSource(num_bars=300).fetch("BTC-USD", "1h")
+        # 40 unchanged prices: RSI is 0 / 0 there, so pandas drops those rows too
+        bars.loc[100:139, ['open', 'high', 'low', 'close']] = 100.0
+        bars.loc[200, 'volume'] = np.nan
+        result = add_indicators(bars)
+        expected = add_indicators_pandas(bars)
+        self.assertTrue(result.index.equals(expected.index))
+        self.assertLess(len(result), 300 - 19 - 20)
+        pd.testing.assert_frame_equal(result, expected, rtol=1e-7)
+
+    def test_short_series(self):
+        bars = SyntheticSource(num_bars=15).fetch("BTC-USD", "1h")
+        self.assertEqual(len(add_indicators(bars)), 0)
+        self.assertEqual(list(add_indicators(bars).columns), list(bars.columns) + INDICATOR_COLUMNS)
+
+    def test_empty_series(self):
+        self.assertEqual(len(ewm_mean(np.empty(0), 12)), 0)
+        self.assertTrue(all(len(values) == 0 for values in compute_indicators([], []).values()))
+        result = add_indicators(pd.DataFrame(columns=OHLCV_COLUMNS))
+        self.assertEqual(len(result), 0)
+        self.assertEqual(list(result.columns), OHLCV_COLUMNS + INDICATOR_COLUMNS)
+
+    def test_rolling_std_is_exact_on_large_prices(self):
+        x = 50_000 + np.cumsum(np.random.default_rng(0).standard_normal(100_000))
+        exact = sliding_window_view(x, 20).std(axis=1, ddof=1)
+        result = rolling_std(x, 20, rolling_mean(x, 20), chunk_size=1000)
+        self.assertTrue(np.isnan(result[:19]).all())
+        np.testing.assert_allclose(result[19:], exact, rtol=1e-9)
+
+    def test_ewm_across_block_levels(self):
+        # Longer than 64 * 64: the carried states recurse twice
+        x = np.random.default_rng(1).standard_normal(64 * 64 * 3 + 17).cumsum()
+        for span in (9, 12, 26):
+            expected = pd.Series(x).ewm(span=span, adjust=False).mean().to_numpy()
+            np.testing.assert_allclose(ewm_mean(x, span), expected, rtol=1e-9, atol=1e-9)
+        np.testing.assert_allclose(ewm_mean(np.array([3.0]), 12), [3.0])
+
+    def test_streaming_matches_batch(self):
+        bars = SyntheticSource(num_bars=3000, initial_price=50_000.0).fetch("BTC-USD", "1m")
+        # Flat prices (RSI 0 / 0, then no losses) and a missing volume
+        bars.loc[1000:1039, 'close'] = bars.loc[999, 'close']
+        bars.loc[1040:1060, 'close'] = bars.loc[999, 'close'] + np.arange(1, 22)
+        bars.loc[2000, 'volume'] = np.nan
+        closes, volumes = bars['close'].to_numpy(), bars['volume'].to_numpy()
+        expected = compute_indicators(closes, volumes)
+
+        state = StreamingIndicators()
+        rows = [state.update(close, volume) for close, volume in zip(closes, volumes)]
+        for name in INDICATOR_COLUMNS:
+            streamed = np.array([row[name] for row in rows])
+            np.testing.assert_array_equal(np.isnan(streamed), np.isnan(expected[name]), err_msg=name)
+            np.testing.assert_allclose(streamed, expected[name], rtol=1e-9, atol=1e-9, err_msg=name)
+        self.assertTrue(np.isnan(expected['rsi'][1030]))
+        self.assertEqual(rows[1060]['rsi'], 100.0)
+
+        # Warming up on a history continues exactly where the batch left off
+        resumed = StreamingIndicators()
+        resumed.warm_up(closes[:-1], volumes[:-1])
+        self.assertEqual(resumed.update(closes[-1], volumes[-1]), rows[-1])
+
+
+if __name__ == "__main__":
+    unittest.main()
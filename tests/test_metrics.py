@@ -0,0 +1,40 @@
+import json
+import os
+import tempfile
+import unittest
+from grpo_trader.train.metrics import PHASES
+from test_trainer import BATCH, make_trainer
+
+
+class TestStepMetrics(unittest.TestCase):
+    def test_train_step_writes_phase_timings(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "metrics.jsonl")
+            trainer = make_trainer(metrics_path=path)
+            trainer.train_step(BATCH)
+            trainer.train_step(BATCH)
+            summary = trainer.metrics.summarize_epoch(epoch=1)
+            trainer.metrics.close()
+
+            with open(path) as f:
+                records = [json.loads(line) for line in f]
+
+        self.assertEqual([r.get('step') for r in records], [0, 1, None])
+        step = records[0]
+        self.assertEqual(set(step['phases']), set(PHASES))
+        phases = ('tokenize', 'generate', 'old_log_prob', 'reward', 'ref_log_prob', 'loss_forward', 'backward', 'optimizer')
+        for phase in phases:
+            self.assertGreater(step['phases'][phase], 0, phase)
+        self.assertEqual(step['phases']['all_reduce'], 0)
+        self.assertLessEqual(sum(step['phases'].values()), step['step_time'])
+        self.assertGreater(step['generated_tokens_per_sec'], 0)
+        self.assertTrue(0 <= step['padding_ratio'] < 1)
+        self.assertIsInstance(step['loss'], float)
+
+        self.assertEqual(records[-1], summary)
+        self.assertEqual(summary['steps'], 2)
+        self.assertEqual(summary['generated_tokens'], records[0]['generated_tokens'] + records[1]['generated_tokens'])
+
+
+if __name__ == '__main__':
+    unittest.main()
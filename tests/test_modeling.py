@@ -0,0 +1,48 @@
+import os
+import tempfile
+import unittest
+import torch
+from safetensors.torch import load_file, save_file
+from grpo_trader.model.modeling import AdapterDisabledReference, apply_lora, load_reference_model
+from tiny_lm import build_tiny_model
+
+
+class TestModeling(unittest.TestCase):
+    def test_load_reference_model_from_safetensors(self):
+        model = build_tiny_model()
+        input_ids = torch.randint(3, 100, (2, 9))
+        with tempfile.TemporaryDirectory() as tmp:
+            model.save_pretrained(tmp)
+            ref_model = load_reference_model(tmp)
+
+            self.assertTrue(all(not p.requires_grad for p in ref_model.parameters()))
+            with torch.no_grad():
+                self.assertTrue(torch.allclose(
+                    ref_model(input_ids=input_ids).logits, model(input_ids=input_ids).logits, atol=1e-5
+                ))
+
+            # A checkpoint without some of the weights is rejected
+            state_dict = load_file(os.path.join(tmp, "model.safetensors"))
+            state_dict.pop("model.norm.weight")
+            partial = os.path.join(tmp, "partial.safetensors")
+            save_file(state_dict, partial)
+            with self.assertRaises(ValueError):
+                load_reference_model(tmp, partial)
+
+    def test_adapter_disabled_reference(self):
+        model = apply_lora(build_tiny_model())
+        input_ids = torch.randint(3, 100, (2, 9))
+        with torch.no_grad():
+            base_logits = model(input_ids=input_ids).logits
+            # Move the adapter away from its no-op initialisation
+            for name, param in model.named_parameters():
+                if "lora_B" in name:
+                    param.add_(0.5)
+            self.assertFalse(torch.allclose(model(input_ids=input_ids).logits, base_logits))
+
+        ref_logits = AdapterDisabledReference(model)(input_ids=input_ids).logits
+        self.assertTrue(torch.allclose(ref_logits, base_logits, atol=1e-6))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import json
+import os
+import tempfile
+import unittest
+from grpo_trader.train.profiling import parse_step_range
+from test_trainer import BATCH, make_trainer
+
+
+class TestStepProfiler(unittest.TestCase):
+    def test_parse_step_range(self):
+        self.assertEqual(parse_step_range("10-12"), (10, 12))
+        self.assertEqual(parse_step_range("3"), (3, 3))
+        with self.assertRaises(ValueError):
+            parse_step_range("12-10")
+        with self.assertRaises(ValueError):
+            parse_step_range("a-b")
+
+    def test_profiles_only_the_configured_steps(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            trainer = make_trainer(profile_steps=(1, 1), profile_dir=tmp)
+            self.assertIsNone(trainer.profiler._profile)
+            trainer.train_step(BATCH)
+            # Capturing step 1
+            self.assertIsNotNone(trainer.profiler._profile)
+            trainer.train_step(BATCH)
+            # Exported as soon as the window is over
+            self.assertIsNone(trainer.profiler._profile)
+            self.assertTrue(os.path.exists(trainer.profiler.table_path))
+            trainer.train_step(BATCH)
+
+            with open(trainer.profiler.trace_path) as f:
+                events = json.load(f)['traceEvents']
+            names = {event.get('name') for event in events}
+            for phase in ('generate', 'loss_forward', 'backward', 'optimizer'):
+                self.assertIn(f"grpo/{phase}", names)
+            # A single step was captured
+            self.assertEqual(sum(1 for event in events if event.get('name') == 'grpo/optimizer'), 1)
+
+    def test_window_starts_from_the_resume_position(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            # Nothing is captured before the first step is known
+            trainer = make_trainer(profile_steps=(0, 1), profile_dir=tmp)
+            self.assertIsNone(trainer.profiler._profile)
+            # Resumed past the window: no trace at all
+            trainer.load_state_dict(dict(trainer.state_dict(), metrics_step=5))
+            trainer.train_step(BATCH)
+            self.assertIsNone(trainer.profiler._profile)
+            self.assertIsNone(trainer.profiler.trace_path)
+
+            trainer = make_trainer(profile_steps=(0, 0), profile_dir=tmp)
+            trainer.train_step(BATCH)
+            self.assertIsNone(trainer.profiler._profile)
+            with open(trainer.profiler.trace_path) as f:
+                events = json.load(f)['traceEvents']
+            self.assertEqual(sum(1 for event in events if event.get('name') == 'grpo/optimizer'), 1)
+            self.assertIn('grpo/generate', {event.get('name') for event in events})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import json
+import os
+import tempfile
+import unittest
+import torch
+from grpo_trader.data.sampler import PrioritizedSampler
+from grpo_trader.train.checkpoint import AsyncCheckpointer, load_checkpoint
+from test_trainer import BATCH, ScriptedEnv, make_trainer
+
+
+class TestPrioritizedSampler(unittest.TestCase):
+    def test_sampling_follows_priorities_with_floor(self):
+        sampler = PrioritizedSampler(range(4), floor=0.2, decay=0.0)
+        # Prompts 0-2 only produce all-equal groups, prompt 3 informative ones
+        rewards = torch.tensor([[1.0, 1.0], [0.0, 0.0], [0.5, 0.5], [0.0, 2.0]])
+        advantages = torch.tensor([[0.0, 0.0], [0.0, 0.0], [0.0, 0.0], [-0.7, 0.7]])
+        sampler.update([0, 1, 2, 3], rewards, advantages)
+
+        probs = sampler.probabilities()
+        self.assertAlmostEqual(float(probs.sum()), 1.0, places=6)
+        # Zero-signal prompts keep the floor share
+        self.assertTrue(torch.allclose(probs[:3], torch.full((3,), 0.2 / 4, dtype=probs.dtype)))
+        self.assertAlmostEqual(float(probs[3]), 0.8 + 0.2 / 4, places=6)
+
+        sampler.set_position(epoch=0)
+        draws = torch.tensor([index for _ in range(200) for index in sampler])
+        self.assertGreater(float((draws == 3).float().mean()), 0.7)
+        self.assertTrue(bool((draws != 3).any()))
+
+    def test_priority_decays_towards_recent_signal(self):
+        sampler = PrioritizedSampler(range(2), decay=0.5, initial_priority=1.0)
+        flat = torch.zeros(1, 3)
+        sampler.update([0], flat, flat)
+        self.assertAlmostEqual(float(sampler.priorities[0]), 0.5)
+        sampler.update([0], flat, flat)
+        self.assertAlmostEqual(float(sampler.priorities[0]), 0.25)
+        # Unscored prompts keep the initial priority
+        self.assertAlmostEqual(float(sampler.priorities[1]), 1.0)
+        self.assertEqual(sampler.num_updates.tolist(), [2, 0])
+
+    def test_state_round_trip_resumes_draws(self):
+        sampler = PrioritizedSampler(range(10), num_replicas=2, seed=1)
+        sampler.update([2, 5], torch.tensor([[0.0, 3.0], [1.0, 1.0]]), torch.tensor([[-0.7, 0.7], [0.0, 0.0]]))
+        self.assertEqual(len(sampler), 5)
+        state = sampler.state_dict()
+        expected = list(sampler)
+
+        resumed = PrioritizedSampler(range(10), num_replicas=2, seed=7)
+        resumed.load_state_dict(state)
+        resumed.set_position(epoch=0, start_index=2)
+        self.assertEqual(len(resumed), 3)
+        self.assertEqual(list(resumed), expected[:3])
+        self.assertTrue(torch.equal(resumed.priorities, sampler.priorities))
+
+    def test_draws_match_probabilities(self):
+        # Not a power of two, with zero priorities in both halves of the tree
+        sampler = PrioritizedSampler(range(37), floor=0.3, decay=0.0)
+        signal = torch.rand(37, generator=torch.Generator().manual_seed(0))
+        signal[[0, 5, 36]] = 0.0
+        rewards = torch.stack([torch.zeros(37), signal * 2 ** 0.5], dim=1)
+        sampler.update(range(37), rewards, torch.zeros(37, 2))
+        torch.testing.assert_close(sampler.priorities, signal.double())
+
+        counts = torch.zeros(37)
+        for _ in range(200):
+            sampler.set_position(epoch=0)
+            for index in sampler:
+                counts[index] += 1
+        frequencies = counts.double() / counts.sum()
+        self.assertLess(float((frequencies - sampler.probabilities()).abs().max()), 0.01)
+
+    def test_large_dataset_draws(self):
+        # O(log N) per draw and per update: a million prompts are no slower to sample from
+        sampler = PrioritizedSampler(range(1_000_000), decay=0.0, initial_priority=0.0)
+        sampler.update([123_456], torch.tensor([[0.0, 1e6]]), torch.zeros(1, 2))
+        draws = [index for index, _ in zip(sampler, range(2000))]
+        self.assertGreater(draws.count(123_456), 1500)
+
+    def test_state_round_trip_through_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            sampler = PrioritizedSampler(range(10), seed=1, decay=0.0)
+            trainer = make_trainer(prompt_sampler=sampler)
+            trainer.train_step(dict(BATCH, index=[4, 7]))
+            checkpointer = AsyncCheckpointer(tmp)
+            checkpointer.save(1, trainer.model, trainer.optimizer, {'trainer': trainer.state_dict()},
+                              sampler_state=sampler.state_dict())
+            checkpointer.wait()
+            expected = list(sampler)
+
+            # The priorities are stored as tensors, not in the JSON trainer state
+            with open(os.path.join(tmp, "checkpoint-1", "trainer_state.json")) as f:
+                self.assertNotIn('sampler', json.load(f))
+            resumed = PrioritizedSampler(range(10), seed=5)
+            state = load_checkpoint(os.path.join(tmp, "checkpoint-1"), make_trainer().model)
+            resumed.load_state_dict(state['sampler'])
+            self.assertTrue(torch.equal(resumed.priorities, sampler.priorities))
+            self.assertEqual(list(resumed), expected)
+
+    def test_trainer_reports_groups_before_dynamic_sampling(self):
+        sampler = PrioritizedSampler(range(10), decay=0.0)
+        trainer = make_trainer(dynamic_sampling=True, prompt_sampler=sampler)
+        trainer.env = ScriptedEnv()
+        # The second prompt's group (falling price) has all-equal rewards and is dropped
+        trainer.train_step(dict(BATCH, index=[4, 7]))
+
+        self.assertEqual(sampler.num_updates[[4, 7]].tolist(), [1, 1])
+        self.assertGreater(float(sampler.priorities[4]), 1.0)
+        self.assertEqual(float(sampler.priorities[7]), 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
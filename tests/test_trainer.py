@@ -0,0 +1,393 @@
+import unittest
+import torch
+from grpo_trader.env.trading_env import TradingEnvironment
+from grpo_trader.model.modeling import AdapterDisabledReference, apply_lora
+from transformers import LogitsProcessorList
+from grpo_trader.train.grpo_trainer import AnswerStopCriteria, GRPOTrainer, SampledTokenLogProbs
+from grpo_trader.train.loss import compute_grpo_loss, compute_token_log_probs, selective_log_probs
+from tiny_lm import build_tiny_model, build_tiny_tokenizer
+
+
+def make_trainer(**kwargs):
+    model = build_tiny_model()
+    tokenizer = build_tiny_tokenizer()
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-3)
+    kwargs.setdefault("max_new_tokens", 8)
+    return GRPOTrainer(model, tokenizer, TradingEnvironment(), optimizer, group_size=3, **kwargs)
+
+
+BATCH = {
+    'prompt': ["Price up. Decide:", [{"role": "user", "content": "Longer prompt about the market. Decide:"}]],
+    'current_price': [100.0, 200.0],
+    'next_price': [110.0, 190.0]
+}
+
+
+class ScriptedEnv:
+    """Rewards 0, 1, 2, ... within a group when the price rises, all zeros otherwise."""
+    def calculate_reward(self, completions, current_price, next_price):
+        if next_price > current_price:
+            return [float(i) for i in range(len(completions))]
+        return [0.0] * len(completions)
+
+
+class TestGRPOTrainer(unittest.TestCase):
+    def test_batched_rollout_shapes(self):
+        trainer = make_trainer()
+        rollout = trainer.generate_rollouts(BATCH['prompt'], BATCH['current_price'], BATCH['next_price'])
+
+        n = len(BATCH['prompt']) * trainer.group_size
+        self.assertEqual(rollout['prompt_ids'].shape[0], n)
+        self.assertEqual(rollout['completion_ids'].shape[0], n)
+        self.assertLessEqual(rollout['completion_ids'].shape[1], trainer.max_new_tokens)
+        self.assertEqual(rollout['rewards'].shape, (n,))
+        # Prompts are left padded: the last prompt column is always a real token
+        self.assertTrue(bool(rollout['prompt_mask'][:, -1].all()))
+        # The G samples of a prompt share the same prompt tokens
+        self.assertTrue(torch.equal(rollout['prompt_ids'][0], rollout['prompt_ids'][2]))
+        # Advantages are normalised within each group
+        group_sums = rollout['advantages'].view(len(BATCH['prompt']), -1).sum(dim=1)
+        self.assertTrue(torch.allclose(group_sums, torch.zeros_like(group_sums), atol=1e-5))
+
+    def test_token_budget_chunks(self):
+        trainer = make_trainer(rollout_token_budget=100)
+        # Each group costs 3 * (len + 8) tokens, so only groups of short prompts can share a call
+        self.assertEqual(trainer._chunk_prompts([10, 10, 30]), [[0], [1], [2]])
+        trainer.rollout_token_budget = 200
+        self.assertEqual(trainer._chunk_prompts([10, 10, 30]), [[0, 1], [2]])
+        trainer.rollout_token_budget = None
+        self.assertEqual(trainer._chunk_prompts([10, 10, 30]), [[0, 1, 2]])
+
+        trainer.rollout_token_budget = 1
+        rollout = trainer.generate_rollouts(BATCH['prompt'], BATCH['current_price'], BATCH['next_price'])
+        self.assertEqual(rollout['completion_ids'].shape[0], len(BATCH['prompt']) * trainer.group_size)
+
+    def test_sampling_log_probs_match_forward(self):
+        trainer = make_trainer()
+        rollout = trainer.generate_rollouts(BATCH['prompt'], BATCH['current_price'], BATCH['next_price'])
+
+        input_ids = torch.cat([rollout['prompt_ids'], rollout['completion_ids']], dim=1)
+        attention_mask = torch.cat([rollout['prompt_mask'], rollout['completion_mask']], dim=1)
+        completion_len = rollout['completion_ids'].shape[1]
+        with torch.no_grad():
+            position_ids = (attention_mask.cumsum(dim=1) - 1).clamp(min=0)
+            logits = trainer.model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids).logits
+        log_probs = torch.log_softmax(logits[:, -completion_len - 1:-1], dim=-1)
+        expected = torch.gather(log_probs, 2, rollout['completion_ids'].unsqueeze(-1)).squeeze(-1)
+        expected = expected * rollout['completion_mask']
+
+        self.assertTrue(torch.allclose(rollout['old_log_probs'], expected, atol=1e-4))
+
+    def test_logits_only_for_completion_positions(self):
+        trainer = make_trainer(share_prompt_cache=False)
+        rollout = trainer.generate_rollouts(BATCH['prompt'], BATCH['current_price'], BATCH['next_price'])
+        inputs = trainer._model_inputs(rollout)
+        full_inputs = {k: v for k, v in inputs.items() if k != 'logits_to_keep'}
+
+        with torch.no_grad():
+            kept, _, kept_logits = compute_token_log_probs(trainer.model, inputs)
+            full, _, _ = compute_token_log_probs(trainer.model, full_inputs)
+
+        self.assertEqual(kept_logits.shape[1], rollout['completion_ids'].shape[1])
+        self.assertTrue(torch.allclose(kept, full, atol=1e-5))
+
+    def test_shared_prompt_cache_scoring(self):
+        trainer = make_trainer()
+        rollout = trainer.generate_rollouts(BATCH['prompt'], BATCH['current_price'], BATCH['next_price'])
+        shared_inputs = trainer._model_inputs(rollout)
+        self.assertEqual(shared_inputs['prompt_ids'].shape[0], len(BATCH['prompt']))
+        trainer.share_prompt_cache = False
+        full_inputs = trainer._model_inputs(rollout)
+
+        weights = torch.randn_like(rollout['old_log_probs'])
+        shared, _, _ = compute_token_log_probs(trainer.model, shared_inputs)
+        shared_grads = torch.autograd.grad((shared * weights).sum(), list(trainer.model.parameters()))
+        full, _, _ = compute_token_log_probs(trainer.model, full_inputs)
+        full_grads = torch.autograd.grad((full * weights).sum(), list(trainer.model.parameters()))
+
+        self.assertTrue(torch.allclose(shared, full, atol=1e-5))
+        self.assertTrue(all(torch.allclose(a, b, atol=1e-5) for a, b in zip(shared_grads, full_grads)))
+
+    def test_packed_sequence_scoring(self):
+        trainer = make_trainer(share_prompt_cache=False)
+        rollout = trainer.generate_rollouts(BATCH['prompt'], BATCH['current_price'], BATCH['next_price'])
+        padded_inputs = trainer._model_inputs(rollout)
+        trainer.pack_sequences = True
+        packed_inputs = trainer._model_inputs(rollout)
+
+        # No padding left: one row holding exactly the real prompt and completion tokens
+        num_tokens = int(rollout['prompt_mask'].sum() + rollout['completion_mask'].sum())
+        self.assertEqual(packed_inputs['input_ids'].shape, (1, num_tokens))
+        self.assertNotIn('attention_mask', packed_inputs)
+        self.assertEqual(packed_inputs['cu_seqlens'][-1].item(), num_tokens)
+
+        weights = torch.randn_like(rollout['old_log_probs'])
+        packed, packed_mask, packed_logits = compute_token_log_probs(trainer.model, packed_inputs)
+        packed_grads = torch.autograd.grad((packed * weights).sum(), list(trainer.model.parameters()))
+        padded, _, _ = compute_token_log_probs(trainer.model, padded_inputs)
+        padded_grads = torch.autograd.grad((padded * weights).sum(), list(trainer.model.parameters()))
+
+        self.assertEqual(packed_logits.shape[1], int(rollout['completion_mask'].sum()))
+        self.assertTrue(torch.equal(packed_mask, rollout['completion_mask']))
+        self.assertTrue(torch.allclose(packed, padded, atol=1e-5))
+        self.assertTrue(all(torch.allclose(a, b, atol=1e-5) for a, b in zip(packed_grads, padded_grads)))
+
+        trainer = make_trainer(pack_sequences=True, kl_estimator="full")
+        self.assertIsInstance(trainer.train_step(BATCH), float)
+
+    def test_fused_loss_matches_logits_loss(self):
+        trainer = make_trainer(beta=0.5)
+        rollout = trainer.generate_rollouts(BATCH['prompt'], BATCH['current_price'], BATCH['next_price'])
+        rollout['old_log_probs'] = rollout['old_log_probs'] - 0.05 * rollout['completion_mask']
+        parameters = list(trainer.model.parameters())
+
+        for pack in (False, True):
+            trainer.pack_sequences = pack
+            inputs = trainer._model_inputs(rollout)
+            args = (trainer.model, inputs, rollout['old_log_probs'].sum(dim=1), rollout['advantages'])
+            kwargs = {'beta': 0.5, 'ref_log_probs': rollout['ref_log_probs'] - 0.1 * rollout['completion_mask']}
+            loss, _, kl = compute_grpo_loss(*args, **kwargs)
+            grads = torch.autograd.grad(loss, parameters)
+            fused_loss, _, fused_kl = compute_grpo_loss(*args, fused=True, **kwargs)
+            fused_grads = torch.autograd.grad(fused_loss, parameters)
+
+            self.assertAlmostEqual(loss.item(), fused_loss.item(), places=5)
+            self.assertAlmostEqual(kl.item(), fused_kl.item(), places=5)
+            self.assertTrue(all(torch.allclose(a, b, atol=1e-5) for a, b in zip(grads, fused_grads)))
+
+        with self.assertRaises(ValueError):
+            make_trainer(fused_loss=True, kl_estimator="full")
+        self.assertIsInstance(make_trainer(fused_loss=True).train_step(BATCH), float)
+
+    def test_ref_log_probs_cached_in_rollout(self):
+        trainer = make_trainer()
+        rollout = trainer.generate_rollouts(BATCH['prompt'], BATCH['current_price'], BATCH['next_price'])
+        # The reference starts as a copy of the policy
+        self.assertEqual(rollout['ref_log_probs'].shape, rollout['old_log_probs'].shape)
+        self.assertTrue(torch.allclose(rollout['ref_log_probs'], rollout['old_log_probs'], atol=1e-4))
+
+        trainer = make_trainer(kl_estimator="full")
+        rollout = trainer.generate_rollouts(BATCH['prompt'], BATCH['current_price'], BATCH['next_price'])
+        self.assertNotIn('ref_log_probs', rollout)
+        self.assertIsInstance(trainer.train_step(BATCH), float)
+
+    def test_lora_reference_without_copy(self):
+        model = apply_lora(build_tiny_model())
+        optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=1e-2)
+        trainer = GRPOTrainer(model, build_tiny_tokenizer(), TradingEnvironment(), optimizer, group_size=3, max_new_tokens=8)
+        self.assertIsInstance(trainer.ref_model, AdapterDisabledReference)
+
+        base = {n: p.detach().clone() for n, p in model.named_parameters() if not p.requires_grad}
+        trainer.train_step(BATCH)
+        trainer.train_step(BATCH)
+        # Only the adapter is trained; the shared base (the reference) is untouched
+        self.assertTrue(all(torch.equal(base[n], p) for n, p in model.named_parameters() if n in base))
+
+    def test_loss_ratio_starts_at_one(self):
+        trainer = make_trainer()
+        rollout = trainer.generate_rollouts(BATCH['prompt'], BATCH['current_price'], BATCH['next_price'])
+        attention_mask = torch.cat([rollout['prompt_mask'], rollout['completion_mask']], dim=1)
+        inputs = {
+            'input_ids': torch.cat([rollout['prompt_ids'], rollout['completion_ids']], dim=1),
+            'attention_mask': attention_mask,
+            'position_ids': (attention_mask.cumsum(dim=1) - 1).clamp(min=0),
+            'completion_mask': rollout['completion_mask']
+        }
+        advantages = torch.ones_like(rollout['advantages'])
+
+        _, policy_loss, _ = compute_grpo_loss(trainer.model, inputs, rollout['old_log_probs'].sum(dim=1), advantages)
+
+        # With unit advantages the clipped objective is -mean(ratio)
+        self.assertAlmostEqual(policy_loss.item(), -1.0, places=3)
+
+    def test_sampled_log_probs_from_raw_logits(self):
+        model = build_tiny_model()
+        tokenizer = build_tiny_tokenizer()
+        # A default processor generate applies before ours: the log probs must ignore it
+        model.generation_config.repetition_penalty = 1.5
+        inputs = tokenizer(["Price up. Decide:", "Down:"], return_tensors="pt", padding=True, padding_side="left")
+
+        with SampledTokenLogProbs(model) as old_log_probs:
+            outputs = model.generate(
+                **inputs, max_new_tokens=6, do_sample=True, pad_token_id=tokenizer.pad_token_id,
+                logits_processor=LogitsProcessorList([old_log_probs]),
+                return_dict_in_generate=True, output_logits=True
+            )
+        completion_ids = outputs.sequences[:, inputs['input_ids'].shape[1]:]
+        expected = torch.stack(
+            [selective_log_probs(logits, completion_ids[:, t]) for t, logits in enumerate(outputs.logits)], dim=1
+        )
+        torch.testing.assert_close(old_log_probs.result(outputs.sequences), expected)
+        # The hook is removed with the context
+        self.assertEqual(len(model._forward_hooks), 0)
+
+    def test_answer_stop_criteria(self):
+        tokenizer = build_tiny_tokenizer()
+        criteria = AnswerStopCriteria(tokenizer)
+        prompt = tokenizer(["go:", "go:"], return_tensors="pt")['input_ids']
+        completions = tokenizer(
+            ["<answer>BUY</answer>xyz", "<answer>SELL</answ"], return_tensors="pt", padding=True
+        )['input_ids']
+        criteria.reset(2, prompt.shape[1], "cpu")
+
+        # Feed the completions one token at a time, like generate does
+        for t in range(1, completions.shape[1] + 1):
+            is_done = criteria(torch.cat([prompt, completions[:, :t]], dim=1), None)
+        self.assertEqual(is_done.tolist(), [True, False])
+        self.assertEqual(criteria.stop_lengths.tolist(), [len("<answer>BUY</answer>"), -1])
+
+        trainer = make_trainer()
+        mask = trainer._completion_mask(completions, torch.tensor([20, completions.shape[1]]))
+        self.assertEqual(mask.sum(dim=1).tolist(), [20, completions.shape[1]])
+
+    def test_decode_steps_saved_by_answer_stop(self):
+        class StopAfter(AnswerStopCriteria):
+            """Stops the even rows after 2 generated tokens and the odd ones after 3."""
+            def __call__(self, input_ids, scores, **kwargs):
+                generated = input_ids.shape[1] - self.prompt_width
+                rows = torch.arange(input_ids.shape[0])
+                newly_done = (generated >= 2 + rows % 2) & (self.stop_lengths < 0)
+                self.stop_lengths[newly_done] = generated
+                return self.stop_lengths >= 0
+
+        trainer = make_trainer(max_new_tokens=8)
+        trainer.stop_criteria = StopAfter(trainer.tokenizer)
+        rollout = trainer.generate_rollouts(BATCH['prompt'], BATCH['current_price'], BATCH['next_price'])
+
+        # The even rows finish early but keep decoding until the odd rows are done too
+        self.assertEqual(rollout['completion_ids'].shape[1], 3)
+        self.assertEqual(trainer.decode_steps_saved, 8 - 3)
+
+        class StopOrEnd(AnswerStopCriteria):
+            """The even rows stop at the tag after 2 tokens, the odd ones end (as at EOS) after 3."""
+            def __call__(self, input_ids, scores, **kwargs):
+                generated = input_ids.shape[1] - self.prompt_width
+                rows = torch.arange(input_ids.shape[0])
+                newly_done = (generated >= 2) & (rows % 2 == 0) & (self.stop_lengths < 0)
+                self.stop_lengths[newly_done] = generated
+                return (self.stop_lengths >= 0) | ((generated >= 3) & (rows % 2 == 1))
+
+        trainer = make_trainer(max_new_tokens=8)
+        trainer.stop_criteria = StopOrEnd(trainer.tokenizer)
+        rollout = trainer.generate_rollouts(BATCH['prompt'], BATCH['current_price'], BATCH['next_price'])
+        # generate ended at the odd rows' end, not at a tag: the tag stop saved nothing
+        self.assertEqual(rollout['completion_ids'].shape[1], 3)
+        self.assertEqual(trainer.decode_steps_saved, 0)
+
+    def test_multiple_epochs_over_rollout(self):
+        trainer = make_trainer(ppo_epochs=2, mini_batch_groups=1)
+        steps = []
+        step = trainer.optimizer.step
+        trainer.optimizer.step = lambda: steps.append(1) or step()
+
+        loss = trainer.train_step(BATCH)
+
+        self.assertIsInstance(loss, float)
+        # 2 epochs x 2 mini-batches of one group each
+        self.assertEqual(len(steps), 4)
+
+    def test_micro_batch_gradient_accumulation(self):
+        trainer = make_trainer(beta=0.5)
+        rollout = trainer.generate_rollouts(BATCH['prompt'], BATCH['current_price'], BATCH['next_price'])
+        # Make the ratio and the KL non trivial
+        rollout['old_log_probs'] = rollout['old_log_probs'] - 0.05 * rollout['completion_mask']
+        rollout['ref_log_probs'] = rollout['ref_log_probs'] - 0.1 * rollout['completion_mask']
+
+        full_loss = trainer.accumulate_gradients(rollout)
+        full_grads = [p.grad.clone() for p in trainer.model.parameters()]
+        trainer.optimizer.zero_grad()
+
+        trainer.max_tokens_per_micro_batch = 1
+        micro_loss = trainer.accumulate_gradients(rollout)
+        micro_grads = [p.grad.clone() for p in trainer.model.parameters()]
+
+        self.assertAlmostEqual(full_loss, micro_loss, places=5)
+        self.assertTrue(all(torch.allclose(a, b, atol=1e-6) for a, b in zip(full_grads, micro_grads)))
+
+    def test_dynamic_sampling_drops_zero_variance_groups(self):
+        trainer = make_trainer(dynamic_sampling=True)
+        trainer.env = ScriptedEnv()
+        rollout = trainer.generate_rollouts(BATCH['prompt'], BATCH['current_price'], BATCH['next_price'])
+
+        # Only the first prompt (price up) has reward variance
+        self.assertEqual(rollout['advantages'].shape[0], trainer.group_size)
+        self.assertEqual(rollout['ref_log_probs'].shape, rollout['completion_ids'].shape)
+        self.assertEqual(rollout['rewards'].tolist(), [0.0, 1.0, 2.0])
+        self.assertAlmostEqual(trainer.skipped_group_fraction, 0.5)
+
+        # A batch with nothing to learn from skips the update entirely
+        flat = {'prompt': BATCH['prompt'][1:], 'current_price': [200.0], 'next_price': [190.0]}
+        self.assertIsNone(trainer.train_step(flat))
+
+        # Refill the dropped group from the next batches
+        refills = iter([flat, BATCH])
+        trainer.max_refill_batches = 2
+        trainer.train_step(BATCH, refill_batches=refills)
+        self.assertEqual(len(trainer.buffer), len(BATCH['prompt']))
+        self.assertIsNone(next(refills, None))
+
+    def test_gradient_checkpointing_gradients(self):
+        trainer = make_trainer()
+        checkpointed = make_trainer(gradient_checkpointing=True)
+        rollout = trainer.generate_rollouts(BATCH['prompt'], BATCH['current_price'], BATCH['next_price'])
+        # Falls back from the shared prompt cache, which checkpointed layers would drop
+        self.assertIn('input_ids', checkpointed._model_inputs(rollout))
+
+        trainer.accumulate_gradients(rollout)
+        checkpointed.accumulate_gradients(rollout)
+
+        self.assertFalse(checkpointed.model.training)
+        pairs = zip(trainer.model.parameters(), checkpointed.model.parameters())
+        self.assertTrue(all(torch.allclose(a.grad, b.grad, atol=1e-5) for a, b in pairs))
+
+    def test_gradient_checkpointing_train_step(self):
+        for kwargs in ({}, {'pack_sequences': True}, {'fused_loss': True},
+                       {'master_weights_dtype': torch.bfloat16}):
+            with self.subTest(**{k: str(v) for k, v in kwargs.items()}):
+                trainer = make_trainer(gradient_checkpointing=True, **kwargs)
+                # A freshly built model is in training mode (from_pretrained returns one in eval mode)
+                self.assertFalse(trainer.compute_model.training)
+                loss = trainer.train_step(BATCH)
+                self.assertTrue(torch.isfinite(torch.tensor(loss)))
+                self.assertFalse(trainer.compute_model.training)
+
+        model = apply_lora(build_tiny_model())
+        optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=1e-2)
+        trainer = GRPOTrainer(
+            model, build_tiny_tokenizer(), TradingEnvironment(), optimizer, group_size=3, max_new_tokens=8,
+            gradient_checkpointing=True
+        )
+        self.assertTrue(torch.isfinite(torch.tensor(trainer.train_step(BATCH))))
+
+    def test_bf16_autocast(self):
+        for fused in (False, True):
+            trainer = make_trainer(autocast_dtype=torch.bfloat16, fused_loss=fused)
+            loss = trainer.train_step(BATCH)
+            self.assertTrue(torch.isfinite(torch.tensor(loss)))
+
+    def test_fp32_master_weights(self):
+        trainer = make_trainer(master_weights_dtype=torch.bfloat16)
+        self.assertEqual(next(trainer.compute_model.parameters()).dtype, torch.bfloat16)
+        before = [p.detach().clone() for p in trainer.model.parameters()]
+
+        trainer.train_step(BATCH)
+
+        # The optimizer updated the fp32 master weights, the compute copy holds them in bf16
+        masters = list(trainer.model.parameters())
+        self.assertTrue(all(p.dtype == torch.float32 for p in masters))
+        self.assertTrue(any(not torch.equal(b, p) for b, p in zip(before, masters)))
+        pairs = zip(masters, trainer.compute_model.parameters())
+        self.assertTrue(all(torch.equal(m.detach().bfloat16(), c) for m, c in pairs))
+        self.assertTrue(all(p.grad is None for p in trainer.compute_model.parameters()))
+
+    def test_train_step(self):
+        trainer = make_trainer()
+        before = [p.detach().clone() for p in trainer.model.parameters()]
+        loss = trainer.train_step(BATCH)
+        self.assertIsInstance(loss, float)
+        changed = any(not torch.equal(b, p) for b, p in zip(before, trainer.model.parameters()))
+        self.assertTrue(changed)
+
+
+if __name__ == '__main__':
+    unittest.main()